@@ -17,7 +17,7 @@ from requirement_blocks import (
     STAT_MINOR,
     DATS_MINOR
 )
-from fetch_data import fetch_course_data
+from fetch_data import load_course_data
 from solver import generate_schedule
 # from pdf_parse import convert_to_images, write_output_txt, get_completed_courses
 
@@ -164,7 +164,7 @@ completed_courses = [
 # outfile = write_output_txt(total_images=total_images, img_file_path=SAVE_TO)
 # completed_courses = get_completed_courses(outfile)
 
-all_courses = fetch_course_data()
+all_courses = load_course_data()
 
 # assemble list of completed courses and their respective semesters
 all_course_ids = set(course_info["id"] for course_info in all_courses)
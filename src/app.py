@@ -3,10 +3,14 @@ import os
 from werkzeug.utils import secure_filename  
 import json
 
-from typing import Optional
-from cp2_types import CourseRequest, CompletedCourse, Index, BaseRequirement, RequirementBlock, ScheduleParams, Schedule
-from fetch_data import fetch_course_data
+from threading import Lock
+from typing import NamedTuple, Optional
+from catalog import CatalogIndex
+from cp2_types import CourseInfo, Id, CourseRequest, CompletedCourse, Index, BaseRequirement, RequirementBlock, ScheduleParams, Schedule
+from fetch_data import load_course_data
 from solver import generate_schedule
+from solver_pool import SolverPool
+from schedule_cache import ScheduleCache
 from pdf_parse import convert_to_images, write_output_txt, get_completed_courses
 
 app = Flask(__name__)
@@ -18,26 +22,56 @@ app.config['SESSION_TYPE'] = 'filesystem'
 # constant for uploading files
 SAVE_TO = "./img/"
 
-# fetch courses initially
-all_courses_info = fetch_course_data()
-all_course_ids = [course_info["id"] for course_info in all_courses_info]
-
-
-# add 3 free elective wild character courses (since each course can only be taken once)
-for i in range(1, 4):
-    all_courses_info.append({
-        "id": f'FREE-{i}',
-        "title": "Free Elective 1",
-        "semester": "2022C",
-        "prerequisites": [],
-        "course_quality": None,
-        "instructor_quality": None,
-        "difficulty": None,
-        "work_required": None,
-        "crosslistings": [],
-        "requirements": [],
-        "sections": []
-    })
+class AppState(NamedTuple):
+    all_courses_info: list[CourseInfo]
+    all_course_ids: list[Id]
+    all_courses_index: CatalogIndex
+    solver_pool: SolverPool
+    schedule_cache: ScheduleCache
+
+
+# the catalog, solver pool and schedule cache are created on the first request instead of at import:
+# the pool's processes import this module again (as `__mp_main__`), and must not load the catalog or start
+# pools of their own
+app_state: Optional[AppState] = None
+app_state_lock = Lock()
+
+
+def get_app_state() -> AppState:
+    global app_state
+    with app_state_lock:
+        if app_state is None:
+            app_state = load_app_state()
+        return app_state
+
+
+def load_app_state() -> AppState:
+    # fetch courses
+    all_courses_info = list(load_course_data())
+    all_course_ids = [course_info["id"] for course_info in all_courses_info]
+
+    # add 3 free elective wild character courses (since each course can only be taken once)
+    for i in range(1, 4):
+        all_courses_info.append({
+            "id": f'FREE-{i}',
+            "title": "Free Elective 1",
+            "semester": "2022C",
+            "prerequisites": [],
+            "course_quality": None,
+            "instructor_quality": None,
+            "difficulty": None,
+            "work_required": None,
+            "crosslistings": [],
+            "requirements": [],
+            "sections": []
+        })
+
+    # solve schedules in a pool of processes that have the catalog preloaded,
+    # which also indexes the catalog once so that we don't have to scan it on every request
+    solver_pool = SolverPool(all_courses_info)
+    # identical requests (e.g. the same program with an empty transcript) are answered from this cache
+    schedule_cache = ScheduleCache()
+    return AppState(all_courses_info, all_course_ids, solver_pool.catalog_index, solver_pool, schedule_cache)
 
 # all requirement blocks
 CIS_BSE: RequirementBlock = [
@@ -132,6 +166,8 @@ MAX_DOUBLE_COUNTING: dict[tuple[Index, Index], Optional[int]] = {
 }
 
 MIN_COURSES_PER_SEMESTER = 4
+# return the best schedule found within this many seconds
+SOLVER_TIME_LIMIT = 30
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -144,7 +180,7 @@ def home():
 
 @app.route('/all-courses', methods=['GET'])
 def all_courses():
-    return jsonify(all_course_ids)
+    return jsonify(get_app_state().all_course_ids)
 
 
 @app.route('/compute-schedule', methods=['GET', 'POST'])
@@ -187,7 +223,15 @@ def compute_schedule():
         max_double_counting
     )
 
-    course_schedule = generate_schedule(all_courses, course_requests, completed, params, verbose=True)
+    state = get_app_state()
+    try:
+        course_schedule = generate_schedule(
+            all_courses, course_requests, completed, params, verbose=True, catalog_index=state.all_courses_index,
+            time_limit=SOLVER_TIME_LIMIT, pool=state.solver_pool, cache=state.schedule_cache
+        )
+    except TimeoutError:
+        # the pool was too busy to start solving within the time limit
+        course_schedule = None
 
     # assign sessions variable
     if course_schedule is not None:
@@ -218,6 +262,8 @@ def get_requirement_blocks(is_submatriculating):
 
 
 def get_solver_params(requested_courses, completed_courses):
+    all_course_ids = get_app_state().all_course_ids
+    all_courses_index = get_app_state().all_courses_index
     # convert completed courses into proper class
     completed: list[CompletedCourse] = [CompletedCourse(element[0], element[1]) 
                                         for element in completed_courses
@@ -230,13 +276,13 @@ def get_solver_params(requested_courses, completed_courses):
     request_ids = set(course_id for course_id, _ in course_requests)
 
     # get all_courses
+    selected_course_ids = (completed_course_ids | request_ids) & all_courses_index.all_course_ids
+    for major in ALL_REQUIREMENT_BLOCKS:
+        for req in major:
+            selected_course_ids |= all_courses_index.courses_satisfying(req)
     all_courses = [
-        course for course in all_courses_info
-        if course['id'] in completed_course_ids.union(request_ids) or any(
-            req.satisfied_by_course(course)
-            for major in ALL_REQUIREMENT_BLOCKS
-            for req in major
-        )
+        all_courses_index.course_id_to_course[course_id]
+        for course_id in all_courses_index.sorted_by_position(selected_course_ids)
     ]
     return completed, course_requests, all_courses
 
@@ -0,0 +1,770 @@
+# Benchmarks for the solver and data pipeline.
+# Run from the root directory with `python src/benchmark.py <benchmark>` (see `--help` for the list).
+# If `data/course_infos.json` hasn't been fetched yet, a synthetic catalog of the same size is
+# built from the other files in `data/` so that the benchmarks still run at full-catalog scale.
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+from multiprocessing import Pool
+import os.path
+import random
+import tempfile
+from time import perf_counter
+from typing import Callable, Optional
+
+import pytest
+import requests
+from ortools.sat.python import cp_model
+
+from catalog import CatalogIndex
+from compiled_catalog import CompiledCatalog, compile_catalog
+from conftest import StubApiServer
+from cp2_types import (
+    BaseRequirement, CompletedCourse, CourseInfo, CourseRequest, RequirementBlock, ScheduleParams, Semester, Student, parse_course_id
+)
+from fetch_data import (
+    COURSE_INFOS_CACHE_FILE, COURSE_OFFER_RATES_CACHE_FILE, COURSE_HISTORICAL_CREDITS_CACHE_FILE,
+    historical_offered_rate, historical_semesters
+)
+from http_cache import HttpCache
+from http_fetch import AsyncFetcher
+from requirement_blocks import CIS_BSE, CIS_MSE, SEAS_WRIT, DSGN_MAJOR, CIS_BAS, MATH_MINOR
+import solver
+from solver import ScheduleGenerator, SemesterEncoding, generate_schedule, get_model_skeleton, model_skeleton_cache
+from schedule_cache import ScheduleCache
+from session import ScheduleSession
+from solver_pool import SolverPool, generate_schedules_batch
+
+COURSE_REQS_FILE = 'data/course_reqs.json'
+
+# Prerequisites for the core courses in the requirement blocks, used by the synthetic catalog
+SYNTHETIC_PREREQUISITES: dict[str, list[list[str]]] = {
+    'CIS-120': [['CIS-110']],
+    'CIS-121': [['CIS-120'], ['CIS-160']],
+    'CIS-240': [['CIS-120']],
+    'CIS-262': [['CIS-160']],
+    'CIS-261': [['CIS-160']],
+    'CIS-320': [['CIS-121'], ['CIS-160']],
+    'CIS-380': [['CIS-121'], ['CIS-240']],
+    'CIS-471': [['CIS-240']],
+    'CIS-400': [['CIS-320']],
+    'CIS-401': [['CIS-400']],
+    'MATH-114': [['MATH-104']],
+    'MATH-240': [['MATH-114']],
+    'PHYS-151': [['PHYS-150', 'PHYS-170']],
+}
+
+def synthesize_catalog(seed: int = 0) -> list[CourseInfo]:
+    """
+    Build a catalog with one entry for every course that we have offer rates for, using the
+    real requirement categories, credits and offer rates where we have them. Prerequisites are
+    randomly drawn from lower-numbered courses in the same department.
+    """
+    rng = random.Random(seed)
+    with open(COURSE_OFFER_RATES_CACHE_FILE) as f:
+        offer_rates: dict[str, dict[str, float]] = json.load(f)
+    with open(COURSE_REQS_FILE) as f:
+        course_reqs: dict[str, list[str]] = json.load(f)
+    with open(COURSE_HISTORICAL_CREDITS_CACHE_FILE) as f:
+        historical_credits: dict[str, float] = json.load(f)
+
+    course_ids = sorted(offer_rates)
+    ids_of_dept: dict[str, list[str]] = {}
+    for course_id in course_ids:
+        ids_of_dept.setdefault(course_id.split('-')[0], []).append(course_id)
+
+    all_courses: list[CourseInfo] = []
+    for course_id in course_ids:
+        dept, number = parse_course_id(course_id)
+        lower_courses = [c for c in ids_of_dept[dept] if c < course_id]
+        prerequisites: list[list[str]] = []
+        if course_id in SYNTHETIC_PREREQUISITES:
+            prerequisites = SYNTHETIC_PREREQUISITES[course_id]
+        elif lower_courses and number >= 200 and rng.random() < 0.5:
+            prerequisites = [
+                rng.sample(lower_courses, min(len(lower_courses), rng.randint(1, 3)))
+                for _ in range(rng.randint(1, 2))
+            ]
+        credits = historical_credits.get(course_id) or rng.choice([1.0] * 9 + [0.5])
+        all_courses.append({
+            'id': course_id,
+            'title': course_id,
+            'semester': '2022A',
+            'rate_offered': offer_rates[course_id],
+            'prerequisites': prerequisites,
+            'course_quality': None,
+            'instructor_quality': None,
+            'difficulty': round(rng.uniform(1, 4), 2),
+            'work_required': None,
+            'crosslistings': [],
+            'requirements': [
+                {'id': category, 'code': category.split('@')[0], 'school': category.split('@')[1],
+                 'semester': '2022A', 'name': category}
+                for category in course_reqs.get(course_id, [])
+            ],
+            'sections': [],
+            'credits': credits,
+        })
+    return all_courses
+
+def load_full_catalog() -> list[CourseInfo]:
+    """ Load the fetched catalog if it exists, otherwise synthesize one of the same size. """
+    if os.path.exists(COURSE_INFOS_CACHE_FILE):
+        with open(COURSE_INFOS_CACHE_FILE) as f:
+            return json.load(f)
+    return synthesize_catalog()
+
+def base_requirements_of(blocks: list[RequirementBlock]) -> list[BaseRequirement]:
+    """ Return all BaseRequirements in the requirement blocks (leaves of the requirements tree). """
+    base_requirements = []
+    to_visit = [req for block in blocks for req in block]
+    while to_visit:
+        req = to_visit.pop()
+        if req.is_multi_requirement:
+            to_visit.extend(req.multi_requirements)
+        else:
+            base_requirements.append(req.base_requirement)
+    return base_requirements
+
+def timed(f: Callable, repeat: int = 1) -> float:
+    """ Return the best wall-clock time over `repeat` runs of `f`, in seconds. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        f()
+        best = min(best, perf_counter() - start)
+    return best
+
+def bench_catalog_index(all_courses: list[CourseInfo]) -> None:
+    """ Compare answering eligibility questions by scanning the catalog against the CatalogIndex. """
+    base_requirements = base_requirements_of([CIS_BSE, CIS_MSE, SEAS_WRIT, DSGN_MAJOR, CIS_BAS, MATH_MINOR])
+    print(f'{len(all_courses)} courses, {len(base_requirements)} base requirements')
+
+    scan = lambda: [
+        [course['id'] for course in all_courses if br.satisfied_by_course(course)]
+        for br in base_requirements
+    ]
+    index = CatalogIndex(all_courses)
+    query = lambda: [index.courses_satisfying(br) for br in base_requirements]
+    assert [set(ids) for ids in scan()] == query()
+
+    scan_time = timed(scan, repeat=3)
+    build_time = timed(lambda: CatalogIndex(all_courses), repeat=3)
+    query_time = timed(query, repeat=10)
+    print(f'scan:  {1000 * scan_time / len(base_requirements):8.3f} ms/query')
+    print(f'index: {1000 * query_time / len(base_requirements):8.3f} ms/query ({1000 * build_time:.1f} ms to build)')
+    print(f'speedup: {scan_time / query_time:.0f}x per query')
+
+def bench_model_skeleton(all_courses: list[CourseInfo]) -> None:
+    """ Compare building a model from scratch against reusing the cached model skeleton. """
+    index = CatalogIndex(all_courses)
+    students = [
+        [],
+        [CompletedCourse('CIS-110', 0, []), CompletedCourse('CIS-120', 1, [])],
+        [CompletedCourse('CIS-160', 1, []), CompletedCourse('CIS-121', 2, []), CompletedCourse('CIS-240', 2, [])],
+    ]
+    def build(completed_courses: list[CompletedCourse]) -> ScheduleGenerator:
+        params = ScheduleParams(
+            num_semesters=8,
+            min_credits_per_semester=0,
+            max_credits_per_semester=6,
+            requirement_blocks=[CIS_BSE, CIS_MSE],
+            max_double_counts={(0, 1): 3},
+            cannot_triple_count=set(),
+        )
+        return ScheduleGenerator(all_courses, [], completed_courses, params, catalog_index=index)
+
+    model_skeleton_cache.clear()
+    cold_time = timed(lambda: build(students[0]))
+    generator = build(students[0])
+    print(f'{len(generator.all_course_ids)} courses, {len(generator.model.Proto().variables)} vars')
+    warm_times = [timed(lambda: build(completed_courses), repeat=3) for completed_courses in students]
+    print(f'cold build: {1000 * cold_time:8.1f} ms')
+    for completed_courses, warm_time in zip(students, warm_times):
+        print(f'warm build ({len(completed_courses)} completed courses): {1000 * warm_time:8.1f} ms')
+    print(f'speedup: {cold_time / max(warm_times):.0f}x')
+
+def bench_semester_windows(all_courses: list[CourseInfo]) -> None:
+    """ Count the semester-indexed variables that are left after restricting courses to the semesters they can be taken in. """
+    index = CatalogIndex(all_courses)
+    params = ScheduleParams(
+        num_semesters=8,
+        min_credits_per_semester=0,
+        max_credits_per_semester=6,
+        requirement_blocks=[CIS_BSE, CIS_MSE],
+        max_double_counts={(0, 1): 3},
+        cannot_triple_count=set(),
+    )
+    model_skeleton_cache.clear()
+    start = perf_counter()
+    generator = ScheduleGenerator(all_courses, [], [], params, catalog_index=index)
+    build_time = perf_counter() - start
+
+    num_courses = len(generator.all_course_ids)
+    full_grid = num_courses * len(generator.semester_indices_with_precollege)
+    num_by_sem_vars = len(set(var.Index() for var in generator.takes_course_by_sem.values()) - set(
+        var.Index() for var in generator.takes_course_in_sem.values()
+    ))
+    never_taken = sum(not sems for sems in generator.semesters_of_course.values())
+    print(f'{num_courses} courses ({never_taken} can never be taken), {len(generator.model.Proto().variables)} vars')
+    print(f'takes_course_in_sem: {len(generator.takes_course_in_sem):6} / {full_grid} ({len(generator.takes_course_in_sem) / full_grid:.0%})')
+    print(f'takes_course_by_sem: {num_by_sem_vars:6} / {full_grid} ({num_by_sem_vars / full_grid:.0%})')
+    for c in ['CIS-120', 'CIS-121', 'CIS-320', 'CIS-380']:
+        print(f'{c}: semesters {generator.semesters_of_course.get(c)}')
+    print(f'build: {1000 * build_time:.1f} ms')
+
+def bench_model_size(all_courses: list[CourseInfo]) -> None:
+    """ Report the size of the model for a double major on the full catalog, in each semester encoding. """
+    index = CatalogIndex(all_courses)
+    for encoding in SemesterEncoding:
+        params = ScheduleParams(
+            num_semesters=8,
+            min_credits_per_semester=0,
+            max_credits_per_semester=6,
+            requirement_blocks=[CIS_BSE, CIS_MSE],
+            max_double_counts={(0, 1): 3},
+            cannot_triple_count=set(),
+        )
+        generator = ScheduleGenerator(all_courses, [], [], params, catalog_index=index, semester_encoding=encoding)
+        proto = generator.model.Proto()
+        print(f'{encoding.value}: {len(proto.variables)} vars, {len(proto.constraints)} constraints')
+
+class TestDurations:
+    """ pytest plugin that adds up the durations of the tests for each parametrization id. """
+    def __init__(self) -> None:
+        self.durations: defaultdict[str, float] = defaultdict(float)
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        if report.when == 'call' and '[' in report.nodeid:
+            self.durations[report.nodeid.rsplit('[', 1)[1].rstrip(']')] += report.duration
+
+def bench_semester_encodings(all_courses: list[CourseInfo]) -> None:
+    """ Compare the BOOLEAN and INTEGER semester encodings on the solver tests and on the full catalog. """
+    test_durations = TestDurations()
+    pytest.main(['-q', '-p', 'no:cacheprovider', os.path.join(os.path.dirname(__file__), 'test_solver.py')], plugins=[test_durations])
+    for encoding in SemesterEncoding:
+        print(f'test_solver.py ({encoding.value}): {1000 * test_durations.durations[encoding.value]:8.1f} ms')
+
+    index = CatalogIndex(all_courses)
+    for encoding in SemesterEncoding:
+        params = ScheduleParams(
+            num_semesters=8,
+            min_credits_per_semester=0,
+            max_credits_per_semester=6,
+            requirement_blocks=[CIS_BSE],
+            max_double_counts={},
+            cannot_triple_count=set(),
+        )
+        model_skeleton_cache.clear()
+        start = perf_counter()
+        generator = ScheduleGenerator(all_courses, [], [], params, catalog_index=index, semester_encoding=encoding)
+        build_time = perf_counter() - start
+
+        solver = cp_model.CpSolver()
+        solver.parameters.num_search_workers = 8
+        solver.parameters.max_time_in_seconds = 120
+        start = perf_counter()
+        status = solver.Solve(generator.model)
+        solve_time = perf_counter() - start
+        proto = generator.model.Proto()
+        print(
+            f'full catalog ({encoding.value}): {len(proto.variables)} vars, {len(proto.constraints)} constraints, '
+            f'build {build_time:.2f} s, solve {solve_time:.2f} s ({solver.StatusName(status)})'
+        )
+
+def bench_hints(all_courses: list[CourseInfo]) -> None:
+    """ Compare solving on the full catalog with and without hints from the greedy planner. """
+    index = CatalogIndex(all_courses)
+    for blocks, name in [([CIS_BSE], 'CIS_BSE'), ([CIS_BSE, CIS_MSE], 'CIS_BSE + CIS_MSE')]:
+        params = ScheduleParams(
+            num_semesters=8,
+            min_credits_per_semester=0,
+            max_credits_per_semester=6,
+            requirement_blocks=blocks,
+            max_double_counts={(0, 1): 3} if len(blocks) == 2 else {},
+            cannot_triple_count=set(),
+        )
+        for use_hints in [False, True]:
+            generator = ScheduleGenerator(all_courses, [], [], params, catalog_index=index)
+            hint_time = timed(generator.add_greedy_hints) if use_hints else 0.0
+
+            solver = cp_model.CpSolver()
+            solver.parameters.num_search_workers = 8
+            solver.parameters.max_time_in_seconds = 120
+            start = perf_counter()
+            status = solver.Solve(generator.model)
+            solve_time = perf_counter() - start
+            print(
+                f'{name} ({"hints" if use_hints else "no hints"}): solve {solve_time:.2f} s ({solver.StatusName(status)})'
+                + (f', greedy planner {1000 * hint_time:.1f} ms' if use_hints else '')
+            )
+
+def bench_batch(all_courses: list[CourseInfo]) -> None:
+    """ Compare the throughput of generating schedules for a cohort one by one and with `generate_schedules_batch`. """
+    students = [
+        Student([], []),
+        Student([], [CompletedCourse('CIS-110', 1, []), CompletedCourse('CIS-160', 1, [])]),
+        Student([], [CompletedCourse('CIS-110', 1, []), CompletedCourse('CIS-160', 1, []), CompletedCourse('CIS-120', 2, [])]),
+        Student([CourseRequest('CIS-262', 4)], []),
+        Student([CourseRequest('CIS-471', 6)], [CompletedCourse('MATH-104', 0, [])]),
+        Student([], [CompletedCourse('MATH-104', 1, []), CompletedCourse('MATH-114', 2, [])]),
+    ]
+    params = ScheduleParams(
+        num_semesters=8,
+        min_credits_per_semester=0,
+        max_credits_per_semester=6,
+        requirement_blocks=[CIS_BSE],
+        max_double_counts={},
+        cannot_triple_count=set(),
+    )
+
+    model_skeleton_cache.clear()
+    start = perf_counter()
+    one_by_one = [
+        generate_schedule(all_courses, course_requests, completed_courses, params, time_limit=60)
+        for course_requests, completed_courses in students
+    ]
+    one_by_one_time = perf_counter() - start
+
+    model_skeleton_cache.clear()
+    start = perf_counter()
+    first_time = None
+    batch: dict[int, object] = {}
+    for i, soln in generate_schedules_batch(all_courses, students, params, time_limit=60):
+        first_time = first_time or perf_counter() - start
+        batch[i] = soln
+    batch_time = perf_counter() - start
+
+    assert [soln is not None for soln in one_by_one] == [batch[i] is not None for i in range(len(students))]
+    print(f'{len(students)} students, {os.cpu_count()} cores')
+    print(f'one by one: {one_by_one_time:6.1f} s ({60 * len(students) / one_by_one_time:.1f} students/minute)')
+    print(f'batch:      {batch_time:6.1f} s ({60 * len(students) / batch_time:.1f} students/minute, first result after {first_time:.1f} s)')
+
+def bench_pool_load(all_courses: list[CourseInfo]) -> None:
+    """
+    Measure the throughput and latency of concurrent requests, like the web app's: 4 client threads send 12
+    solves, which run in the requests' threads (as before `SolverPool`) or in a warmed-up `SolverPool`.
+    """
+    completed_courses = [
+        [],
+        [CompletedCourse('CIS-110', 1, []), CompletedCourse('CIS-160', 1, [])],
+        [CompletedCourse('MATH-104', 1, []), CompletedCourse('MATH-114', 2, [])],
+    ]
+    requests_ = [completed_courses[i % len(completed_courses)] for i in range(12)]
+    params = ScheduleParams(
+        num_semesters=8,
+        min_credits_per_semester=0,
+        max_credits_per_semester=6,
+        requirement_blocks=[CIS_BSE],
+        max_double_counts={},
+        cannot_triple_count=set(),
+    )
+    catalog_index = CatalogIndex(all_courses)
+    print(f'{len(requests_)} requests from 4 threads, {os.cpu_count()} cores')
+
+    def run(name: str, solve: Callable[[list[CompletedCourse]], object]) -> None:
+        latencies: list[float] = []
+        def request(completed: list[CompletedCourse]) -> None:
+            start = perf_counter()
+            assert solve(completed) is not None
+            latencies.append(perf_counter() - start)
+        start = perf_counter()
+        with ThreadPoolExecutor(4) as clients:
+            list(clients.map(request, requests_))
+        elapsed = perf_counter() - start
+        latencies.sort()
+        print(
+            f'{name}: {60 * len(requests_) / elapsed:.1f} solves/minute, latency p50 {latencies[len(latencies) // 2]:.1f} s, '
+            f'max {latencies[-1]:.1f} s'
+        )
+
+    model_skeleton_cache.clear()
+    generate_schedule(all_courses, [], [], params, catalog_index=catalog_index)
+    run('in request threads', lambda completed: generate_schedule(
+        all_courses, [], completed, params, catalog_index=catalog_index, time_limit=60
+    ))
+    pool = SolverPool(all_courses, catalog_index=catalog_index)
+    try:
+        # Let every process build the model skeleton once, like a running server's would have
+        for future in [pool.submit([], [], params, count_queue_time=False) for _ in range(pool.num_processes)]:
+            future.result()
+        run(f'SolverPool ({pool.num_processes} processes)', lambda completed: generate_schedule(
+            all_courses, [], completed, params, time_limit=60, pool=pool
+        ))
+    finally:
+        pool.shutdown()
+
+def bench_session(all_courses: list[CourseInfo]) -> None:
+    """ Time re-solves after single-course edits in a ScheduleSession, for a double major on the full catalog. """
+    index = CatalogIndex(all_courses)
+    def double_major_params(blocks: list[RequirementBlock]) -> ScheduleParams:
+        return ScheduleParams(
+            num_semesters=8,
+            min_credits_per_semester=0,
+            max_credits_per_semester=6,
+            requirement_blocks=blocks,
+            max_double_counts={(0, 1): 3} if len(blocks) == 2 else {},
+            cannot_triple_count=set(),
+        )
+    session = ScheduleSession(all_courses, [], double_major_params([CIS_BSE, CIS_MSE]), catalog_index=index)
+    edits: list[tuple[str, Callable[[], None]]] = [
+        ('first solve', lambda: None),
+        ('request CIS-380 in semester 7', lambda: session.request('CIS-380', 7)),
+        ('move CIS-380 to semester 5', lambda: session.request('CIS-380', 5)),
+        ('request CIS-500', lambda: session.request('CIS-500')),
+        ('forbid CIS-262 (infeasible)', lambda: session.forbid('CIS-262')),
+        ('allow CIS-262', lambda: session.allow('CIS-262')),
+        ('request CIS-380 in semester 1 (infeasible)', lambda: session.request('CIS-380', 1)),
+        ('move CIS-380 back to semester 5', lambda: session.request('CIS-380', 5)),
+        ('drop the MSE (rebuilds the model)', lambda: session.set_schedule_params(double_major_params([CIS_BSE]))),
+        ('request CIS-380 in semester 7', lambda: session.request('CIS-380', 7)),
+    ]
+    for name, edit in edits:
+        start = perf_counter()
+        edit()
+        soln = session.solve()
+        print(f'{name:45} {1000 * (perf_counter() - start):8.1f} ms ({"feasible" if soln else "infeasible"})')
+
+def bench_solve_many(all_courses: list[CourseInfo]) -> None:
+    """ Time finding k diverse schedules for a double major on the full catalog with `ScheduleGenerator.solve_many`. """
+    index = CatalogIndex(all_courses)
+    params = ScheduleParams(
+        num_semesters=8,
+        min_credits_per_semester=0,
+        max_credits_per_semester=6,
+        requirement_blocks=[CIS_BSE, CIS_MSE],
+        max_double_counts={(0, 1): 3},
+        cannot_triple_count=set(),
+    )
+    generator = ScheduleGenerator(all_courses, [], [], params, catalog_index=index)
+    k = 5
+    start = perf_counter()
+    generator.solve_many(1)
+    print(f'first schedule: {perf_counter() - start:.2f} s')
+    for min_hamming_distance in [2, 10]:
+        start = perf_counter()
+        solns = generator.solve_many(k, min_hamming_distance=min_hamming_distance, time_limit=300)
+        total_time = perf_counter() - start
+        print(f'{len(solns)} / {k} schedules at distance >= {min_hamming_distance}: {total_time:.2f} s')
+
+def bench_diagnose(all_courses: list[CourseInfo]) -> None:
+    """ Time explaining infeasible double majors on the full catalog with `ScheduleGenerator.diagnose_infeasibility`. """
+    index = CatalogIndex(all_courses)
+    def double_major_params(num_semesters: int, max_credits_per_semester: float) -> ScheduleParams:
+        return ScheduleParams(
+            num_semesters=num_semesters,
+            min_credits_per_semester=0,
+            max_credits_per_semester=max_credits_per_semester,
+            requirement_blocks=[CIS_BSE, CIS_MSE],
+            max_double_counts={(0, 1): 3},
+            cannot_triple_count=set(),
+        )
+    cases = [
+        ('too few semesters', double_major_params(4, 5), []),
+        ('CIS-380 requested in semester 1', double_major_params(8, 6), [CourseRequest('CIS-380', 1)]),
+        ('CIS-262 and CIS-380 requested in semester 2', double_major_params(8, 6), [CourseRequest('CIS-262', 2), CourseRequest('CIS-380', 2)]),
+    ]
+    for name, params, course_requests in cases:
+        start = perf_counter()
+        generator = ScheduleGenerator(
+            all_courses, course_requests, [], params, catalog_index=index, guard_constraints=True
+        )
+        diagnosis = generator.diagnose_infeasibility()
+        print(f'{name}: {perf_counter() - start:.2f} s')
+        for description in diagnosis or []:
+            print(f'  - {description}')
+
+def bench_cache(all_courses: list[CourseInfo]) -> None:
+    """ Time `generate_schedule` with a ScheduleCache on a miss, a memory hit and a disk hit, for a double major. """
+    index = CatalogIndex(all_courses)
+    params = ScheduleParams(
+        num_semesters=8,
+        min_credits_per_semester=0,
+        max_credits_per_semester=6,
+        requirement_blocks=[CIS_BSE, CIS_MSE],
+        max_double_counts={(0, 1): 3},
+        cannot_triple_count=set(),
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ScheduleCache(directory)
+        for name in ['miss', 'memory hit', 'memory hit']:
+            start = perf_counter()
+            generate_schedule(all_courses, [], [], params, catalog_index=index, cache=cache)
+            print(f'{name}: {1e6 * (perf_counter() - start):.0f} us')
+        cache = ScheduleCache(directory)
+        start = perf_counter()
+        generate_schedule(all_courses, [], [], params, catalog_index=index, cache=cache)
+        print(f'disk hit: {1e6 * (perf_counter() - start):.0f} us')
+
+def bench_saved_skeleton(all_courses: list[CourseInfo]) -> None:
+    """ Time building a model skeleton for a double major vs. loading it from a file saved with `ModelSkeleton.save`. """
+    index = CatalogIndex(all_courses)
+    params = ScheduleParams(
+        num_semesters=8,
+        min_credits_per_semester=0,
+        max_credits_per_semester=6,
+        requirement_blocks=[CIS_BSE, CIS_MSE],
+        max_double_counts={(0, 1): 3},
+        cannot_triple_count=set(),
+    )
+    model_skeleton_cache.clear()
+    start = perf_counter()
+    skeleton = get_model_skeleton(index, params, [], [])
+    print(f'build: {perf_counter() - start:.3f} s')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'skeleton.pickle')
+        start = perf_counter()
+        skeleton.save(path)
+        print(f'save: {perf_counter() - start:.3f} s ({os.path.getsize(path) / 2**20:.1f} MB)')
+        model_skeleton_cache.clear()
+        start = perf_counter()
+        get_model_skeleton(index, params, [], [], saved_path=path)
+        print(f'load: {perf_counter() - start:.3f} s')
+
+def bench_interchangeable(all_courses: list[CourseInfo]) -> None:
+    """
+    Compare the model size and solve time on the full catalog with and without collapsing interchangeable
+    requirements into counted groups (see `solver.interchangeable_requirements`).
+    """
+    index = CatalogIndex(all_courses)
+    interchangeable_requirements = solver.interchangeable_requirements
+    for blocks, name in [([CIS_BSE], 'CIS_BSE'), ([CIS_BSE, CIS_MSE], 'CIS_BSE + CIS_MSE')]:
+        for collapse in [False, True]:
+            solver.interchangeable_requirements = interchangeable_requirements if collapse else lambda _: []
+            model_skeleton_cache.clear()
+            params = ScheduleParams(
+                num_semesters=8,
+                min_credits_per_semester=0,
+                max_credits_per_semester=6,
+                requirement_blocks=blocks,
+                max_double_counts={(0, 1): 3} if len(blocks) == 2 else {},
+                cannot_triple_count=set(),
+            )
+            generator = ScheduleGenerator(all_courses, [], [], params, catalog_index=index)
+            proto = generator.model.Proto()
+            cp_solver = cp_model.CpSolver()
+            cp_solver.parameters.num_search_workers = 8
+            cp_solver.parameters.max_time_in_seconds = 120
+            start = perf_counter()
+            status = cp_solver.Solve(generator.model)
+            print(
+                f'{name} ({"collapsed" if collapse else "not collapsed"}): {len(generator.counts_for)} counts_for vars, '
+                f'{len(proto.variables)} vars, {len(proto.constraints)} constraints, '
+                f'solve {perf_counter() - start:.2f} s ({cp_solver.StatusName(status)})'
+            )
+    solver.interchangeable_requirements = interchangeable_requirements
+    model_skeleton_cache.clear()
+
+def bench_pruning(all_courses: list[CourseInfo]) -> None:
+    """ Compare the model size and solve time on the full catalog with and without pruning courses (see `solver.prune_courses`). """
+    index = CatalogIndex(all_courses)
+    prune_courses = solver.prune_courses
+    for blocks, name in [([CIS_BSE], 'CIS_BSE'), ([CIS_BSE, CIS_MSE], 'CIS_BSE + CIS_MSE')]:
+        print(f'{name}: prune_courses {timed(lambda: prune_courses(index, blocks), repeat=3) * 1000:.1f} ms')
+        for prune in [False, True]:
+            solver.prune_courses = prune_courses if prune else lambda *_: solver.CoursePruning(frozenset(), frozenset(), {})
+            solver.course_pruning_cache.clear()
+            model_skeleton_cache.clear()
+            params = ScheduleParams(
+                num_semesters=8,
+                min_credits_per_semester=0,
+                max_credits_per_semester=6,
+                requirement_blocks=blocks,
+                max_double_counts={(0, 1): 3} if len(blocks) == 2 else {},
+                cannot_triple_count=set(),
+            )
+            start = perf_counter()
+            generator = ScheduleGenerator(all_courses, [], [], params, catalog_index=index)
+            build_time = perf_counter() - start
+            cp_solver = cp_model.CpSolver()
+            cp_solver.parameters.num_search_workers = 8
+            cp_solver.parameters.max_time_in_seconds = 120
+            start = perf_counter()
+            status = cp_solver.Solve(generator.model)
+            print(
+                f'  {"pruned" if prune else "not pruned"}: {len(generator.takes_course)} courses, '
+                f'{len(generator.counts_for)} counts_for vars, build {build_time:.2f} s, '
+                f'solve {perf_counter() - start:.2f} s ({cp_solver.StatusName(status)}, objective {cp_solver.ObjectiveValue():.0f})'
+            )
+    solver.prune_courses = prune_courses
+    solver.course_pruning_cache.clear()
+    model_skeleton_cache.clear()
+
+def fetch_with_new_connection(url: str) -> Optional[dict]:
+    """ How course infos were fetched before `AsyncFetcher`: a bare request per course, in a process pool. """
+    try:
+        return json.loads(requests.get(url).text)
+    except:
+        return None
+
+def bench_fetch(all_courses: list[CourseInfo]) -> None:
+    """
+    Compare the throughput of fetching course infos from a local stub of the API (with 5 ms of latency per
+    request) with a pool of 20 processes and with `AsyncFetcher`.
+    """
+    course_ids = [course['id'] for course in all_courses[:2000]]
+    server = StubApiServer({f'/courses/{c}/': {'id': c} for c in course_ids}, latency=0.005)
+    urls = {c: f'{server.url}/courses/{c}/' for c in course_ids}
+    try:
+        start = perf_counter()
+        with Pool(20) as p:
+            results = list(p.imap_unordered(fetch_with_new_connection, urls.values(), 1))
+        elapsed = perf_counter() - start
+        print(f'Pool(20): {len(course_ids) / elapsed:.0f} courses/s ({sum(r is not None for r in results)} fetched)')
+        server.client_addresses.clear()
+        for concurrency in [20, 50]:
+            with AsyncFetcher(concurrency) as fetcher:
+                start = perf_counter()
+                fetch_results = fetcher.fetch_all_sync(urls)
+                elapsed = perf_counter() - start
+            print(
+                f'AsyncFetcher({concurrency}): {len(course_ids) / elapsed:.0f} courses/s '
+                f'({sum(r.error is None for r in fetch_results.values())} fetched, {len(server.client_addresses)} connections)'
+            )
+            server.client_addresses.clear()
+    finally:
+        server.close()
+
+def bench_http_cache(all_courses: list[CourseInfo]) -> None:
+    """
+    Time refreshing 2000 course infos from a local stub of the API (with 5 ms of latency per request): with an
+    empty `HttpCache`, with fresh cached responses, and with stale ones of which 1% changed.
+    """
+    course_ids = [course['id'] for course in all_courses[:2000]]
+    server = StubApiServer({f'/courses/{c}/': course for c, course in zip(course_ids, all_courses)}, latency=0.005)
+    urls = {c: f'{server.url}/courses/{c}/' for c in course_ids}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = HttpCache(directory)
+            with AsyncFetcher(20, cache=cache) as fetcher:
+                for name in ['empty cache', 'fresh', 'stale, 1% changed']:
+                    if name.startswith('stale'):
+                        cache.ttl = 0
+                        for c in course_ids[::100]:
+                            server.documents[f'/courses/{c}/'] = {**server.documents[f'/courses/{c}/'], 'title': 'Changed'}
+                    hits, revalidated, downloads = cache.hits, cache.revalidated, cache.downloads
+                    start = perf_counter()
+                    fetcher.fetch_all_sync(urls)
+                    elapsed = perf_counter() - start
+                    print(
+                        f'{name}: {elapsed:.2f}s ({cache.hits - hits} hits, {cache.revalidated - revalidated} '
+                        f'revalidated, {cache.downloads - downloads} downloaded)'
+                    )
+    finally:
+        server.close()
+
+# The shape of a section in the Penn Courses API
+SAMPLE_SECTION = {
+    'id': 'CIS-120-001', 'status': 'O', 'activity': 'LEC', 'credits': 1.0, 'semester': '2022A',
+    'meetings': [{'day': day, 'start': 10.15, 'end': 11.45, 'room': 'TOWN 100'} for day in 'TR'],
+    'instructors': [{'id': 1234, 'name': 'Instructor Name'}], 'course_quality': 3.1, 'instructor_quality': 3.2,
+    'difficulty': 2.8, 'work_required': 2.9, 'associated_sections': [], 'registration_volume': 0,
+}
+
+def bench_compiled_catalog(all_courses: list[CourseInfo]) -> None:
+    """ Compare loading the catalog from JSON with memory-mapping the compiled catalog. """
+    with tempfile.TemporaryDirectory() as directory:
+        json_filename = os.path.join(directory, 'course_infos.json')
+        compiled_filename = os.path.join(directory, 'course_infos.cp2cat')
+        with open(json_filename, 'w') as f:
+            json.dump(all_courses, f)
+        print(f'compile: {timed(lambda: compile_catalog(all_courses, compiled_filename)):.3f}s')
+        print(f'size: JSON {os.path.getsize(json_filename) // 1024} KiB, compiled {os.path.getsize(compiled_filename) // 1024} KiB')
+
+        def load_json() -> None:
+            with open(json_filename) as f:
+                json.load(f)
+        print(f'json.load: {timed(load_json, repeat=5) * 1000:.1f}ms')
+        # The fetched catalog also has every section of every course, which the compiled catalog leaves out
+        with open(json_filename, 'w') as f:
+            json.dump([{**course, 'sections': [SAMPLE_SECTION] * 3} for course in all_courses], f)
+        print(
+            f'json.load with 3 sections per course ({os.path.getsize(json_filename) // 1024} KiB): '
+            f'{timed(load_json, repeat=5) * 1000:.1f}ms'
+        )
+        print(f'CompiledCatalog.load: {timed(lambda: CompiledCatalog.load(compiled_filename), repeat=5) * 1000:.2f}ms')
+        print(f'CompiledCatalog.load + decode one course: {timed(lambda: CompiledCatalog.load(compiled_filename)[len(all_courses) // 2], repeat=5) * 1000:.2f}ms')
+        print(f'CompiledCatalog.load + decode every course: {timed(lambda: list(CompiledCatalog.load(compiled_filename)), repeat=5) * 1000:.1f}ms')
+        print(f'CompiledCatalog.load + CatalogIndex: {timed(lambda: CatalogIndex(CompiledCatalog.load(compiled_filename)), repeat=5) * 1000:.1f}ms')
+
+def sequential_offered_rate(curr_sem: str, list_courses_api_url: str) -> dict[str, dict[str, float]]:
+    """ How offer rates were computed before `semester_course_ids`: one listing after another, into sets. """
+    num_semesters: defaultdict[str, int] = defaultdict(int)
+    rates: defaultdict[str, dict[str, float]] = defaultdict(lambda: {season.value: 0 for season in Semester})
+    for semester in historical_semesters(curr_sem):
+        num_semesters[semester[4]] += 1
+        for course_id in set(course['id'] for course in json.loads(requests.get(list_courses_api_url.format(semester)).text)):
+            rates[course_id][semester[4]] += 1.0
+    for seasons_rates in rates.values():
+        for season in seasons_rates:
+            seasons_rates[season] /= num_semesters[season]
+    return rates
+
+def bench_offer_rates(all_courses: list[CourseInfo]) -> None:
+    """
+    Time computing the offer rates over 5 years of semester listings from a local stub of the API (with 100 ms
+    of latency per request, and about 80% of the catalog offered each semester): fetching the listings one after
+    another, and with `historical_offered_rate` from scratch, with the past semesters saved, and for a new term.
+    """
+    rng = random.Random(0)
+    semesters = historical_semesters('2022C') + ['2023A']
+    server = StubApiServer({
+        f'/{semester}/courses/': [
+            {'id': course['id'], 'title': course['title'], 'semester': semester, 'num_sections': 2}
+            for course in all_courses if rng.random() < 0.8
+        ]
+        for semester in semesters
+    }, latency=0.1)
+    list_courses_api_url = f'{server.url}/{{}}/courses/'
+    try:
+        start = perf_counter()
+        expected = sequential_offered_rate('2022C', list_courses_api_url)
+        print(f'sequential: {perf_counter() - start:.2f}s')
+        with tempfile.TemporaryDirectory() as directory, AsyncFetcher() as fetcher:
+            for name, curr_sem in [('from scratch', '2022C'), ('past semesters saved', '2022C'), ('new term', '2023A')]:
+                server.num_requests.clear()
+                start = perf_counter()
+                rates = historical_offered_rate(curr_sem, directory, list_courses_api_url, fetcher)
+                print(f'{name}: {perf_counter() - start:.2f}s ({sum(server.num_requests.values())} listings downloaded)')
+                if curr_sem == '2022C':
+                    assert rates == expected
+    finally:
+        server.close()
+
+BENCHMARKS: dict[str, Callable[[list[CourseInfo]], None]] = {
+    'catalog_index': bench_catalog_index,
+    'model_skeleton': bench_model_skeleton,
+    'semester_windows': bench_semester_windows,
+    'semester_encodings': bench_semester_encodings,
+    'model_size': bench_model_size,
+    'hints': bench_hints,
+    'batch': bench_batch,
+    'pool_load': bench_pool_load,
+    'session': bench_session,
+    'solve_many': bench_solve_many,
+    'diagnose': bench_diagnose,
+    'cache': bench_cache,
+    'saved_skeleton': bench_saved_skeleton,
+    'interchangeable': bench_interchangeable,
+    'pruning': bench_pruning,
+    'fetch': bench_fetch,
+    'http_cache': bench_http_cache,
+    'compiled_catalog': bench_compiled_catalog,
+    'offer_rates': bench_offer_rates,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run CP^2 benchmarks.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark', help=f'one of {list(BENCHMARKS)} (default: all)')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name!r}')
+
+    all_courses = load_full_catalog()
+    for name in args.benchmarks or BENCHMARKS:
+        print(f'===== {name} =====')
+        BENCHMARKS[name](all_courses)
+        print()
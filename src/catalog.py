@@ -0,0 +1,118 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import hashlib
+import json
+from typing import Sequence
+from cp2_types import BaseRequirement, CourseInfo, Id, parse_course_id
+
+
+class CatalogIndex:
+    """
+    Inverted index over the course catalog, built once at load time, that answers
+    "which courses satisfy this BaseRequirement" with set intersections and range slices
+    instead of calling `BaseRequirement.satisfied_by_course` on every course.
+
+    Attributes:
+
+        `all_courses: list[CourseInfo]`
+            The catalog, in its original order (later duplicates replace earlier ones).
+
+        `course_id_to_course: dict[Id, CourseInfo]`
+            A map from each course's id to the CourseInfo object.
+
+        `position_of_course: dict[Id, int]`
+            The position of each course in the original catalog, used to return courses in catalog order.
+
+        `course_numbers_of_dept: dict[str, list[int]]`
+            `course_numbers_of_dept[dept]` is the sorted list of course numbers in the department.
+
+        `course_ids_of_dept: dict[str, list[Id]]`
+            `course_ids_of_dept[dept][i]` is the id of the course with number `course_numbers_of_dept[dept][i]`.
+
+        `courses_of_category: dict[Id, set[Id]]`
+            `courses_of_category[category_id]` is the set of courses that fulfill the requirement category.
+
+        `version: str`
+            A hash of the catalog fields that the solver uses, so that models built from equal
+            catalogs can be shared.
+    """
+
+    def __init__(self, all_courses: Sequence[CourseInfo]) -> None:
+        self.course_id_to_course: dict[Id, CourseInfo] = {
+            course['id']: course for course in all_courses
+        }
+        self.all_courses = list(self.course_id_to_course.values())
+        self.all_course_ids = set(self.course_id_to_course)
+        self.position_of_course: dict[Id, int] = {
+            course_id: i for i, course_id in enumerate(self.course_id_to_course)
+        }
+
+        self.course_number: dict[Id, int] = {}
+        numbers_and_ids_of_dept: defaultdict[str, list[tuple[int, Id]]] = defaultdict(list)
+        self.courses_of_category: defaultdict[Id, set[Id]] = defaultdict(set)
+        for course in self.all_courses:
+            course_id = course['id']
+            dept, number = parse_course_id(course_id)
+            self.course_number[course_id] = number
+            numbers_and_ids_of_dept[dept].append((number, course_id))
+            for req in course['requirements']:
+                self.courses_of_category[req['id']].add(course_id)
+
+        self.course_numbers_of_dept: dict[str, list[int]] = {}
+        self.course_ids_of_dept: dict[str, list[Id]] = {}
+        for dept, numbers_and_ids in numbers_and_ids_of_dept.items():
+            numbers_and_ids.sort()
+            self.course_numbers_of_dept[dept] = [number for number, _ in numbers_and_ids]
+            self.course_ids_of_dept[dept] = [course_id for _, course_id in numbers_and_ids]
+
+        solver_fields = [
+            (
+                course['id'], course['credits'], course['prerequisites'], course['crosslistings'],
+                course['rate_offered'], course.get('difficulty'), sorted(req['id'] for req in course['requirements'])
+            )
+            for course in self.all_courses
+        ]
+        self.version = hashlib.sha1(json.dumps(solver_fields, sort_keys=True).encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.all_courses)
+
+    def courses_in_dept(self, dept: str, min_number: int = 0, max_number: int = 0) -> list[Id]:
+        """ Return the courses in the department with min_number <= number <= max_number (0 means unbounded). """
+        numbers = self.course_numbers_of_dept.get(dept, [])
+        lo = bisect_left(numbers, min_number) if min_number else 0
+        hi = bisect_right(numbers, max_number) if max_number else len(numbers)
+        return self.course_ids_of_dept[dept][lo:hi] if numbers else []
+
+    def courses_satisfying(self, br: BaseRequirement) -> set[Id]:
+        """ Return the ids of all courses `c` such that `br.satisfied_by_course(c)`. """
+        if 'FREE' in br.categories:
+            return set(self.all_course_ids)
+
+        # Each set parameter narrows the candidates down; start from the smallest one
+        candidate_sets: list[set[Id]] = []
+        if br.courses:
+            candidate_sets.append(br.courses & self.all_course_ids)
+        if br.depts:
+            candidate_sets.append(set().union(*(
+                self.courses_in_dept(dept, br.min_number, br.max_number) for dept in br.depts
+            )))
+        if br.categories:
+            candidate_sets.append(set().union(*(
+                self.courses_of_category.get(category, ()) for category in br.categories
+            )))
+        candidate_sets.sort(key=len)
+        candidates = candidate_sets[0].intersection(*candidate_sets[1:])
+
+        # The department ranges already account for course numbers
+        if not br.depts and (br.min_number or br.max_number):
+            candidates = {
+                course_id for course_id in candidates
+                if (not br.min_number or self.course_number[course_id] >= br.min_number)
+                and (not br.max_number or self.course_number[course_id] <= br.max_number)
+            }
+        return candidates
+
+    def sorted_by_position(self, course_ids: set[Id]) -> list[Id]:
+        """ Return the course ids in the order that they appear in the catalog. """
+        return sorted(course_ids, key=self.position_of_course.__getitem__)
@@ -0,0 +1,316 @@
+import gc
+import json
+import mmap
+import os
+from functools import cached_property
+from typing import Any, Iterator, Optional, Sequence, overload
+import numpy as np
+from cp2_types import CourseInfo, Id, ReqCategoryInfo, Semester, parse_course_id
+
+MAGIC = b'CP2CAT1\n'
+# Arrays start at multiples of this many bytes, so that every array is aligned for its dtype
+ALIGNMENT = 64
+# The string index of a None string (e.g. a course without a title)
+NO_STRING = -1
+# The columns of `rate_offered`
+SEASONS = [season.value for season in Semester]
+# The optional float fields of a course, stored as NaN when they are None
+OPTIONAL_FLOAT_FIELDS = ['course_quality', 'instructor_quality', 'difficulty', 'work_required']
+
+
+class StringTable:
+    """ Interns strings while compiling a catalog: each distinct string is stored once, and referred to by index. """
+
+    def __init__(self) -> None:
+        self.index_of: dict[str, int] = {}
+
+    def __call__(self, s: Optional[str]) -> int:
+        if s is None:
+            return NO_STRING
+        return self.index_of.setdefault(s, len(self.index_of))
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """ The UTF-8 bytes of all strings, and the offset of each string in them (plus the end). """
+        encoded = [s.encode() for s in self.index_of]
+        offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def indptr(lengths: list[int]) -> np.ndarray:
+    """ The start of each row (plus the end) of rows with the given lengths, laid out one after the other. """
+    starts = np.zeros(len(lengths) + 1, dtype='<i4')
+    np.cumsum(lengths, out=starts[1:])
+    return starts
+
+
+def csr(rows: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """ Pack a list of lists into a compressed sparse row pair: row `i` is `indices[indptr[i]:indptr[i + 1]]`. """
+    starts = indptr([len(row) for row in rows])
+    return starts, np.fromiter((x for row in rows for x in row), dtype='<i4', count=int(starts[-1]))
+
+
+def compile_catalog(all_courses: Sequence[CourseInfo], filename: str) -> None:
+    """
+    Write the catalog to a compact binary file that `CompiledCatalog.load` can memory-map (see `CompiledCatalog`).
+    Only the fields that the planner reads are kept: `sections` and any other fields are left out.
+    """
+    strings = StringTable()
+    depts = StringTable()
+    category_row: dict[Id, int] = {}
+    categories: list[list[int]] = []
+    for course in all_courses:
+        for req in course['requirements']:
+            if req['id'] not in category_row:
+                category_row[req['id']] = len(categories)
+                categories.append([strings(req[field]) for field in ReqCategoryInfo.__annotations__])
+
+    depts_and_numbers = [parse_course_id(course['id']) for course in all_courses]
+    arrays: dict[str, np.ndarray] = {
+        'id': np.array([strings(course['id']) for course in all_courses], dtype='<i4'),
+        'title': np.array([strings(course.get('title')) for course in all_courses], dtype='<i4'),
+        'semester': np.array([strings(course.get('semester')) for course in all_courses], dtype='<i4'),
+        'dept': np.array([depts(dept) for dept, _ in depts_and_numbers], dtype='<i4'),
+        'number': np.array([number for _, number in depts_and_numbers], dtype='<i4'),
+        'credits': np.array([course['credits'] for course in all_courses], dtype='<f8'),
+        'rate_offered': np.array(
+            [[course['rate_offered'].get(season, 0) for season in SEASONS] for course in all_courses], dtype='<f8'
+        ).reshape(-1, len(SEASONS)),
+        'categories': np.array(categories, dtype='<i4').reshape(-1, len(ReqCategoryInfo.__annotations__)),
+    }
+    for field in OPTIONAL_FLOAT_FIELDS:
+        arrays[field] = np.array(
+            [np.nan if course.get(field) is None else course[field] for course in all_courses], dtype='<f8'
+        )
+    arrays['requirements_indptr'], arrays['requirements_indices'] = csr(
+        [[category_row[req['id']] for req in course['requirements']] for course in all_courses]
+    )
+    # The prerequisite groups of each course are consecutive rows of the groups
+    arrays['prerequisites_indptr'] = indptr([len(course['prerequisites']) for course in all_courses])
+    arrays['prerequisite_groups_indptr'], arrays['prerequisite_groups_indices'] = csr(
+        [[strings(c) for c in group] for course in all_courses for group in course['prerequisites']]
+    )
+    arrays['crosslistings_indptr'], arrays['crosslistings_indices'] = csr(
+        [[strings(c) for c in course['crosslistings']] for course in all_courses]
+    )
+    arrays['dept_names'] = np.array([strings(dept) for dept in depts.index_of], dtype='<i4')
+    arrays['string_data'], arrays['string_offsets'] = strings.arrays()
+
+    # Lay the arrays out after the header, each at an aligned offset
+    header: dict[str, Any] = {'num_courses': len(all_courses), 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    # Write to a temporary file first so that readers never see a partial catalog
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_filename, filename)
+
+
+class CompiledCatalog(Sequence[CourseInfo]):
+    """
+    A catalog compiled by `compile_catalog`, memory-mapped instead of parsed, so that loading it takes
+    milliseconds and only the pages that are read are loaded into memory.
+
+    Each column is a read-only NumPy array over the file: one row per course for `id`, `title` and `semester`
+    (indices into the string table, `NO_STRING` for None), `dept` (an index into `dept_names`), `number`, `credits`, `rate_offered`
+    (one column per `Semester`, in `SEASONS` order) and the `OPTIONAL_FLOAT_FIELDS` (NaN for None).
+    The requirement categories, prerequisites and cross-listings of each course are stored in CSR form
+    (`*_indptr` and `*_indices` arrays): e.g. the categories of course `i` are the rows
+    `requirements_indices[requirements_indptr[i]:requirements_indptr[i + 1]]` of `categories`, whose columns
+    are the fields of `ReqCategoryInfo`. Prerequisites have one more level: the groups of course `i` are the
+    rows `prerequisites_indptr[i]` to `prerequisites_indptr[i + 1]` of the `prerequisite_groups_*` CSR pair.
+
+    It is also a sequence of `CourseInfo`s (with empty `sections`), so it can be passed to code that expects a
+    list of course infos. Indexing decodes only the courses that are read (once each), but iterating decodes
+    all of them at once, which is much faster than one by one. Building a `CatalogIndex` iterates, so a
+    catalog that is indexed (like the app's) is fully decoded, and the memory-mapping only saves the parsing.
+    """
+    id: np.ndarray
+    title: np.ndarray
+    semester: np.ndarray
+    dept: np.ndarray
+    number: np.ndarray
+    credits: np.ndarray
+    rate_offered: np.ndarray
+    categories: np.ndarray
+    course_quality: np.ndarray
+    instructor_quality: np.ndarray
+    difficulty: np.ndarray
+    work_required: np.ndarray
+    requirements_indptr: np.ndarray
+    requirements_indices: np.ndarray
+    prerequisites_indptr: np.ndarray
+    prerequisite_groups_indptr: np.ndarray
+    prerequisite_groups_indices: np.ndarray
+    crosslistings_indptr: np.ndarray
+    crosslistings_indices: np.ndarray
+    dept_names: np.ndarray
+    string_data: np.ndarray
+    string_offsets: np.ndarray
+
+    def __init__(self, buffer: Any) -> None:
+        self.buffer = buffer
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a compiled catalog')
+        header_length = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], 'little')
+        header = json.loads(bytes(buffer[len(MAGIC) + 8:len(MAGIC) + 8 + header_length]))
+        data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+        self.num_courses: int = header['num_courses']
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            array = np.frombuffer(buffer, dtype, count, data_start + spec['offset']).reshape(spec['shape'])
+            setattr(self, name, array)
+        # The courses that were decoded so far, by index
+        self.decoded: list[Optional[CourseInfo]] = [None] * self.num_courses
+        self.num_decoded = 0
+
+    @classmethod
+    def load(cls, filename: str) -> 'CompiledCatalog':
+        with open(filename, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @cached_property
+    def strings(self) -> list[str]:
+        """ The string table. """
+        data = bytes(self.string_data)
+        offsets = self.string_offsets.tolist()
+        return [data[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+
+    def string(self, i: int) -> Optional[str]:
+        """ The i-th string of the string table (None for `NO_STRING`), without decoding the whole table. """
+        if i == NO_STRING:
+            return None
+        start, end = self.string_offsets[i:i + 2].tolist()
+        return bytes(self.string_data[start:end]).decode()
+
+    def decode_course(self, i: int) -> CourseInfo:
+        """ Decode the i-th course from the columns. """
+        string = self.string
+        def row(indptr: np.ndarray, indices: np.ndarray, j: int) -> list[int]:
+            start, end = indptr[j:j + 2].tolist()
+            return indices[start:end].tolist()
+
+        category_fields = list(ReqCategoryInfo.__annotations__)
+        course: dict[str, Any] = {
+            'id': string(int(self.id[i])),
+            'title': string(int(self.title[i])),
+            'semester': string(int(self.semester[i])),
+            'rate_offered': dict(zip(SEASONS, self.rate_offered[i].tolist())),
+            'prerequisites': [
+                [string(c) for c in row(self.prerequisite_groups_indptr, self.prerequisite_groups_indices, group)]
+                for group in range(*self.prerequisites_indptr[i:i + 2].tolist())
+            ],
+            'crosslistings': [string(c) for c in row(self.crosslistings_indptr, self.crosslistings_indices, i)],
+            'requirements': [
+                dict(zip(category_fields, map(string, self.categories[category].tolist())))
+                for category in row(self.requirements_indptr, self.requirements_indices, i)
+            ],
+            'sections': [],
+            'credits': float(self.credits[i]),
+        }
+        for field in OPTIONAL_FLOAT_FIELDS:
+            value = float(getattr(self, field)[i])
+            course[field] = None if value != value else value
+        return course  # type: ignore
+
+    def decode_all(self) -> None:
+        """
+        Decode the courses that weren't decoded yet, column by column
+        (reading NumPy arrays one element at a time is much slower than converting them once).
+        """
+        # Decoding allocates many containers but no reference cycles, so the collector would only slow it down
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for i, course in enumerate(self.decode_courses()):
+                if self.decoded[i] is None:
+                    self.decoded[i] = course
+            self.num_decoded = self.num_courses
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def decode_courses(self) -> list[CourseInfo]:
+        # NO_STRING (-1) indexes the None at the end
+        strings: list[Optional[str]] = [*self.strings, None]
+        def string_column(name: str) -> list[Optional[str]]:
+            return [strings[i] for i in getattr(self, name).tolist()]
+        def rows(indptr: list[int], values: list) -> list[list]:
+            return [values[start:end] for start, end in zip(indptr, indptr[1:])]
+
+        category_fields = list(ReqCategoryInfo.__annotations__)
+        categories = [dict(zip(category_fields, map(strings.__getitem__, row))) for row in self.categories.tolist()]
+        prerequisite_groups = rows(self.prerequisite_groups_indptr.tolist(), string_column('prerequisite_groups_indices'))
+        optional_floats = [
+            [None if value != value else value for value in getattr(self, field).tolist()]
+            for field in OPTIONAL_FLOAT_FIELDS
+        ]
+        courses: list[dict[str, Any]] = []
+        for (
+            course_id, title, semester, rate_offered, prerequisites, crosslistings, requirements, credits, *values
+        ) in zip(
+            string_column('id'),
+            string_column('title'),
+            string_column('semester'),
+            self.rate_offered.tolist(),
+            rows(self.prerequisites_indptr.tolist(), prerequisite_groups),
+            rows(self.crosslistings_indptr.tolist(), string_column('crosslistings_indices')),
+            rows(self.requirements_indptr.tolist(), self.requirements_indices.tolist()),
+            self.credits.tolist(),
+            *optional_floats,
+        ):
+            course = {
+                'id': course_id,
+                'title': title,
+                'semester': semester,
+                'rate_offered': dict(zip(SEASONS, rate_offered)),
+                'prerequisites': prerequisites,
+                'crosslistings': crosslistings,
+                'requirements': [categories[row].copy() for row in requirements],
+                'sections': [],
+                'credits': credits,
+            }
+            course.update(zip(OPTIONAL_FLOAT_FIELDS, values))
+            courses.append(course)
+        return courses  # type: ignore
+
+    def course_ids(self) -> list[Id]:
+        return [self.strings[i] for i in self.id.tolist()]
+
+    def __len__(self) -> int:
+        return self.num_courses
+
+    @overload
+    def __getitem__(self, i: int) -> CourseInfo: ...
+    @overload
+    def __getitem__(self, i: slice) -> list[CourseInfo]: ...
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.num_courses))]
+        if i < 0:
+            i += self.num_courses
+        if not 0 <= i < self.num_courses:
+            raise IndexError('course index out of range')
+        course = self.decoded[i]
+        if course is None:
+            course = self.decoded[i] = self.decode_course(i)
+            self.num_decoded += 1
+        return course
+
+    def __iter__(self) -> Iterator[CourseInfo]:
+        if self.num_decoded < self.num_courses:
+            self.decode_all()
+        return iter(self.decoded)  # type: ignore
@@ -1,6 +1,85 @@
+from collections import defaultdict
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Lock, Thread
+from time import sleep
+from typing import Any, Iterator
 from cp2_types import CourseInfo, Semester
 import pytest
 
+
+class StubApiServer:
+    """
+    A local HTTP/1.1 server (with keep-alive) that serves JSON `documents` by path, standing in for the
+    PennCourses API in tests and benchmarks. The first `fail_first[path]` requests for a path get a 503,
+    and every response is delayed by `latency` seconds to simulate the network. Responses have an `ETag`,
+    and conditional requests (`If-None-Match`) for unchanged documents get a 304.
+    """
+
+    def __init__(self, documents: dict[str, Any], latency: float = 0.0) -> None:
+        self.documents = documents
+        self.latency = latency
+        self.fail_first: defaultdict[str, int] = defaultdict(int)
+        self.num_requests: defaultdict[str, int] = defaultdict(int)
+        self.num_not_modified: defaultdict[str, int] = defaultdict(int)
+        self.client_addresses: set[tuple[str, int]] = set()
+        self.lock = Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self) -> None:
+                with stub.lock:
+                    stub.num_requests[self.path] += 1
+                    stub.client_addresses.add(self.client_address)
+                    fail = stub.num_requests[self.path] <= stub.fail_first[self.path]
+                if stub.latency:
+                    sleep(stub.latency)
+                if fail or self.path not in stub.documents:
+                    self.send_response(503 if fail else 404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = json.dumps(stub.documents[self.path]).encode()
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if self.headers.get('If-None-Match') == etag:
+                    with stub.lock:
+                        stub.num_not_modified[self.path] += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_api_server() -> Iterator[StubApiServer]:
+    server = StubApiServer({})
+    yield server
+    server.close()
+
+
 @pytest.fixture
 def sample_courses_info() -> list[CourseInfo]:
     return [
@@ -18,6 +18,10 @@ class CompletedCourse(NamedTuple):
     semester: Index
     satisfies: list[Uid]
 
+class Student(NamedTuple):
+    course_requests: list[CourseRequest]
+    completed_courses: list[CompletedCourse]
+
 class ReqCategoryInfo(TypedDict):
     id: Id
     code: str
@@ -52,6 +56,15 @@ class CourseInfo(TypedDict):
     sections: list[dict]
     credits: float
 
+def parse_course_id(course_id: Id) -> tuple[str, int]:
+    """ Split a course id like 'CIS-120' into its department and number (0 if the number isn't numeric). """
+    dept, number_str = course_id.split('-')
+    try:
+        number = int(number_str)
+    except:
+        number = 0
+    return dept, number
+
 class BaseRequirement:
     """
     A requirement that must be satisfied. Contains several optional
@@ -121,11 +134,7 @@ class BaseRequirement:
             return True
         categories = set(req['id'] for req in course_info['requirements'])
         course_id = course_info['id']
-        dept, number_str = course_id.split('-')
-        try:
-            number = int(number_str)
-        except:
-            number = 0
+        dept, number = parse_course_id(course_id)
 
         category_satisfied = not self.categories or not categories.isdisjoint(self.categories)
         dept_satisfied = not self.depts or dept in self.depts
@@ -284,7 +293,7 @@ class ScheduleParams():
         self.max_double_counts = max_double_counts
         self.cannot_triple_count = cannot_triple_count
         if not total_max_credits:
-            total_max_credits = max_credits_per_semester * num_semesters
+            self.total_max_credits = max_credits_per_semester * num_semesters
 
 # SemesterSchedule is a list of course ids, and Schedule is a list of SemesterSchedules
 SemesterSchedule = list[Id]
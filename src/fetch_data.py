@@ -1,23 +1,55 @@
-from collections import defaultdict
-from typing import Optional, Callable, cast
+from typing import Any, Optional, Callable, cast
+from compiled_catalog import SEASONS, CompiledCatalog, compile_catalog
 from cp2_types import CourseInfo, Semester, Id
-from multiprocessing import Pool
+from http_cache import HttpCache
+from http_fetch import AsyncFetcher, FetchResult
+from math import inf
+from time import time
+import numpy as np
 import requests
 import os.path
 import json
 
 COURSES_CACHE_FILE = 'data/all_courses.json'
 COURSE_INFOS_CACHE_FILE = 'data/course_infos.json'
+# Course infos fetched so far by an unfinished `compute_course_infos`
+COURSE_INFOS_CHECKPOINT_FILE = 'data/course_infos.partial.jsonl'
 COURSE_OFFER_RATES_CACHE_FILE = 'data/offer_rates.json'
 COURSE_HISTORICAL_CREDITS_CACHE_FILE = 'data/historical_credits.json'
+# The sorted ids of the courses offered in each semester (see `semester_course_ids`)
+SEMESTER_COURSE_IDS_DIR = 'data/semester_course_ids'
+# The output of `fetch_course_data`, compiled (see `compiled_catalog.py`)
+COMPILED_CATALOG_FILE = 'data/course_infos.cp2cat'
 BASE_URL = 'https://penncourseplan.com/api/base'
 LIST_COURSES_API_URL = f'{BASE_URL}/{{}}/courses/'
 REQS_API_URL = f'{BASE_URL}/current/requirements/'
 GET_COURSE_API = f'{BASE_URL}/current/courses/{{}}/'
+GET_SEM_COURSE_API = f'{BASE_URL}/{{}}/courses/{{}}/'
+# Every API response is cached by URL (see `HttpCache`)
+HTTP_CACHE = HttpCache()
+# The number of requests in flight at once while fetching course infos, and the max number of requests per second
+FETCH_CONCURRENCY = 20
+FETCH_RATE_LIMIT: Optional[float] = None
 
-def get_cached_value(filename: str, compute_value: Callable[[], dict]):
-    # TODO: add expiration
-    if os.path.exists(filename):
+def write_json_atomically(filename: str, value: Any) -> None:
+    """ Write the value to a temporary file and rename it, so that the file is never left half-written. """
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_filename, filename)
+
+def get_cached_value(
+    filename: str,
+    compute_value: Callable[[], Any],
+    max_age: float = inf,
+    on_saved: Optional[Callable[[], None]] = None,
+):
+    """
+    Return the value cached in the file, or compute and cache it if the file is missing or older than `max_age`
+    seconds. The values computed from the API are cheap to recompute, since its responses are cached too.
+    `on_saved` is called once a computed value is in the file (e.g. to delete the value's checkpoint).
+    """
+    if os.path.exists(filename) and time() - os.path.getmtime(filename) <= max_age:
         print('Cache hit!')
         with open(filename, 'r') as f:
             return json.loads(f.read())
@@ -25,40 +57,103 @@ def get_cached_value(filename: str, compute_value: Callable[[], dict]):
 
     val = compute_value()
     if val is not None:
-        with open(filename, 'x') as f:
-            f.write(json.dumps(val))
-            return val
+        write_json_atomically(filename, val)
+        if on_saved is not None:
+            on_saved()
+    return val
+
+def read_checkpoint(filename: str) -> dict[Id, CourseInfo]:
+    """
+    Read the course infos saved in the JSON Lines checkpoint file (one course info per line), by id.
+    A partial last line (if the program was killed while writing it) is cut off, so that appending can continue.
+    """
+    course_infos: dict[Id, CourseInfo] = {}
+    if not os.path.exists(filename):
+        return course_infos
+    end_of_valid_lines = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            try:
+                course_info = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            course_infos[course_info['id']] = course_info
+            end_of_valid_lines += len(line)
+    if end_of_valid_lines < os.path.getsize(filename):
+        os.truncate(filename, end_of_valid_lines)
+    return course_infos
 
-def fetch_course_info(params) -> Optional[CourseInfo]:
-    i, course_id, n_total_courses = params
-    if i % 50 == 0:
-        print(f'Fetching info for course {i}/{n_total_courses}')
-    try:
-        course_info = json.loads(requests.get(GET_COURSE_API.format(course_id)).text)
+def fetch_course_infos(
+    course_ids: list[Id],
+    fetcher: Optional[AsyncFetcher] = None,
+    get_course_api: str = GET_COURSE_API,
+    on_course_info: Optional[Callable[[CourseInfo], None]] = None,
+) -> tuple[dict[Id, CourseInfo], dict[Id, str]]:
+    """
+    Fetch the info of each course concurrently (see `AsyncFetcher`). Return the info of each course that was
+    fetched, and the reason that each other course failed. `on_course_info` is called with each course info
+    as soon as it is fetched.
+    """
+    course_infos: dict[Id, CourseInfo] = {}
+    failures: dict[Id, str] = {}
+    num_done = 0
+
+    def on_result(course_id: Id, result: FetchResult) -> None:
+        nonlocal num_done
+        num_done += 1
+        if num_done % 50 == 0:
+            print(f'Fetched info for course {num_done}/{len(course_ids)}')
+        if result.error is not None:
+            print(f'Failed to fetch info for course {course_id} ({result.error}, {result.attempts} attempts)')
+            failures[course_id] = result.error
+            return
+        course_info = result.value
         # We don't need this attribute and it takes up lots of space
-        del course_info['description']
-        return course_info
-    except:
-        print(f'Failed to fetch info for course {course_id}')
-    return None
+        course_info.pop('description', None)
+        course_infos[course_id] = course_info
+        if on_course_info is not None:
+            on_course_info(course_info)
 
-def compute_course_infos(all_courses):
-    course_ids_and_idx = [(i, course['id'], len(all_courses)) for i, course in enumerate(all_courses)]
-    with open(COURSES_CACHE_FILE, 'x') as f:
-        f.write('[')
-        with Pool(20) as p:
-            course_infos = p.imap_unordered(fetch_course_info, course_ids_and_idx, 1)
-            i = 0
-            for course_info in course_infos:
-                i += 1
-                if course_info is not None:
-                    f.write(
-                        json.dumps(course_info) 
-                        + (', ' if i <= len(all_courses) else '')
-                    )
-        f.write(']')
+    if fetcher is None:
+        with AsyncFetcher(FETCH_CONCURRENCY, FETCH_RATE_LIMIT, cache=HTTP_CACHE) as fetcher:
+            fetcher.fetch_all_sync({c: get_course_api.format(c) for c in course_ids}, on_result)
+    else:
+        fetcher.fetch_all_sync({c: get_course_api.format(c) for c in course_ids}, on_result)
+    return course_infos, failures
 
-    return None
+def compute_course_infos(
+    all_courses: list[dict],
+    checkpoint_filename: str = COURSE_INFOS_CHECKPOINT_FILE,
+    get_course_api: str = GET_COURSE_API,
+    fetcher: Optional[AsyncFetcher] = None,
+) -> list[CourseInfo]:
+    """
+    Fetch the info of every course in the list of courses, in the same order (leaving out courses that failed).
+
+    Each course info is appended to a JSON Lines checkpoint file as soon as it is fetched, so an interrupted
+    refresh resumes where it stopped: courses that are already in the checkpoint aren't fetched again.
+    The caller caches the returned list, and deletes the checkpoint once the list is saved (see `fetch_course_data`),
+    so that the fetched course infos aren't lost if saving fails.
+    """
+    course_infos = read_checkpoint(checkpoint_filename)
+    if course_infos:
+        print(f'Resuming from {len(course_infos)} course infos in {checkpoint_filename}')
+    course_ids_to_fetch = list(dict.fromkeys(
+        course['id'] for course in all_courses if course['id'] not in course_infos
+    ))
+    with open(checkpoint_filename, 'a') as f:
+        def save(course_info: CourseInfo) -> None:
+            f.write(json.dumps(course_info) + '\n')
+            f.flush()
+        fetched_course_infos, failures = fetch_course_infos(
+            course_ids_to_fetch, fetcher, get_course_api, on_course_info=save
+        )
+    course_infos.update(fetched_course_infos)
+    if failures:
+        print(f'Failed to fetch {len(failures)} courses: {", ".join(sorted(failures))}')
+    return [course_infos[c] for c in dict.fromkeys(course['id'] for course in all_courses) if c in course_infos]
 
 def get_top_level_operator(prereq_string: str) -> str:
     """ 
@@ -147,44 +242,98 @@ def parse_prerequisites(all_courses: list[dict]) -> list[CourseInfo]:
     
     return cast(list[CourseInfo], all_courses)
 
-def historical_offered_rate(curr_sem: str) -> dict[Id, dict[str, float]]:
+def semester_ttl(year: int, season: Semester, curr_sem: str) -> Optional[float]:
+    """ The TTL of API responses about a semester: data about past semesters doesn't change. """
+    return None if f'{year}{season.value}' == curr_sem else inf
+
+def historical_semesters(curr_sem: str, horizon_years: int = 5) -> list[str]:
+    """ The semesters (like '2022A') of the last `horizon_years` years, up to and including the current one. """
+    curr_year, curr_season = int(curr_sem[:4]), curr_sem[4]
+    return [
+        f'{year}{season.value}'
+        for year in range(curr_year, curr_year - horizon_years, -1)
+        for season in Semester
+        if not (year == curr_year and season > curr_season)
+    ]
+
+def semester_course_ids(
+    semesters: list[str],
+    curr_sem: str,
+    directory: str = SEMESTER_COURSE_IDS_DIR,
+    list_courses_api_url: str = LIST_COURSES_API_URL,
+    fetcher: Optional[AsyncFetcher] = None,
+) -> dict[str, np.ndarray]:
+    """
+    Return the sorted array of the ids (as UTF-8 bytes) of the courses offered in each semester, leaving out
+    semesters whose listing couldn't be fetched.
+
+    Each listing is saved to `directory` as a `.npy` array. Past semesters don't change, so their saved arrays
+    are used forever; the current semester is fetched again (through the HTTP cache). Listings are fetched
+    concurrently, so a new term costs one download.
+    """
+    def path(semester: str) -> str:
+        return os.path.join(directory, f'{semester}.npy')
+
+    ids_of_semester: dict[str, np.ndarray] = {}
+    urls: dict[str, str] = {}
+    for semester in semesters:
+        if semester != curr_sem and os.path.exists(path(semester)):
+            ids_of_semester[semester] = np.load(path(semester))
+        else:
+            urls[semester] = list_courses_api_url.format(semester)
+
+    if urls:
+        print(f'Fetching the courses offered in {", ".join(urls)}')
+        if fetcher is None:
+            with AsyncFetcher(FETCH_CONCURRENCY, FETCH_RATE_LIMIT, cache=HTTP_CACHE) as fetcher:
+                results = fetcher.fetch_all_sync(urls)
+        else:
+            results = fetcher.fetch_all_sync(urls)
+        os.makedirs(directory, exist_ok=True)
+        for semester, result in results.items():
+            if result.error is not None:
+                print(f'Failed to fetch the courses offered in {semester} ({result.error}), leaving it out')
+                continue
+            ids = np.unique(np.array([course['id'].encode() for course in result.value], dtype=bytes))
+            tmp_filename = f'{path(semester)}.{os.getpid()}.tmp'
+            with open(tmp_filename, 'wb') as f:
+                np.save(f, ids)
+            os.replace(tmp_filename, path(semester))
+            ids_of_semester[semester] = ids
+    return {semester: ids_of_semester[semester] for semester in semesters if semester in ids_of_semester}
+
+def historical_offered_rate(
+    curr_sem: str,
+    directory: str = SEMESTER_COURSE_IDS_DIR,
+    list_courses_api_url: str = LIST_COURSES_API_URL,
+    fetcher: Optional[AsyncFetcher] = None,
+) -> dict[Id, dict[str, float]]:
     """
     Look over the last 5 years to guess at which season each
     course is offered in. Return the fraction of semesters
     of each season that each course was offered.
     """
     print('Fetching historical data to see which semester courses are offered')
-    HORIZON_YEARS = 5
-    curr_year, curr_season = int(curr_sem[:4]), curr_sem[4]
-    num_semesters: dict[str, int] = defaultdict(int)
-    course_seasons_rates: dict[Id, dict[str, float]] = defaultdict(
-        lambda: {season.value: 0 for season in Semester}
+    ids_of_semester = semester_course_ids(
+        historical_semesters(curr_sem), curr_sem, directory, list_courses_api_url, fetcher
     )
-    
-    for year in range(curr_year, curr_year - HORIZON_YEARS, -1):
-        for season in Semester:
-            if year == curr_year and season > curr_season:
-                continue
-
-            LIST_SEM_COURSES_API_URL = LIST_COURSES_API_URL.format(
-                f'{year}{season.value}'
-            )
-            print(LIST_SEM_COURSES_API_URL)
-            num_semesters[season.value] += 1
-            courses_offered = set(
-                course['id'] for course in 
-                json.loads(
-                    requests.get(LIST_SEM_COURSES_API_URL).text
-                )
-            )
-            for course_id in courses_offered:
-                course_seasons_rates[course_id][season.value] += 1.0
+    if not ids_of_semester:
+        return {}
 
-    for course_id, seasons_rates in course_seasons_rates.items():
-        for season_str in seasons_rates:
-            seasons_rates[season_str] /= num_semesters[season_str]
+    # Count the semesters of each season that each course was offered in, one semester at a time
+    all_ids = np.unique(np.concatenate(list(ids_of_semester.values())))
+    num_offered = np.zeros((len(all_ids), len(SEASONS)))
+    num_semesters = np.zeros(len(SEASONS))
+    for semester, ids in ids_of_semester.items():
+        season = SEASONS.index(semester[4])
+        num_offered[np.searchsorted(all_ids, ids), season] += 1
+        num_semesters[season] += 1
+    rates = np.divide(num_offered, num_semesters, out=np.zeros_like(num_offered), where=num_semesters > 0)
 
-    return course_seasons_rates
+    return {
+        course_id.decode(): dict(zip(SEASONS, seasons_rates))
+        for course_id, seasons_rates in zip(all_ids.tolist(), rates.tolist())
+    }
 
 
 def get_credits_from_old_sections(course_id, curr_sem) -> float:
@@ -200,10 +349,15 @@ def get_credits_from_old_sections(course_id, curr_sem) -> float:
             if year == curr_year and season > curr_season:
                 continue
 
-            res = requests.get(GET_COURSE_API.format(course_id))
-            if res.status_code == 200:
-                old_course = json.loads(res.text)
-                
+            try:
+                old_course = HTTP_CACHE.get_json(
+                    GET_SEM_COURSE_API.format(f'{year}{season.value}', course_id),
+                    semester_ttl(year, season, curr_sem)
+                )
+            except requests.RequestException:
+                # Not offered that semester
+                continue
+            else:
                 if credits := next((
                         cu for section in old_course.get('sections', []) 
                         if (cu := section['credits']) > 0
@@ -215,8 +369,12 @@ def get_credits_from_old_sections(course_id, curr_sem) -> float:
                 
 
 # TODO: deduplicate the entries
-def fetch_course_data() -> list[CourseInfo]:
-    """ Fetch a list of each course's information from the PennCourses API. """
+def fetch_course_data(max_age: float = inf) -> list[CourseInfo]:
+    """
+    Fetch a list of each course's information from the PennCourses API.
+    The cached data is refreshed if it is older than `max_age` seconds, which only downloads the
+    API responses that changed (see `HttpCache`).
+    """
     print('Fetching all courses\' requirement categories')
     LIST_CURRENT_SEM_COURSES_API_URL = LIST_COURSES_API_URL.format('current')
     course_infos: list[dict] = get_cached_value(
@@ -224,16 +382,18 @@ def fetch_course_data() -> list[CourseInfo]:
         lambda: compute_course_infos(
             get_cached_value(
                 COURSES_CACHE_FILE, 
-                lambda: json.loads(
-                    requests.get(LIST_CURRENT_SEM_COURSES_API_URL).text
-                )
+                lambda: HTTP_CACHE.get_json(LIST_CURRENT_SEM_COURSES_API_URL),
+                max_age
             )
-        )
+        ),
+        max_age,
+        on_saved=lambda: os.remove(COURSE_INFOS_CHECKPOINT_FILE),
     )
     curr_sem = course_infos[0]['semester']
     course_seasons_rates = get_cached_value(
         COURSE_OFFER_RATES_CACHE_FILE,
-        lambda: historical_offered_rate(curr_sem)
+        lambda: historical_offered_rate(curr_sem),
+        max_age
     )
     course_historical_credits = get_cached_value(
         COURSE_HISTORICAL_CREDITS_CACHE_FILE, 
@@ -245,7 +405,8 @@ def fetch_course_data() -> list[CourseInfo]:
             # TODO: lots of courses with no data, haven't been taught lately...
             # will have to figure out how to handle them
             and course['title']
-        }
+        },
+        max_age
     )
     for course in course_infos:
         course['rate_offered'] = course_seasons_rates.get(
@@ -264,4 +425,22 @@ def fetch_course_data() -> list[CourseInfo]:
                     0.0
                 )
 
-    return parse_prerequisites(course_infos)
\ No newline at end of file
+    return parse_prerequisites(course_infos)
+
+def load_course_data(max_age: float = inf) -> CompiledCatalog:
+    """
+    Return the course infos of `fetch_course_data`, memory-mapped from the compiled catalog (see `CompiledCatalog`).
+    The catalog is compiled again if it is older than `max_age` seconds or than the files it was compiled from.
+    """
+    sources = [COURSE_INFOS_CACHE_FILE, COURSE_OFFER_RATES_CACHE_FILE, COURSE_HISTORICAL_CREDITS_CACHE_FILE]
+    if (
+        not os.path.exists(COMPILED_CATALOG_FILE)
+        or time() - os.path.getmtime(COMPILED_CATALOG_FILE) > max_age
+        or any(
+            os.path.getmtime(source) > os.path.getmtime(COMPILED_CATALOG_FILE)
+            for source in sources if os.path.exists(source)
+        )
+    ):
+        print('Compiling the catalog')
+        compile_catalog(fetch_course_data(max_age), COMPILED_CATALOG_FILE)
+    return CompiledCatalog.load(COMPILED_CATALOG_FILE)
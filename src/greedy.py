@@ -0,0 +1,209 @@
+from collections import defaultdict
+from typing import TYPE_CHECKING, NamedTuple
+from cp2_types import BaseRequirement, Id, Index, Requirement, Uid
+
+if TYPE_CHECKING:
+    from solver import ScheduleGenerator
+
+
+class GreedySchedule(NamedTuple):
+    # semester_of[c] is the semester that course c is taken in (courses that aren't taken are left out)
+    semester_of: dict[Id, Index]
+    # counts_for[c] contains the uids of the BaseRequirements that course c counts for
+    counts_for: dict[Id, list[Uid]]
+
+
+class GreedyPlanner:
+    """
+    Builds a candidate schedule in polynomial time, to be used as a hint for the CP model.
+    The schedule isn't guaranteed to be feasible (e.g. it may leave requirements unsatisfied
+    when it runs out of room), but it's usually close to one.
+
+    1. Completed and requested courses are taken first.
+    2. Requirements are assigned courses, starting with the base requirements that have the fewest
+       eligible courses (so that courses required by name come first) and then the multi-requirements.
+       Courses that are already taken are preferred, when they are allowed to double count.
+    3. Missing prerequisites of the chosen courses are added.
+    4. Courses are packed into the earliest semesters that respect their prerequisites, the seasons
+       that they are offered in and `max_credits_per_semester`, longest prereq chains first.
+    """
+
+    def __init__(self, generator: 'ScheduleGenerator') -> None:
+        self.generator = generator
+        self.course_id_to_course = generator.course_id_to_course
+        self.schedule_params = generator.schedule_params
+        self.first_future_sem = generator.last_completed_sem + 1
+
+        # Courses to take, in the order they were chosen
+        self.chosen: dict[Id, None] = {}
+        self.counts_for: defaultdict[Id, list[BaseRequirement]] = defaultdict(list)
+        self.blocks_of_course: defaultdict[Id, set[Index]] = defaultdict(set)
+        self.double_counted_credits: defaultdict[tuple[Index, Index], float] = defaultdict(float)
+        self.semester_of: dict[Id, Index] = {}
+
+    def plan(self) -> GreedySchedule:
+        generator = self.generator
+        for course_id, sem, satisfies in generator.completed_courses:
+            self.semester_of[course_id] = sem
+            self.choose(course_id)
+            for br_uid in satisfies:
+                if br_uid in generator.representative_of:
+                    self.count(course_id, generator.representative_of[br_uid])
+        for course_id, sem in generator.course_requests:
+            if course_id in self.semester_of:
+                continue
+            if sem and sem > generator.last_completed_sem and (course_id, sem) in generator.takes_course_in_sem:
+                self.semester_of[course_id] = sem
+            self.choose(course_id)
+
+        top_level_requirements = [
+            (b, req) for b, block in enumerate(generator.requirement_blocks) for req in block
+        ]
+        # Requirements with fewer options first
+        top_level_requirements.sort(key=lambda b_req: (
+            b_req[1].is_multi_requirement,
+            0 if b_req[1].is_multi_requirement else len(self.candidates(b_req[1].base_requirement))
+        ))
+        for b, req in top_level_requirements:
+            self.satisfy(req, b)
+
+        self.add_missing_prerequisites()
+        self.place_courses()
+        return GreedySchedule(
+            semester_of=self.semester_of,
+            counts_for={
+                c: [br.uid for br in self.counts_for[c]]
+                for c in self.semester_of
+            },
+        )
+
+    def choose(self, course_id: Id) -> None:
+        self.chosen[course_id] = None
+
+    def count(self, course_id: Id, br: BaseRequirement) -> None:
+        """ Count the course for the BaseRequirement and update the number of double counted credits. """
+        b = self.generator.block_of_base_requirement[br.uid]
+        credits = self.course_id_to_course[course_id]['credits']
+        for other_b in self.blocks_of_course[course_id]:
+            self.double_counted_credits[min(b, other_b), max(b, other_b)] += credits
+        self.blocks_of_course[course_id].add(b)
+        self.counts_for[course_id].append(br)
+
+    def can_count(self, course_id: Id, b: Index) -> bool:
+        """ Whether the course can count for another requirement in block b. """
+        if not self.generator.semesters_of_course[course_id]:
+            return False
+        blocks = self.blocks_of_course[course_id]
+        if b in blocks:
+            return False
+        credits = self.course_id_to_course[course_id]['credits']
+        for other_b in blocks:
+            max_double_counts = self.schedule_params.max_double_counts.get((min(b, other_b), max(b, other_b)))
+            if max_double_counts is not None and self.double_counted_credits[min(b, other_b), max(b, other_b)] + credits > max_double_counts:
+                return False
+        cannot_triple_count = self.schedule_params.cannot_triple_count
+        if b in cannot_triple_count and len(blocks & cannot_triple_count) >= 2:
+            return False
+        return True
+
+    def candidates(self, br: BaseRequirement) -> list[Id]:
+        """ Return the courses that can count for the BaseRequirement (or its group's representative), best first. """
+        br = self.generator.representative_of[br.uid]
+        b = self.generator.block_of_base_requirement[br.uid]
+        semesters_of_course = self.generator.semesters_of_course
+        return sorted(
+            (c for c in self.generator.courses_of_base_requirement[br.uid] if self.can_count(c, b)),
+            # Prefer courses that we already take, then courses that can be taken early
+            key=lambda c: (c not in self.chosen, semesters_of_course[c][0])
+        )
+
+    def satisfy(self, req: Requirement, b: Index) -> float:
+        """ Try to satisfy the requirement, and return the number of credits that count for it (0 if not satisfied). """
+        if not req.is_multi_requirement:
+            candidates = self.candidates(req.base_requirement)
+            if not candidates:
+                return 0
+            course_id = candidates[0]
+            self.choose(course_id)
+            self.count(course_id, self.generator.representative_of[req.base_requirement.uid])
+            return self.course_id_to_course[course_id]['credits']
+
+        num_satisfied = 0
+        credits = 0.0
+        for subreq in req.multi_requirements:
+            if num_satisfied >= req.min_satisfied_reqs and credits >= req.min_credits:
+                break
+            subreq_credits = self.satisfy(subreq, b)
+            if subreq_credits:
+                num_satisfied += 1
+                credits += subreq_credits
+        return credits if num_satisfied >= req.min_satisfied_reqs and credits >= req.min_credits else 0
+
+    def add_missing_prerequisites(self) -> None:
+        """ For each OR-group of prereqs of a chosen course, choose a course from the group if there isn't one yet. """
+        semesters_of_course = self.generator.semesters_of_course
+        to_visit = list(self.chosen)
+        while to_visit:
+            c = to_visit.pop()
+            if c in self.semester_of and self.semester_of[c] < self.first_future_sem:
+                continue
+            for or_prereqs in self.course_id_to_course[c]['prerequisites']:
+                or_prereq_ids = [p for p in or_prereqs if p in self.course_id_to_course and semesters_of_course[p]]
+                if not or_prereq_ids or any(p in self.chosen for p in or_prereq_ids):
+                    continue
+                prereq_id = min(or_prereq_ids, key=lambda p: semesters_of_course[p][0])
+                self.choose(prereq_id)
+                to_visit.append(prereq_id)
+
+    def place_courses(self) -> None:
+        """
+        Place the chosen courses semester by semester, dropping the ones that don't fit. In each semester,
+        the courses whose prereqs have been placed are taken in order of the length of the longest chain
+        of chosen courses that depend on them, so that long prereq chains are started early.
+        """
+        semesters_of_course = self.generator.semesters_of_course
+        max_credits = self.schedule_params.max_credits_per_semester
+        credits_in_sem: defaultdict[Index, float] = defaultdict(float)
+        for c, s in self.semester_of.items():
+            credits_in_sem[s] += self.course_id_to_course[c]['credits']
+
+        unplaced = [c for c in self.chosen if c not in self.semester_of]
+        dependents: defaultdict[Id, list[Id]] = defaultdict(list)
+        for c in unplaced:
+            for or_prereqs in self.course_id_to_course[c]['prerequisites']:
+                for p in or_prereqs:
+                    if p in self.chosen:
+                        dependents[p].append(c)
+
+        chain_length: dict[Id, int] = {}
+        def get_chain_length(c: Id) -> int:
+            if c not in chain_length:
+                chain_length[c] = 0  # guards against prereq cycles
+                chain_length[c] = 1 + max((get_chain_length(d) for d in dependents[c]), default=0)
+            return chain_length[c]
+        unplaced.sort(key=get_chain_length, reverse=True)
+
+        def prereqs_placed_before(c: Id, sem: Index) -> bool:
+            return all(
+                any(self.semester_of.get(p, sem) < sem for p in or_prereqs)
+                for or_prereqs in self.course_id_to_course[c]['prerequisites']
+            )
+
+        for s in range(self.first_future_sem, self.schedule_params.num_semesters + 1):
+            still_unplaced = []
+            for c in unplaced:
+                credits = self.course_id_to_course[c]['credits']
+                if s in semesters_of_course[c] and credits_in_sem[s] + credits <= max_credits and prereqs_placed_before(c, s):
+                    self.semester_of[c] = s
+                    credits_in_sem[s] += credits
+                else:
+                    still_unplaced.append(c)
+            unplaced = still_unplaced
+
+        for c in unplaced:
+            self.counts_for.pop(c, None)
+
+
+def greedy_schedule(generator: 'ScheduleGenerator') -> GreedySchedule:
+    """ Build a candidate schedule for the generator's model in polynomial time (see `GreedyPlanner`). """
+    return GreedyPlanner(generator).plan()
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+from threading import Lock, get_ident
+from time import time
+from typing import Any, Optional
+import requests
+
+HTTP_CACHE_DIR = 'data/http_cache'
+# How long a response is used without asking the server whether it changed, in seconds
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class HttpCache:
+    """
+    Caches JSON responses on disk by URL (one file per URL, named by the hash of the URL), so that refreshing
+    the catalog only downloads what changed.
+
+    A response is used as is for `ttl` seconds after it was fetched (callers can pass a TTL per request, e.g.
+    `math.inf` for data about past semesters, which never changes). After that it is revalidated with a
+    conditional request (`If-None-Match`/`If-Modified-Since`, from the response's `ETag`/`Last-Modified`),
+    and the server only sends the response again if it changed. Only successful responses are cached.
+
+    Attributes:
+
+        `hits: int`, `revalidated: int`, `downloads: int`
+            The number of requests that were answered from the cache without a request, answered from the
+            cache after the server said that the response didn't change, and downloaded.
+    """
+
+    def __init__(self, directory: str = HTTP_CACHE_DIR, ttl: float = DEFAULT_TTL) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.session = requests.Session()
+        # Guards the counters, since `AsyncFetcher` writes entries from several threads
+        self.lock = Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.directory, f'{hashlib.sha256(url.encode()).hexdigest()}.json')
+
+    def read(self, url: str) -> Optional[dict[str, Any]]:
+        """ Return the cache entry of the URL (with its `body`, `fetched_at` time and validators), or None. """
+        try:
+            with open(self.path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def is_fresh(self, entry: dict[str, Any], ttl: Optional[float] = None) -> bool:
+        return time() - entry['fetched_at'] <= (self.ttl if ttl is None else ttl)
+
+    def conditional_headers(self, entry: Optional[dict[str, Any]]) -> dict[str, str]:
+        """ The headers that ask the server to only send the response if it changed since the entry was fetched. """
+        headers: dict[str, str] = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def write(self, url: str, body: Any, response: requests.Response) -> None:
+        """ Cache the parsed body of a successful response. """
+        with self.lock:
+            self.downloads += 1
+        self.save({
+            'url': url,
+            'fetched_at': time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body': body,
+        })
+
+    def touch(self, entry: dict[str, Any], response: requests.Response) -> None:
+        """ Mark the entry as fresh again, after the server said that it didn't change (304 Not Modified). """
+        with self.lock:
+            self.revalidated += 1
+        entry['fetched_at'] = time()
+        entry['etag'] = response.headers.get('ETag', entry.get('etag'))
+        entry['last_modified'] = response.headers.get('Last-Modified', entry.get('last_modified'))
+        self.save(entry)
+
+    def save(self, entry: dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(entry['url'])
+        # Write to a temporary file first so that readers never see a partial entry
+        tmp_path = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def get_json(self, url: str, ttl: Optional[float] = None, timeout: float = 30.0) -> Any:
+        """
+        Return the parsed JSON response of the URL, from the cache if possible (see the class docstring).
+        Raises `requests.RequestException` if the request fails (e.g. `requests.HTTPError` for a 404).
+        """
+        entry = self.read(url)
+        if entry is not None and self.is_fresh(entry, ttl):
+            self.hits += 1
+            return entry['body']
+        response = self.session.get(url, headers=self.conditional_headers(entry), timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            self.touch(entry, response)
+            return entry['body']
+        response.raise_for_status()
+        body = response.json()
+        self.write(url, body, response)
+        return body
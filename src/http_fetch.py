@@ -0,0 +1,178 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+from time import monotonic
+from typing import Any, Callable, Hashable, NamedTuple, Optional, TypeVar
+import requests
+from requests.adapters import HTTPAdapter
+from http_cache import HttpCache
+
+K = TypeVar('K', bound=Hashable)
+
+# Responses that are worth retrying (the server is overloaded or briefly unavailable)
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class FetchResult(NamedTuple):
+    # The parsed JSON response, or None if the fetch failed
+    value: Any
+    # Why the fetch failed (None if it didn't)
+    error: Optional[str]
+    # The number of requests that were made
+    attempts: int
+
+
+class RateLimiter:
+    """ A token bucket that lets through `rate` acquisitions per second on average, in bursts of up to `burst`. """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = monotonic()
+        self.lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncFetcher:
+    """
+    Fetches many JSON documents over HTTP concurrently, for refreshing the catalog.
+
+    Requests go through one `requests.Session`, whose connection pool keeps up to `concurrency` keep-alive
+    connections per host open, instead of a new connection (and TLS handshake) per request. An asyncio event loop
+    schedules them: at most `concurrency` requests are in flight at once, at most `rate_limit` requests are started
+    per second (if set), and failed requests (connection errors, timeouts and `RETRY_STATUS_CODES`) are retried up
+    to `max_attempts` times with exponential backoff (honoring `Retry-After`). The blocking calls of the session run
+    in a thread pool of `concurrency` threads.
+
+    Every fetch returns a `FetchResult` instead of raising, so that one bad course doesn't stop a refresh.
+
+    With a `cache`, fresh cached responses are returned without a request (with 0 attempts), stale ones are
+    revalidated with a conditional request, and successful responses are cached (see `HttpCache`).
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 20,
+        rate_limit: Optional[float] = None,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 30.0,
+        cache: Optional[HttpCache] = None,
+    ) -> None:
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit, burst=concurrency) if rate_limit else None
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(concurrency)
+
+    def __enter__(self) -> 'AsyncFetcher':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.session.close()
+
+    def backoff_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """ The time to wait before retrying after the `attempt`-th failed attempt. """
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(self.max_backoff, float(retry_after))
+        # With jitter, so that requests that failed together don't all retry together
+        return min(self.max_backoff, self.backoff * 2**(attempt - 1)) * random.uniform(0.5, 1)
+
+    async def fetch(self, url: str, semaphore: asyncio.Semaphore, ttl: Optional[float] = None) -> FetchResult:
+        loop = asyncio.get_running_loop()
+        # The cache's file reads and writes run in the executor like the requests, so as not to block the event loop
+        entry = await loop.run_in_executor(self.executor, self.cache.read, url) if self.cache is not None else None
+        if entry is not None and self.cache.is_fresh(entry, ttl):
+            self.cache.hits += 1
+            return FetchResult(entry['body'], None, 0)
+        headers = self.cache.conditional_headers(entry) if self.cache is not None else {}
+        error = ''
+        for attempt in range(1, self.max_attempts + 1):
+            response: Optional[requests.Response] = None
+            async with semaphore:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                try:
+                    response = await loop.run_in_executor(
+                        self.executor, lambda: self.session.get(url, headers=headers, timeout=self.timeout)
+                    )
+                except requests.RequestException as e:
+                    error = f'{type(e).__name__}: {e}'
+            if response is not None:
+                if response.status_code == 304 and entry is not None:
+                    await loop.run_in_executor(self.executor, self.cache.touch, entry, response)
+                    return FetchResult(entry['body'], None, attempt)
+                if response.status_code == 200:
+                    try:
+                        value = response.json()
+                    except ValueError as e:
+                        return FetchResult(None, f'invalid JSON: {e}', attempt)
+                    if self.cache is not None:
+                        await loop.run_in_executor(self.executor, self.cache.write, url, value, response)
+                    return FetchResult(value, None, attempt)
+                error = f'HTTP {response.status_code}'
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return FetchResult(None, error, attempt)
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self.backoff_delay(attempt, response))
+        return FetchResult(None, error, self.max_attempts)
+
+    async def fetch_all(
+        self,
+        urls: dict[K, str],
+        on_result: Optional[Callable[[K, FetchResult], None]] = None,
+        ttl: Optional[float] = None,
+    ) -> dict[K, FetchResult]:
+        """
+        Fetch the URL of each key, and return the result of each key. `on_result` is called with each
+        key and result as soon as it is done (e.g. to report progress or save it). `ttl` overrides the
+        TTL of the cache for these URLs.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if self.rate_limiter is not None:
+            # asyncio locks belong to one event loop
+            self.rate_limiter.lock = asyncio.Lock()
+
+        async def fetch_key(key: K, url: str) -> tuple[K, FetchResult]:
+            result = await self.fetch(url, semaphore, ttl)
+            if on_result is not None:
+                on_result(key, result)
+            return key, result
+
+        return dict(await asyncio.gather(*(fetch_key(key, url) for key, url in urls.items())))
+
+    def fetch_all_sync(
+        self,
+        urls: dict[K, str],
+        on_result: Optional[Callable[[K, FetchResult], None]] = None,
+        ttl: Optional[float] = None,
+    ) -> dict[K, FetchResult]:
+        """ `fetch_all`, from code that isn't running in an event loop. """
+        return asyncio.run(self.fetch_all(urls, on_result, ttl))
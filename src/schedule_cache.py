@@ -0,0 +1,254 @@
+from collections import OrderedDict
+from copy import copy
+import hashlib
+import json
+import os
+from threading import Lock, get_ident
+from time import time
+from typing import Any, NamedTuple, Optional
+from catalog import CatalogIndex
+from cp2_types import (
+    BaseRequirement, CompletedCourse, CourseRequest, Id, Index, RequirementBlock, Schedule, ScheduleParams, Uid
+)
+from solver import SemesterEncoding, canonical_requirement, flatten_requirement_blocks
+
+SCHEDULE_CACHE_DIR = 'data/schedule_cache'
+
+# A solved schedule in the format returned by `ScheduleGenerator.solve`
+Solution = tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]
+
+
+class RequirementBlocksInfo(NamedTuple):
+    # The canonical form of the requirement blocks (see `canonical_requirement`), as JSON
+    canonical: str
+    # positions[br.uid] = (b, i) if br is the i-th BaseRequirement of block b in the DFS of `flatten_requirement_blocks`
+    # (which is the same for requirement blocks with the same structure)
+    positions: dict[Uid, tuple[Index, int]]
+    base_requirements_of_block: list[list[BaseRequirement]]
+
+
+MAX_CACHED_REQUIREMENT_BLOCKS_INFOS = 64
+# By the uids of the top-level requirements (like the model skeleton cache)
+requirement_blocks_info_cache: dict[tuple[tuple[Uid, ...], ...], RequirementBlocksInfo] = {}
+
+def get_requirement_blocks_info(requirement_blocks: list[RequirementBlock]) -> RequirementBlocksInfo:
+    key = tuple(tuple(req.uid for req in block) for block in requirement_blocks)
+    info = requirement_blocks_info_cache.get(key)
+    if info is None:
+        _, base_requirements_of_block = flatten_requirement_blocks(requirement_blocks)
+        info = RequirementBlocksInfo(
+            json.dumps([[canonical_requirement(req) for req in block] for block in requirement_blocks]),
+            {
+                br.uid: (b, i)
+                for b, base_requirements in enumerate(base_requirements_of_block)
+                for i, br in enumerate(base_requirements)
+            },
+            base_requirements_of_block,
+        )
+        if len(requirement_blocks_info_cache) >= MAX_CACHED_REQUIREMENT_BLOCKS_INFOS:
+            del requirement_blocks_info_cache[next(iter(requirement_blocks_info_cache))]
+        requirement_blocks_info_cache[key] = info
+    return info
+
+
+def schedule_cache_key(
+    catalog_index: CatalogIndex,
+    course_requests: list[CourseRequest],
+    completed_courses: list[CompletedCourse],
+    schedule_params: ScheduleParams,
+    semester_encoding: Optional[SemesterEncoding] = None,
+) -> str:
+    """
+    Return a hash of everything that the solved schedule depends on: the catalog version, the structure of the
+    requirement blocks, the schedule params, and the requests and completed courses (in any order).
+    """
+    info = get_requirement_blocks_info(schedule_params.requirement_blocks)
+    # The bound of every pair of blocks, including those that a defaultdict leaves out (read from a copy, since
+    # reading a defaultdict adds the missing keys), so that e.g. no double counting and no limit don't collide
+    max_double_counts = copy(schedule_params.max_double_counts)
+    num_blocks = len(schedule_params.requirement_blocks)
+    canonical_inputs = [
+        catalog_index.version,
+        info.canonical,
+        schedule_params.num_semesters,
+        schedule_params.max_credits_per_semester,
+        schedule_params.min_credits_per_semester,
+        schedule_params.total_max_credits,
+        [max_double_counts[b1, b2] for b1 in range(num_blocks) for b2 in range(b1 + 1, num_blocks)],
+        sorted(schedule_params.cannot_triple_count),
+        sorted((request.course_id, request.semester or 0) for request in course_requests),
+        sorted(
+            (
+                completed.course_id, completed.semester,
+                sorted(info.positions.get(br_uid, (-1, br_uid)) for br_uid in completed.satisfies)
+            )
+            for completed in completed_courses
+        ),
+        semester_encoding.value if semester_encoding else None,
+    ]
+    return hashlib.sha256(json.dumps(canonical_inputs).encode()).hexdigest()
+
+
+class ScheduleCache:
+    """
+    Caches solved schedules by `schedule_cache_key`, in an in-memory LRU tier backed by an on-disk tier
+    (one JSON file per schedule in `directory`), so that identical requests don't build and solve the model again.
+
+    BaseRequirements are stored by their position in the requirement blocks (see `RequirementBlocksInfo`),
+    and mapped back to the caller's requirement blocks on a hit, since uids differ between processes.
+    Only optimal schedules are cached (see `generate_schedule`), since a schedule found within a time limit
+    could be improved by a later solve.
+
+    Entries older than `max_age` seconds are ignored and deleted from both tiers (e.g. so that a schedule that
+    an improved model would find differently isn't served forever), and the oldest entries are deleted when the
+    directory grows past `max_disk_bytes`.
+
+    Attributes:
+
+        `memory_hits: int`, `disk_hits: int`, `misses: int`
+            The number of lookups that were answered from memory, answered from disk, or not cached.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = SCHEDULE_CACHE_DIR,
+        max_entries: int = 1024,
+        max_disk_bytes: int = 64 * 2**20,
+        max_age: Optional[float] = 7 * 24 * 60 * 60,
+    ) -> None:
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        # By key: the time the entry was stored, and the entry
+        self.entries: 'OrderedDict[str, tuple[float, dict[str, Any]]]' = OrderedDict()
+        self.lock = Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(
+        self,
+        catalog_index: CatalogIndex,
+        course_requests: list[CourseRequest],
+        completed_courses: list[CompletedCourse],
+        schedule_params: ScheduleParams,
+        semester_encoding: Optional[SemesterEncoding] = None,
+    ) -> str:
+        """ See `schedule_cache_key`. """
+        return schedule_cache_key(catalog_index, course_requests, completed_courses, schedule_params, semester_encoding)
+
+    def path(self, key: str) -> str:
+        assert self.directory is not None
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key: str, requirement_blocks: list[RequirementBlock]) -> Optional[Solution]:
+        """ Return the cached schedule for the key, with BaseRequirements from `requirement_blocks`, or None. """
+        with self.lock:
+            timed_entry = self.entries.get(key)
+            if timed_entry is not None and self.is_expired(timed_entry[0]):
+                del self.entries[key]
+                timed_entry = None
+            if timed_entry is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+        if timed_entry is None:
+            timed_entry = self.read(key)
+            with self.lock:
+                if timed_entry is None:
+                    self.misses += 1
+                    return None
+                self.disk_hits += 1
+                self.remember(key, *timed_entry)
+        return decode_entry(timed_entry[1], requirement_blocks)
+
+    def put(self, key: str, requirement_blocks: list[RequirementBlock], soln: Solution) -> None:
+        entry = encode_entry(soln, requirement_blocks)
+        with self.lock:
+            self.remember(key, time(), entry)
+        if self.directory is not None:
+            # Write to a temporary file first so that readers never see a partial entry
+            tmp_path = f'{self.path(key)}.{os.getpid()}.{get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self.path(key))
+            self.evict_from_disk()
+
+    def is_expired(self, stored_at: float) -> bool:
+        return self.max_age is not None and time() - stored_at > self.max_age
+
+    def remember(self, key: str, stored_at: float, entry: dict[str, Any]) -> None:
+        """ Add the entry to the memory tier. Must be called with the lock held. """
+        self.entries[key] = (stored_at, entry)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def read(self, key: str) -> Optional[tuple[float, dict[str, Any]]]:
+        """ Return the time the entry was stored on disk, and the entry, or None. """
+        if self.directory is None:
+            return None
+        path = self.path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self.is_expired(stored_at):
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return stored_at, json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def evict_from_disk(self) -> None:
+        """ Delete the entries that are too old, then the oldest entries until the directory fits in `max_disk_bytes`. """
+        assert self.directory is not None
+        files: list[tuple[float, int, str]] = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total_bytes = sum(size for _, size, _ in files)
+        now = time()
+        for mtime, size, path in files:
+            if total_bytes <= self.max_disk_bytes and (self.max_age is None or now - mtime <= self.max_age):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+        if self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    os.remove(entry.path)
+
+
+def encode_entry(soln: Solution, requirement_blocks: list[RequirementBlock]) -> dict[str, Any]:
+    schedule, course_id_to_requirements = soln
+    positions = get_requirement_blocks_info(requirement_blocks).positions
+    return {
+        'schedule': schedule,
+        'counts_for': {
+            c: [positions[br.uid] for _, br in requirements]
+            for c, requirements in course_id_to_requirements.items()
+        },
+    }
+
+
+def decode_entry(entry: dict[str, Any], requirement_blocks: list[RequirementBlock]) -> Solution:
+    base_requirements_of_block = get_requirement_blocks_info(requirement_blocks).base_requirements_of_block
+    schedule: Schedule = [list(semester) for semester in entry['schedule']]
+    return schedule, {
+        c: [(b, base_requirements_of_block[b][i]) for b, i in positions]
+        for c, positions in entry['counts_for'].items()
+    }
@@ -0,0 +1,168 @@
+from typing import Optional, Sequence
+from ortools.sat.python import cp_model
+from catalog import CatalogIndex
+from cp2_types import (
+    BaseRequirement, BoolVar, CompletedCourse, CourseInfo, CourseRequest, Id, Index, Schedule, ScheduleParams
+)
+from solver import ScheduleGenerator, SemesterEncoding, skip_preprocessing
+
+
+class ScheduleSession:
+    """
+    Keeps the model of one student's schedule across interactive edits (requesting a course, moving it to
+    another semester, forbidding it), so that each edit is a re-solve of the same model instead of a new one.
+
+    Requests and forbidden courses are passed to the solver as assumption literals instead of constraints.
+    Each re-solve is hinted with the previous solution, which lets it skip presolve and the other expensive
+    preprocessing (most of the solve time on the full catalog). Changing the schedule params (e.g. adding the MSE), or
+    requesting a course that isn't in the model, rebuilds the model from the cached skeleton. So does requesting a
+    course that some courses were pruned in favor of (see `prune_courses`), which brings them back into the model,
+    like `generate_schedule` would.
+
+    Attributes:
+
+        `generator: ScheduleGenerator`
+            The generator of the current model, built with `requests_as_assumptions`.
+
+        `course_requests: dict[Id, Optional[Index]]`
+            The requested courses, and the semesters they are requested in (None for any semester).
+
+        `forbidden_course_ids: set[Id]`
+            The courses that must not be taken.
+
+        `solution: Optional[list[int]]`
+            The values of all variables of the model in the last solution.
+    """
+
+    def __init__(
+        self,
+        all_courses: Sequence[CourseInfo],
+        completed_courses: list[CompletedCourse],
+        schedule_params: ScheduleParams,
+        catalog_index: Optional[CatalogIndex] = None,
+        semester_encoding: Optional[SemesterEncoding] = None,
+    ) -> None:
+        self.catalog_index = catalog_index or CatalogIndex(all_courses)
+        self.completed_courses = completed_courses
+        self.schedule_params = schedule_params
+        self.semester_encoding = semester_encoding
+        self.course_requests: dict[Id, Optional[Index]] = {}
+        self.forbidden_course_ids: set[Id] = set()
+        self.last_soln: Optional[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]] = None
+        self.build()
+
+    def build(self) -> None:
+        """ Build the model for the current schedule params and requests, hinted with the last schedule. """
+        self.generator = ScheduleGenerator(
+            self.catalog_index.all_courses,
+            [CourseRequest(course_id, sem) for course_id, sem in self.course_requests.items()],
+            self.completed_courses,
+            self.schedule_params,
+            catalog_index=self.catalog_index,
+            semester_encoding=self.semester_encoding,
+            requests_as_assumptions=True,
+        )
+        # The courses that the courses left out of the model were pruned in favor of
+        self.dominator_ids: set[Id] = set().union(*self.generator.pruning.dominators_of.values())
+        model = self.generator.model
+        # Assumed for requests that can never be satisfied
+        self.false_literal = model.NewBoolVar('')
+        model.Add(self.false_literal == 0)
+
+        self.solution: Optional[list[int]] = None
+        if self.last_soln:
+            schedule, course_id_to_requirements = self.last_soln
+            self.generator.add_hints(
+                {c: s for s, semester in enumerate(schedule) for c in semester},
+                {c: [br.uid for _, br in requirements] for c, requirements in course_id_to_requirements.items()},
+            )
+
+    def request(self, course_id: Id, semester: Optional[Index] = None) -> None:
+        """ Request to take the course (in `semester`, if given), replacing any previous request for it. """
+        self.forbidden_course_ids.discard(course_id)
+        self.course_requests[course_id] = semester
+        if course_id in self.catalog_index.course_id_to_course and (
+            course_id not in self.generator.takes_course or course_id in self.dominator_ids
+        ):
+            self.build()
+
+    def unrequest(self, course_id: Id) -> None:
+        self.course_requests.pop(course_id, None)
+
+    def forbid(self, course_id: Id) -> None:
+        """ Don't take the course, even if it was requested. """
+        self.course_requests.pop(course_id, None)
+        self.forbidden_course_ids.add(course_id)
+
+    def allow(self, course_id: Id) -> None:
+        self.forbidden_course_ids.discard(course_id)
+
+    def set_schedule_params(self, schedule_params: ScheduleParams) -> None:
+        self.schedule_params = schedule_params
+        self.build()
+
+    def assumptions(self) -> list[BoolVar]:
+        """ Return the literals that express the requests and forbidden courses. """
+        generator = self.generator
+        completed_ids = set(course.course_id for course in self.completed_courses)
+        literals: list[BoolVar] = [
+            is_requested if c in self.course_requests else is_requested.Not()
+            for c, is_requested in generator.is_requested.items()
+        ]
+        for course_id, sem in self.course_requests.items():
+            # skip courses already taken/semesters already taken (like `ScheduleGenerator.take_requested_courses`)
+            if (sem and sem <= generator.last_completed_sem) or course_id in completed_ids:
+                continue
+            if course_id not in generator.takes_course:
+                literals.append(self.false_literal)
+            elif sem:
+                literals.append(generator.takes_course_in_sem.get((course_id, sem), self.false_literal))
+            else:
+                literals.append(generator.takes_course[course_id])
+        for course_id in self.forbidden_course_ids:
+            if course_id in generator.takes_course:
+                literals.append(generator.takes_course[course_id].Not())
+        return literals
+
+    def solve(
+        self, time_limit: Optional[float] = None
+    ) -> Optional[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]:
+        """
+        Solve the model with the current requests, and return the schedule in the same format as
+        `ScheduleGenerator.solve` (or None if there is no schedule that satisfies all the requests).
+        """
+        generator = self.generator
+        proto = generator.model.Proto()
+        del proto.assumptions[:]
+        proto.assumptions.extend(literal.Index() for literal in self.assumptions())
+
+        solver = cp_model.CpSolver()
+        # CP-SAT searches with a single worker when there are assumptions
+        solver.parameters.num_search_workers = 1
+        if time_limit is not None:
+            solver.parameters.max_time_in_seconds = time_limit
+        if self.solution is not None:
+            del proto.solution_hint.vars[:]
+            del proto.solution_hint.values[:]
+            proto.solution_hint.vars.extend(range(len(self.solution)))
+            proto.solution_hint.values.extend(self.solution)
+            skip_preprocessing(solver)
+        else:
+            generator.add_greedy_hints()
+        # CP-SAT accepts a complete and feasible hint without checking the assumptions,
+        # so the hint must agree with them
+        hint_index = {var: i for i, var in enumerate(proto.solution_hint.vars)}
+        for literal in proto.assumptions:
+            var, value = (literal, 1) if literal >= 0 else (-literal - 1, 0)
+            if var in hint_index:
+                proto.solution_hint.values[hint_index[var]] = value
+            else:
+                proto.solution_hint.vars.append(var)
+                proto.solution_hint.values.append(value)
+
+        status = solver.Solve(generator.model)
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            return None
+        self.solution = list(solver.ResponseProto().solution)
+        self.last_soln = generator.decode_solution(self.solution)
+        return self.last_soln
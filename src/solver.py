@@ -1,14 +1,56 @@
-from collections import defaultdict
-from math import ceil
+from collections import OrderedDict, defaultdict
+from copy import copy
+from enum import Enum
+from functools import lru_cache
+import hashlib
+from itertools import compress
+import json
+from math import ceil, inf
+from operator import itemgetter
+import pickle
+from queue import Queue
+from threading import Lock, Thread
+from time import perf_counter
 from tkinter.font import BOLD
-from typing import Optional, Sequence
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterator, NamedTuple, Optional, Sequence
 from ortools.sat.python import cp_model
+from ortools.sat.python.cp_model import IntVar
+from catalog import CatalogIndex
+from greedy import greedy_schedule
 from cp2_types import (
-    BaseRequirement, CourseInfo, Requirement, ScheduleParams, CompletedCourse, CourseRequest, Schedule, Id, Index, Semester, BoolVar, Uid
+    BaseRequirement, CourseInfo, Requirement, RequirementBlock, ScheduleParams, CompletedCourse, CourseRequest,
+    Schedule, Id, Index, Semester, BoolVar, Uid
 )
 
+if TYPE_CHECKING:
+    from schedule_cache import ScheduleCache
+    from solver_pool import SolverPool
+
 PRECOLLEGE_SEM: Index = 0
 
+def gather(indices: Sequence[int]) -> Callable[[Sequence[int]], tuple[int, ...]]:
+    """ Return a function that reads the values at `indices` of a sequence in one call (like numpy's `a[indices]`). """
+    if len(indices) == 1:
+        i = indices[0]
+        return lambda a: (a[i],)
+    if not indices:
+        return lambda a: ()
+    return itemgetter(*indices)
+
+class SemesterEncoding(Enum):
+    """
+    How the semester that each course is taken in is modeled.
+
+    `BOOLEAN`: a ladder of `takes_course_by_sem` booleans per course, with prerequisites reified per semester.
+
+    `INTEGER`: a single `semester_of` integer per course, with prerequisites as precedences between them.
+    """
+    BOOLEAN = 'boolean'
+    INTEGER = 'integer'
+
+# Used when no encoding is passed to `generate_schedule`/`ScheduleGenerator`
+DEFAULT_SEMESTER_ENCODING = SemesterEncoding.BOOLEAN
+
 def get_root(br: BaseRequirement) -> Requirement:
     req = br
     while hasattr(req, 'parent'):
@@ -22,74 +64,128 @@ def generate_schedule(
     completed_courses: list[CompletedCourse],
     schedule_params: ScheduleParams,
     verbose: bool = False,
+    catalog_index: Optional[CatalogIndex] = None,
+    semester_encoding: Optional[SemesterEncoding] = None,
+    time_limit: Optional[float] = None,
+    pool: Optional['SolverPool'] = None,
+    cache: Optional['ScheduleCache'] = None,
 ) -> Optional[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]:
-    """ Attempt to generate a schedule from the inputs and print it. """
-    if verbose:
-        print('Constructing model...')
-    generator = ScheduleGenerator(list(all_courses), course_requests, completed_courses, schedule_params)
-    if verbose:
-        print('Solving model...')
-    if (soln := generator.solve(verbose=verbose)):
-        schedule, course_id_to_requirement = soln
+    """
+    Attempt to generate a schedule from the inputs and print it.
+    Pass a `catalog_index` built from `all_courses` to avoid re-indexing the catalog on every call.
+    If `time_limit` (in seconds) is set, the best schedule found within the limit is returned.
+    If a `pool` is given, the schedule is solved in one of its processes (with its catalog instead of `all_courses`).
+    If a `cache` is given, the schedule is looked up there first, and stored there once solved (if it's optimal).
+    """
+    if cache is not None:
+        if pool is not None:
+            catalog_index = pool.catalog_index
+        elif catalog_index is None:
+            catalog_index = CatalogIndex(all_courses)
+        cache_key = cache.key(catalog_index, course_requests, completed_courses, schedule_params, semester_encoding)
+        soln = cache.get(cache_key, schedule_params.requirement_blocks)
+        if soln is not None:
+            if verbose:
+                print('Found schedule in the cache')
+                print_schedule(soln, catalog_index.course_id_to_course)
+            return soln
+
+    if pool is not None:
+        if verbose:
+            print('Solving model in the solver pool...')
+        soln, status = pool.submit(
+            course_requests, completed_courses, schedule_params,
+            time_limit=time_limit, semester_encoding=semester_encoding
+        ).result()
+        course_id_to_course = pool.catalog_index.course_id_to_course
     else:
+        if verbose:
+            print('Constructing model...')
+        generator = ScheduleGenerator(
+            list(all_courses), course_requests, completed_courses, schedule_params,
+            catalog_index=catalog_index, semester_encoding=semester_encoding, verbose=verbose
+        )
+        if verbose:
+            print(f'Pruned {len(generator.pruning.equivalent)} equivalent and {len(generator.pruning.dominated)} dominated courses')
+            print('Solving model...')
+        soln = generator.solve(verbose=verbose, time_limit=time_limit)
+        status = generator.status
+        course_id_to_course = generator.course_id_to_course
+    if not soln:
         print('Not possible to generate a schedule that meets the specifications!\n')
+        if verbose and pool is None:
+            diagnosis = ScheduleGenerator(
+                list(all_courses), course_requests, completed_courses, schedule_params,
+                catalog_index=catalog_index, semester_encoding=semester_encoding, guard_constraints=True
+            ).diagnose_infeasibility(time_limit=time_limit)
+            if diagnosis:
+                print('These constraints conflict:')
+                for description in diagnosis:
+                    print(f'- {description}')
+                print()
         return None
 
+    # A schedule found within the time limit may not be optimal, and a later solve with more time may do better
+    if cache is not None and status == cp_model.OPTIMAL:
+        cache.put(cache_key, schedule_params.requirement_blocks, soln)
+    if verbose:
+        print_schedule(soln, course_id_to_course)
+    return soln
+
+
+def print_schedule(
+    soln: tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]],
+    course_id_to_course: dict[Id, CourseInfo],
+) -> None:
+    """ Print a schedule returned by `generate_schedule`, and the CompletedCourses to reproduce it. """
+    schedule, course_id_to_requirement = soln
     num_semesters_without_precollege = len(schedule)-1
-    courses_taken = set(course for sem in schedule for course in sem)
-    course_id_to_course: dict[Id, CourseInfo] = {
-        course['id']: course for course in all_courses if course['id'] in courses_taken
-    }
     num_courses_taken = sum(len(sem) for sem in schedule)
     total_cu = sum(
         course_id_to_course[c]['credits'] for sem in schedule for c in sem
     )
-    if verbose:
-        print(f'Solution found ({num_courses_taken} courses / {total_cu:g} CU in {num_semesters_without_precollege} semesters)')
-        print()
-
-        for s, semester in enumerate(schedule):
-            sem_cu = sum(course_id_to_course[course_id]['credits'] for course_id in semester)
-            if s == 0:
-                print(f'PRE-COLLEGE CREDITS ({len(semester)} courses / {sem_cu:g} CU):')
-            else:
-                print(f'SEMESTER {s} ({len(semester)} courses / {sem_cu:g} CU):')
-            print('------------------')
+    print(f'Solution found ({num_courses_taken} courses / {total_cu:g} CU in {num_semesters_without_precollege} semesters)')
+    print()
 
-            for course_id in semester:
-                requirement_names = [
-                    f'{_b}: {get_root(br).nickname} {br}'
-                    for (_b, br) in course_id_to_requirement[course_id]
-                ]
-                requirement_names_str = ', '.join(requirement_names) or '{}'
-                cu = course_id_to_course[course_id]['credits']
-                # Indicate double-counted courses with a star
-                maybe_star = '*' if len(requirement_names) > 1 else ''
-                print(f'+ {cu:g}cu | {maybe_star}{course_id} (counts_for {requirement_names_str})')
-            print()
+    for s, semester in enumerate(schedule):
+        sem_cu = sum(course_id_to_course[course_id]['credits'] for course_id in semester)
+        if s == 0:
+            print(f'PRE-COLLEGE CREDITS ({len(semester)} courses / {sem_cu:g} CU):')
+        else:
+            print(f'SEMESTER {s} ({len(semester)} courses / {sem_cu:g} CU):')
+        print('------------------')
 
-        for s, semester in enumerate(schedule):
-            for course_id in semester:
-                req_uids = [br.uid for _, br in course_id_to_requirement[course_id]]
-                print(f'CompletedCourse(\'{course_id}\', {s}, {req_uids}),')
+        for course_id in semester:
+            requirement_names = [
+                f'{_b}: {get_root(br).nickname} {br}'
+                for (_b, br) in course_id_to_requirement[course_id]
+            ]
+            requirement_names_str = ', '.join(requirement_names) or '{}'
+            cu = course_id_to_course[course_id]['credits']
+            # Indicate double-counted courses with a star
+            maybe_star = '*' if len(requirement_names) > 1 else ''
+            print(f'+ {cu:g}cu | {maybe_star}{course_id} (counts_for {requirement_names_str})')
+        print()
 
-    return schedule, course_id_to_requirement
+    for s, semester in enumerate(schedule):
+        for course_id in semester:
+            req_uids = [br.uid for _, br in course_id_to_requirement[course_id]]
+            print(f'CompletedCourse(\'{course_id}\', {s}, {req_uids}),')
 
 
-def compute_double_counts_upper_bound(schedule_params: ScheduleParams, max_credits_to_satisfy: dict[Uid, float]) -> float:
+def compute_double_counts_upper_bound(
+    schedule_params: ScheduleParams, max_credits_to_satisfy: dict[Uid, float], verbose: bool = False
+) -> float:
     """ 
     Compute an upper bound on (total number of requirements - total number of courses taken),
     equivalently the number of times that, for each block, a course counts for a later block,
     by solving a relaxation of the problem without any constraints about the requirements.
     """ 
-    model = cp_model.CpModel()
     requirement_blocks = schedule_params.requirement_blocks
 
-    max_total_cu = 0.0
     max_credits_in_block: dict[Index, float] = {}
     for b, block in enumerate(requirement_blocks):
         max_credits_in_block[b] = sum(max_credits_to_satisfy[req.uid] for req in block)
-        max_total_cu += max_credits_in_block[b]
 
     # Need to scale fractional values into integers if the max credits to satisfy any block is fractional
     fractional_parts: list[float] = [
@@ -98,77 +194,478 @@ def compute_double_counts_upper_bound(schedule_params: ScheduleParams, max_credi
         if (fractional := f % 1) > 0
     ]
     scaling_coeff = int(1.0 / min(fractional_parts, default=1.0))
-    print('scaling coeff', scaling_coeff)
 
+    # We can basically think of each 0.25 CU as an "abstract course" unit
+    units_in_block = tuple(
+        int(scaling_coeff * max_credits_in_block[b]) for b in range(len(requirement_blocks))
+    )
+    max_double_counted_units = tuple(
+        int(scaling_coeff * (schedule_params.max_double_counts[b1, b2] or 0))
+        for b1 in range(len(requirement_blocks))
+        for b2 in range(b1+1, len(requirement_blocks))
+    )
+    max_double_counts = max_double_counted_units_upper_bound(units_in_block, max_double_counted_units)
+    if verbose:
+        print("max double counting credits:", max_double_counts / scaling_coeff)
+    return max_double_counts / scaling_coeff
+
+
+@lru_cache(maxsize=None)
+def max_double_counted_units_upper_bound(
+    units_in_block: tuple[int, ...],
+    max_double_counted_units: tuple[int, ...],
+) -> int:
+    """
+    Given that each block b needs `units_in_block[b]` abstract course units, and that each pair of blocks
+    b1 < b2 can share at most `max_double_counted_units[k]` units (pairs in lexicographic order), return
+    the maximum of (total units needed by the blocks - number of distinct units used).
+
+    Units are interchangeable, so it's enough to count the units in each region of the Venn diagram of
+    the blocks: x[S] units count for exactly the blocks in S, and save |S| - 1 units. This is a small
+    integer program (2^num_blocks - 1 variables) instead of one with a variable per (unit, block) pair,
+    and it has the same optimum. Results are memoized since they only depend on the block structure.
+    """
+    num_blocks = len(units_in_block)
+    block_pairs = [(b1, b2) for b1 in range(num_blocks) for b2 in range(b1+1, num_blocks)]
+    max_double_counted_units_between = dict(zip(block_pairs, max_double_counted_units))
+
+    # Closed forms: with two blocks, the only region that saves anything is the intersection
+    if num_blocks <= 1:
+        return 0
+    if num_blocks == 2:
+        return max(0, min(units_in_block[0], units_in_block[1], max_double_counted_units_between[0, 1]))
+
+    model = cp_model.CpModel()
+    regions = [
+        frozenset(b for b in range(num_blocks) if mask & (1 << b))
+        for mask in range(1, 1 << num_blocks)
+    ]
+    units_in_region: dict[frozenset[Index], cp_model.IntVar] = {
+        region: model.NewIntVar(0, min(units_in_block[b] for b in region), '')
+        for region in regions
+    }
+    # Each block gets exactly the units it needs
+    for b in range(num_blocks):
+        model.Add(
+            sum(units_in_region[region] for region in regions if b in region) == units_in_block[b]
+        )
     # Enforce max double counting between each pair of blocks
-    max_double_counts: dict[tuple[Index, Index], int] = {
-        pair: scaling_coeff * (max_cu or 0) for pair, max_cu in schedule_params.max_double_counts.items()
+    for (b1, b2), max_units in max_double_counted_units_between.items():
+        model.Add(
+            sum(units_in_region[region] for region in regions if b1 in region and b2 in region) <= max(0, max_units)
+        )
+    model.Maximize(sum((len(region) - 1) * units_in_region[region] for region in regions))
+
+    solver = cp_model.CpSolver()
+    assert solver.Solve(model) == cp_model.OPTIMAL
+    return int(solver.ObjectiveValue())
+
+
+# Model skeletons are large (tens of thousands of variables for the full catalog),
+# so only keep the most recently used ones around
+MAX_CACHED_MODEL_SKELETONS = 8
+model_skeleton_cache: 'OrderedDict[Hashable, ModelSkeleton]' = OrderedDict()
+model_skeleton_cache_lock = Lock()
+
+def flatten_requirement_blocks(
+    requirement_blocks: list[RequirementBlock]
+) -> tuple[list[Requirement], list[list[BaseRequirement]]]:
+    """
+    DFS on the requirements tree. Return a list of all Requirements, and for each block,
+    a list of the BaseRequirements in its subtree.
+    """
+    all_requirements: list[Requirement] = []
+    base_requirements_of_block: list[list[BaseRequirement]] = []
+    # None is used as a separator between the subtrees of each block in the DFS stack
+    to_visit: list[Optional[Requirement]] = []
+    for block in requirement_blocks:
+        to_visit.append(None)
+        to_visit.extend(block)
+    to_visit = to_visit[::-1]
+
+    while to_visit:
+        req = to_visit.pop()
+        if req is None:
+            base_requirements_of_block.append([])
+            continue
+
+        all_requirements.append(req)
+        if req.is_multi_requirement:
+            to_visit.extend(req.multi_requirements)
+        else:
+            # decide what TODO about this
+            # for course_id in req.base_requirement.courses:
+            #     # Make sure all courses that appear in some requirement are in our set of courses
+            #     assert course_id in set(c['id'] for c in all_courses), f'Missing course: {course_id}'
+            base_requirements_of_block[-1].append(req.base_requirement)
+
+    return all_requirements, base_requirements_of_block
+
+def canonical_requirement(req: Requirement) -> list[Any]:
+    """
+    Return a JSON-serializable form of the requirement tree that only depends on its structure
+    (not on uids or nicknames, which don't change the schedules that satisfy it).
+    """
+    if req.is_multi_requirement:
+        return [
+            req.min_satisfied_reqs, req.min_credits,
+            [canonical_requirement(subreq) for subreq in req.multi_requirements]
+        ]
+    br = req.base_requirement
+    return [
+        sorted(br.categories), sorted(br.depts), sorted(br.courses), br.min_number, br.max_number, br.allow_partial_cu
+    ]
+
+def slot_base_requirement(req: Requirement) -> Optional[BaseRequirement]:
+    """
+    If the requirement is satisfied by any single course that counts for its BaseRequirement (a base requirement,
+    or an elective that only 1 CU courses can count for), return that BaseRequirement, otherwise None.
+    """
+    if req.is_multi_requirement:
+        # `Requirement.elective`
+        if len(req.multi_requirements) != 1 or req.multi_requirements[0].is_multi_requirement:
+            return None
+        if req.min_satisfied_reqs > 1 or req.min_credits != 1:
+            return None
+        br = req.multi_requirements[0].base_requirement
+        if br.courses:
+            return None
+    else:
+        br = req.base_requirement
+    return None if br.allow_partial_cu else br
+
+def interchangeable_requirements(requirement_blocks: list[RequirementBlock]) -> list[list[Requirement]]:
+    """
+    Return the groups (of 2 or more) of sibling requirements with the same structure (see `canonical_requirement`)
+    that are each satisfied by a single course (see `slot_base_requirement`), like
+    `*[Requirement.elective(...) for _ in range(4)]`. Which requirement of a group a course counts for
+    doesn't matter, so the model counts the courses for the whole group at once (see `ModelSkeleton`).
+    """
+    groups: list[list[Requirement]] = []
+    to_visit: list[list[Requirement]] = list(requirement_blocks)
+    while to_visit:
+        siblings = to_visit.pop()
+        by_structure: dict[str, list[Requirement]] = {}
+        for req in siblings:
+            if slot_base_requirement(req) is not None:
+                by_structure.setdefault(json.dumps(canonical_requirement(req)), []).append(req)
+            elif req.is_multi_requirement:
+                to_visit.append(req.multi_requirements)
+        groups.extend(group for group in by_structure.values() if len(group) > 1)
+    return groups
+
+def eligible_courses(catalog_index: CatalogIndex, br: BaseRequirement) -> set[Id]:
+    """
+    Return the ids of the courses that are allowed to count for the BaseRequirement.
+    Excludes 0 CU courses (likely bad data), and electives that don't allow partial CUs
+    can only be satisfied by 1 CU courses.
+    """
+    only_1cu_courses = not br.courses and not br.allow_partial_cu
+    return {
+        c for c in catalog_index.courses_satisfying(br)
+        if (credits := catalog_index.course_id_to_course[c]['credits']) > 0
+        if not only_1cu_courses or credits == 1
     }
-    num_double_counts_between: dict[tuple[Index, Index], cp_model.IntVar] = {}
-    for b1 in range(len(requirement_blocks)):
-        for b2 in range(b1+1, len(requirement_blocks)):
-            num_double_counts_between[b1, b2] = model.NewIntVar(0, max_double_counts[b1, b2], '')
 
-    # We can basically think of each 0.25 CU as an "abstract course" unit
-    num_abstract_courses = int(scaling_coeff * max_total_cu)
-    counts_for: dict[tuple[Index, Index], BoolVar] = {}
-    for b, block in enumerate(requirement_blocks):        
-        for c in range(num_abstract_courses):
-            counts_for[c, b] = model.NewBoolVar('')
-        
-        # All requirements are satisfied in each block
-        model.Add(
-            sum(counts_for[c, b] for c in range(num_abstract_courses)) == int(scaling_coeff * max_credits_in_block[b])
+class CoursePruning(NamedTuple):
+    # Courses that can be left out of the model, because other courses in the model are as good as them (see
+    # `prune_courses`): `equivalent` ones have a kept twin with the same attributes, `dominated` ones don't
+    equivalent: frozenset[Id]
+    dominated: frozenset[Id]
+    # The kept courses that each pruned course was pruned in favor of
+    dominators_of: dict[Id, tuple[Id, ...]]
+
+
+def max_courses_counting_for(br: BaseRequirement, credits: float, is_top_level: bool) -> float:
+    """
+    Return an upper bound on the number of courses of `credits` CUs that can count for the BaseRequirement at once
+    (see `satisfy_all_requirements_once`).
+    """
+    if not br.courses:
+        # At most 1 CU
+        return int(1 / credits) if br.allow_partial_cu else 1
+    if is_top_level:
+        return 2 if br.allow_partial_cu else 1
+    return inf
+
+def prune_courses(catalog_index: CatalogIndex, requirement_blocks: list[RequirementBlock]) -> CoursePruning:
+    """
+    Find the courses that can count for the requirement blocks but never need to be in the model.
+
+    A course b dominates a course a if they can count for the same BaseRequirements and have the same credits,
+    b's OR-groups of prerequisites are a subset of a's, b is offered in every season that a is, and b is no more
+    difficult. Neither may be cross-listed or a prerequisite of another course. If a schedule takes a, one of
+    a's dominators can take its place (in the same semester, counting for the same requirements), unless they
+    are all taken too. At most `max_courses_counting_for` courses count for the requirements at once, so a is
+    pruned once that many kept courses dominate it.
+
+    Courses are only taken if they count for a requirement, unless they are requested or completed, so
+    `get_model_skeleton` keeps pruned courses that are requested or completed, or whose dominators are.
+    """
+    course_id_to_course = catalog_index.course_id_to_course
+    _, base_requirements_of_block = flatten_requirement_blocks(requirement_blocks)
+    top_level_uids = set(req.uid for block in requirement_blocks for req in block)
+    base_requirements_of_course: defaultdict[Id, list[BaseRequirement]] = defaultdict(list)
+    for block_base_requirements in base_requirements_of_block:
+        for br in block_base_requirements:
+            for c in eligible_courses(catalog_index, br):
+                base_requirements_of_course[c].append(br)
+
+    # Courses whose identity matters to other courses
+    protected: set[Id] = set()
+    for c in base_requirements_of_course:
+        course = course_id_to_course[c]
+        protected.update(p for or_prereqs in course['prerequisites'] for p in or_prereqs)
+        if course['crosslistings']:
+            protected.add(c)
+            protected.update(course['crosslistings'])
+
+    courses_of_signature: defaultdict[tuple[frozenset[Uid], float], list[Id]] = defaultdict(list)
+    for c, brs in base_requirements_of_course.items():
+        if c not in protected:
+            courses_of_signature[frozenset(br.uid for br in brs), course_id_to_course[c]['credits']].append(c)
+
+    equivalent: set[Id] = set()
+    dominated: set[Id] = set()
+    dominators_of: dict[Id, tuple[Id, ...]] = {}
+    for (_, credits), course_ids in courses_of_signature.items():
+        if len(course_ids) < 2:
+            continue
+        max_courses = sum(
+            max_courses_counting_for(br, credits, br.parent.uid in top_level_uids)
+            for br in base_requirements_of_course[course_ids[0]]
         )
+        if max_courses == inf:
+            continue
+        # (difficulty, seasons offered, prereq OR-groups), like in `minimize_maximum_difficulty`
+        # and `compute_semesters_of_courses`
+        attributes: dict[Id, tuple[int, frozenset[str], frozenset[frozenset[Id]]]] = {}
+        for c in course_ids:
+            course = course_id_to_course[c]
+            difficulty = course.get('difficulty', 0) or 0
+            attributes[c] = (
+                round(difficulty) if difficulty >= 0 else 0,
+                frozenset(
+                    season.value for season in [Semester.FALL, Semester.SPRING] if course['rate_offered'][season.value] != 0
+                ),
+                frozenset(frozenset(or_prereqs) for or_prereqs in course['prerequisites']),
+            )
+        def dominates(b: Id, a: Id) -> bool:
+            b_difficulty, b_seasons, b_prereqs = attributes[b]
+            a_difficulty, a_seasons, a_prereqs = attributes[a]
+            return b_difficulty <= a_difficulty and b_seasons >= a_seasons and b_prereqs <= a_prereqs
+
+        # Keep enough of the courses with the same attributes, then drop the dominated ones (likely dominators first)
+        courses_of_attributes: defaultdict[tuple, list[Id]] = defaultdict(list)
+        for c in sorted(course_ids):
+            courses_of_attributes[attributes[c]].append(c)
+        candidates: list[Id] = []
+        for twins in courses_of_attributes.values():
+            candidates.extend(twins[:max(int(max_courses), 1)])
+            equivalent.update(twins[max(int(max_courses), 1):])
+        candidates.sort(key=lambda c: (attributes[c][0], -len(attributes[c][1]), len(attributes[c][2]), c))
+        kept: list[Id] = []
+        for c in candidates:
+            if sum(dominates(k, c) for k in kept) >= max(max_courses, 1):
+                dominated.add(c)
+            else:
+                kept.append(c)
+        for c in course_ids:
+            if c in equivalent or c in dominated:
+                dominators_of[c] = tuple(k for k in kept if dominates(k, c))
+
+    return CoursePruning(frozenset(equivalent), frozenset(dominated), dominators_of)
+
+def compute_semesters_of_courses(
+    course_id_to_course: dict[Id, CourseInfo],
+    num_semesters: int,
+    extra_semesters_of_course: dict[Id, set[Index]] = {},
+) -> dict[Id, list[Index]]:
+    """
+    Return the sorted list of semesters in which each course could be taken. A course can't be taken
+    before the semester after its prerequisites can first be satisfied (following prerequisite chains),
+    and only in the seasons that it is offered in. Like in `enforce_prerequisites`, prerequisites that
+    aren't in `course_id_to_course` are ignored, so a course with an OR-group of only such prerequisites
+    can never be taken. `extra_semesters_of_course` (e.g. for completed courses) are always allowed.
+
+    There is no separate "latest useful semester" bound: the window ends at the last semester (up to
+    `num_semesters`) that the course is offered in. A tighter bound would only apply to courses that are useful
+    just as prerequisites (which would be useless after the last semester that a dependent course can be taken in),
+    but the model never contains such courses: every course can count for a requirement or was requested or
+    completed, and requirements don't care when a course is taken, so each course is as useful in its last
+    offered semester as in its first. If prerequisite-only courses are ever added (see the TODO in
+    `ModelSkeleton.__init__`), they should be bounded by their dependents' windows here.
+    """
+    never = num_semesters + 1
 
-    for b1 in range(len(requirement_blocks)):
-        for b2 in range(b1+1, len(requirement_blocks)):    
-            double_counts_boolvars = []
-            for c in range(num_abstract_courses):
-                double_counts = model.NewBoolVar('')
-                double_counts_boolvars.append(double_counts)
-                # cf[c, b1] & cf[c, b2] => dc
-                model.AddBoolOr([counts_for[c, b1].Not(), counts_for[c, b2].Not(), double_counts])
-                # dc => cf[c, b1] & cf[c, b2]
-                model.AddImplication(double_counts, counts_for[c, b1])
-                model.AddImplication(double_counts, counts_for[c, b2])
-
-            model.Add(num_double_counts_between[b1, b2] == sum(double_counts_boolvars))
-
-    objective_boolvars: list[BoolVar] = []
-    for c in range(num_abstract_courses):
-        for b1 in range(len(requirement_blocks)):
-            double_counts_with_later_block = model.NewBoolVar('')
-            objective_boolvars.append(double_counts_with_later_block)
-
-            counts_for_later_block = model.NewBoolVar('')
-            model.AddBoolOr([
-                counts_for[c, b2] for b2 in range(b1+1, len(requirement_blocks))
-            ]).OnlyEnforceIf(counts_for_later_block)
-            model.AddBoolAnd([
-                counts_for[c, b2].Not() for b2 in range(b1+1, len(requirement_blocks))
-            ]).OnlyEnforceIf(counts_for_later_block.Not())
+    def first_offered_from(course: CourseInfo, s: Index) -> Index:
+        while s < never and course['rate_offered'][(Semester.FALL if s % 2 == 1 else Semester.SPRING).value] == 0:
+            s += 1
+        return s
 
-            # cf[c, b1] & cflb => dcwlb
-            model.AddBoolOr([
-                counts_for[c, b1].Not(), counts_for_later_block.Not(), 
-                double_counts_with_later_block
-            ])
-            # dc => cf[c, b1] & cflb
-            model.AddImplication(double_counts_with_later_block, counts_for[c, b1])
-            model.AddImplication(double_counts_with_later_block, counts_for_later_block)
+    # Find the earliest semester of each course by iterating to a fixed point, which is reached
+    # after at most `never` rounds since the semesters only increase (cyclic prerequisites end up at `never`)
+    earliest_sem: dict[Id, Index] = {
+        c: first_offered_from(course, 1) for c, course in course_id_to_course.items()
+    }
+    def earliest_taken_sem(c: Id) -> Index:
+        return min([earliest_sem[c], *extra_semesters_of_course.get(c, ())])
+
+    changed = True
+    while changed:
+        changed = False
+        for c, course in course_id_to_course.items():
+            prereqs_satisfied_sem = max((
+                min((earliest_taken_sem(p) for p in or_prereqs if p in course_id_to_course), default=never)
+                for or_prereqs in course['prerequisites']
+            ), default=0)
+            sem = first_offered_from(course, min(max(1, prereqs_satisfied_sem + 1), never))
+            if sem > earliest_sem[c]:
+                earliest_sem[c] = sem
+                changed = True
+
+    return {
+        c: sorted(set(
+            s for s in range(earliest_sem[c], never)
+            if first_offered_from(course, s) == s
+        ) | extra_semesters_of_course.get(c, set()))
+        for c, course in course_id_to_course.items()
+    }
+
+MAX_CACHED_COURSE_PRUNINGS = 64
+# By the catalog version and the uids of the top-level requirements (like the model skeleton cache)
+course_pruning_cache: dict[Hashable, CoursePruning] = {}
+
+def get_course_pruning(catalog_index: CatalogIndex, requirement_blocks: list[RequirementBlock]) -> CoursePruning:
+    key = (catalog_index.version, tuple(tuple(req.uid for req in block) for block in requirement_blocks))
+    pruning = course_pruning_cache.get(key)
+    if pruning is None:
+        pruning = prune_courses(catalog_index, requirement_blocks)
+        if len(course_pruning_cache) >= MAX_CACHED_COURSE_PRUNINGS:
+            del course_pruning_cache[next(iter(course_pruning_cache))]
+        course_pruning_cache[key] = pruning
+    return pruning
+
+def get_model_skeleton(
+    catalog_index: CatalogIndex,
+    schedule_params: ScheduleParams,
+    course_requests: list[CourseRequest],
+    completed_courses: list[CompletedCourse],
+    semester_encoding: SemesterEncoding = SemesterEncoding.BOOLEAN,
+    saved_path: Optional[str] = None,
+    verbose: bool = False,
+) -> 'ModelSkeleton':
+    """
+    Return a ModelSkeleton for the catalog and requirement blocks, reusing a cached one if possible.
+    Requested/completed courses that can't count for any requirement (and completed courses pinned to
+    requirements they can't otherwise count for, or completed in semesters they couldn't otherwise be taken in)
+    need their own variables, so they are part of the cache key. So are the courses that are pruned from the model
+    (see `prune_courses`) but are kept because they are requested or completed.
+    If the skeleton isn't cached and `saved_path` is given, its model is loaded from that file (see
+    `ModelSkeleton.save`) instead of built, and cached for the next calls.
+    """
+    requirement_blocks = schedule_params.requirement_blocks
+    _, base_requirements_of_block = flatten_requirement_blocks(requirement_blocks)
+    eligible_courses_of_base_requirement: dict[Uid, set[Id]] = {
+        br.uid: eligible_courses(catalog_index, br)
+        for block_base_requirements in base_requirements_of_block
+        for br in block_base_requirements
+    }
+    eligible_course_ids: set[Id] = set().union(*eligible_courses_of_base_requirement.values())
 
-    model.Maximize(sum(objective_boolvars))
+    def in_catalog(c: Id) -> bool:
+        return c in catalog_index.course_id_to_course and catalog_index.course_id_to_course[c]['credits'] > 0
 
-    solver = cp_model.CpSolver()
-    assert solver.Solve(model) == cp_model.OPTIMAL
-    print("max double counting credits:", solver.ObjectiveValue() / scaling_coeff)
-    return solver.ObjectiveValue() / scaling_coeff
+    extra_course_ids = frozenset(
+        c
+        for c in [request.course_id for request in course_requests] + [completed.course_id for completed in completed_courses]
+        if c not in eligible_course_ids and in_catalog(c)
+    )
+    extra_counts_for = frozenset(
+        (completed.course_id, br_uid)
+        for completed in completed_courses
+        for br_uid in completed.satisfies
+        if br_uid in eligible_courses_of_base_requirement
+        if completed.course_id not in eligible_courses_of_base_requirement[br_uid] and in_catalog(completed.course_id)
+    )
+    semesters_of_course = compute_semesters_of_courses(
+        {
+            c: catalog_index.course_id_to_course[c]
+            for c in eligible_course_ids | extra_course_ids
+        },
+        schedule_params.num_semesters
+    )
+    extra_course_semesters = frozenset(
+        (completed.course_id, completed.semester)
+        for completed in completed_courses
+        if completed.course_id in semesters_of_course
+        if completed.semester not in semesters_of_course[completed.course_id]
+        if 0 <= completed.semester <= schedule_params.num_semesters
+    )
+
+    pruning = get_course_pruning(catalog_index, requirement_blocks)
+    used_course_ids = set(request.course_id for request in course_requests) | set(completed.course_id for completed in completed_courses)
+    unpruned_course_ids = frozenset(
+        c for c, dominators in pruning.dominators_of.items()
+        if c in used_course_ids or any(d in used_course_ids for d in dominators)
+    )
+    # The prerequisites of courses that can't count for anything (which aren't protected from pruning)
+    unpruned_course_ids |= frozenset(
+        p
+        for c in extra_course_ids for or_prereqs in catalog_index.course_id_to_course[c]['prerequisites'] for p in or_prereqs
+        if p in pruning.dominators_of
+    )
+
+    key = (
+        catalog_index.version,
+        tuple(tuple(req.uid for req in block) for block in requirement_blocks),
+        schedule_params.num_semesters,
+        extra_course_ids,
+        unpruned_course_ids,
+        extra_counts_for,
+        extra_course_semesters,
+        semester_encoding,
+    )
+    with model_skeleton_cache_lock:
+        skeleton = model_skeleton_cache.get(key)
+        if skeleton is not None:
+            model_skeleton_cache.move_to_end(key)
+            return skeleton
+
+    equivalent = pruning.equivalent - unpruned_course_ids
+    dominated = pruning.dominated - unpruned_course_ids
+    skeleton = ModelSkeleton(
+        catalog_index, requirement_blocks, schedule_params.num_semesters,
+        extra_course_ids, extra_counts_for, extra_course_semesters, semester_encoding, saved_path,
+        CoursePruning(equivalent, dominated, {c: pruning.dominators_of[c] for c in equivalent | dominated}), verbose,
+    )
+    with model_skeleton_cache_lock:
+        model_skeleton_cache[key] = skeleton
+        if len(model_skeleton_cache) > MAX_CACHED_MODEL_SKELETONS:
+            model_skeleton_cache.popitem(last=False)
+    return skeleton
+
+
+# The CP vars of a ModelSkeleton (see its attributes), and the dicts of them, which `ModelSkeleton.save` saves by index
+SKELETON_VARS = ['last_completed_sem_var', 'credits_taken_times_4']
+SKELETON_VAR_DICTS = [
+    'takes_course_in_sem', 'takes_course', 'takes_course_by_sem', 'semester_of', 'counts_for', 'is_satisfied',
+    'is_future_sem', 'double_counted_credits_times_4', 'credits_in_sem_times_4',
+    'prereq_group_taken_by_sem', 'first_sem_of_prereq_group',
+]
 
+def var_index(var: Optional[IntVar]) -> Optional[int]:
+    return None if var is None else var.Index()
 
-class ScheduleGenerator:
+class ModelSkeleton:
     """
-    Class that handles construction and solving of a CP model to generate a schedule.
+    The part of the CP model that only depends on the catalog, the requirement blocks and the number of
+    semesters, i.e. everything except the student's completed courses, course requests and credit limits.
+    Building it dominates the time to construct a model, so skeletons are cached (see `get_model_skeleton`)
+    and each ScheduleGenerator adds its student-specific constraints to a copy of the skeleton's model.
+
+    Constraints that only apply to future semesters (prerequisites) are guarded by
+    `is_future_sem`, which is fixed once the last completed semester is known.
 
     Attributes:
 
@@ -183,131 +680,247 @@ class ScheduleGenerator:
         `course_id_to_course: dict[Id, CourseInfo]`
             A map from each course's id to the CourseInfo object.
 
-        `schedule_params: ScheduleParams`
-            An object storing the course requirements.
-        
+        `pruning: CoursePruning`
+            The courses that were left out of the model, although they can count for requirements.
+
+        `catalog_index: CatalogIndex`
+            An index over the full catalog, used to find the courses that can satisfy each requirement.
+
+        `semester_encoding: SemesterEncoding`
+            How the semester that each course is taken in is modeled.
+
         `requirement_blocks: list[RequirementBlock]`
             A list of all requirement blocks.
-        
+
         `all_requirements: list[Requirement]`
             A list of all Requirements (i.e. non-leaves of the requirements tree).
 
         `all_base_requirements: list[BaseRequirement]`
             A list of all BaseRequirements (i.e. leaves of the requirements tree).
-        
+
         `base_requirements_of_block: list[list[BaseRequirement]]`
             `base_requirements_of_block[b]` contains a list of all BaseRequirements in block b's subtree.
 
+        `block_of_base_requirement: dict[Uid, Index]`
+            `block_of_base_requirement[br_uid]` is the index of the block whose subtree contains the BaseRequirement.
+
+        `slots_of_base_requirement: dict[Uid, list[BaseRequirement]]`
+            For each group of interchangeable requirements (see `interchangeable_requirements`), the BaseRequirements
+            of the group (its slots), keyed by the uid of the first one, which represents the group in the model:
+            courses only count for the representative, and the j-th slot is satisfied iff at least j courses do.
+
+        `representative_of: dict[Uid, BaseRequirement]`
+            `representative_of[br_uid]` is the BaseRequirement that courses count for in the model instead of the
+            BaseRequirement (itself, unless it is a slot of a group).
+
+        `base_requirements_of_course: dict[Id, list[BaseRequirement]]`
+            `base_requirements_of_course[course_id]` contains all BaseRequirements that the course is allowed
+            to count for, in the same order as `all_base_requirements`.
+
+        `base_requirements_of_course_in_block: dict[Id, dict[Index, list[BaseRequirement]]]`
+            `base_requirements_of_course_in_block[course_id][b]` contains the BaseRequirements of block b
+            that the course is allowed to count for (blocks without any are omitted).
+
+        `courses_of_base_requirement: dict[Uid, list[Id]]`
+            `courses_of_base_requirement[br_uid]` contains the ids of all courses that are allowed to count
+            for the BaseRequirement (none for the slots of a group other than its representative).
+
+        `min_base_credits_to_satisfy: dict[Uid, float]`
+        `max_base_credits_to_satisfy: dict[Uid, float]`
+            Bounds on the number of credits needed to satisfy each Requirement.
+
         `total_credits_lower_bound: int`
             A lower bound on the number of credits that must be satisfied, assuming each
             Requirement is satisfied using its k smallest sub-requirements.
 
-        `double_counting_credits_upper_bound: float`
-            An upper bound on the number of credits that can count for multiple requirements.
-
-        `last_completed_sem`: Index
-            The last semester that was already completed.
-
         `semester_indices: Sequence[Index]`
             A sequence of all semesters excluding the precollege "semester".
 
         `semester_indices_with_precollege: Sequence[Index]`
             A sequence of all semesters including the precollege "semester".
-        
-        `semester_indices_in_future: Sequence[Index]`
-            A sequence of all semesters starting from the first semester that hasn't been completed yet.
+
+        `semesters_of_course: dict[Id, list[Index]]`
+            `semesters_of_course[course_id]` is the sorted list of semesters that the course can be taken in,
+            based on its prerequisites and the seasons it is offered in (see `compute_semesters_of_courses`).
+
+        `credits_times_4: dict[Id, int]`
+            4 times the number of credits of each course (the coefficient of the course in credit sums).
+
+        `courses_of_sem: dict[Index, list[Id]]`
+            `courses_of_sem[sem_idx]` contains the ids of all courses that can be taken in that semester.
 
 
         ===== MODEL =====
 
-        `model: CpModel`    
+        `model: CpModel`
             The CP model.
-    
+
         `takes_course: dict[Id, BoolVar]`
             `takes_course[course_id]` is True iff the course is taken at any point.
 
         `takes_course_in_sem: dict[(Id, Index), BoolVar]`
             `takes_course_in_sem[course_id, sem_idx]` is True iff the course is taken in that semester.
-        
+            Only exists for the semesters in `semesters_of_course`.
+
         `takes_course_by_sem: dict[(Id, Index), BoolVar]`
             `takes_course_by_sem[course_id, sem_idx]` is True iff the course is taken in or before that semester.
+            Only exists between the first and last semesters in `semesters_of_course` (see `takes_course_by_sem_literal`),
+            and only in the BOOLEAN encoding.
 
         `is_satisfied: dict[Uid, BoolVar]`
             `is_satisfied[req_uid]` is True iff the Requirement is satisfied.
-        
+
         `counts_for: dict[(Id, Uid), BoolVar]`
             `counts_for[course_id, base_req_uid]` is True iff the course is counted to satisfy the BaseRequirement.
+            Only exists for the pairs in `base_requirements_of_course`.
 
-    # Model
-    max_difficulty: IntVar
-    list_difficulties: list[IntVar]
+        `semester_of: dict[Id, IntVar]`
+            `semester_of[course_id]` is the semester that the course is taken in, or `not_taken_sem` if it isn't taken.
+            Only exists in the INTEGER encoding, where it replaces `takes_course_by_sem`.
+
+        `not_taken_sem: Index`
+            The value of `semester_of` for courses that aren't taken (one after the last semester).
+
+        `is_future_sem: dict[Index, BoolVar]`
+            `is_future_sem[sem_idx]` is True iff the semester hasn't been completed yet.
+
+        `last_completed_sem_var: IntVar`
+            The last semester that was already completed.
+
+        `prereq_group_taken_by_sem: dict[(frozenset[Id], Index), Optional[BoolVar]]`
+            `prereq_group_taken_by_sem[or_prereq_ids, sem_idx]` is True iff some course in the OR-group of prereqs
+            is taken in or before that semester (None if that's impossible). Only in the BOOLEAN encoding.
+
+        `first_sem_of_prereq_group: dict[frozenset[Id], IntVar]`
+            `first_sem_of_prereq_group[or_prereq_ids]` is the first semester that a course in the OR-group of prereqs
+            is taken in. Only in the INTEGER encoding.
+
+        `credits_in_sem_times_4: dict[Index, IntVar]`
+            `credits_in_sem_times_4[sem_idx]` is 4 times the number of credits taken in that semester.
+
+        `credits_taken_times_4: IntVar`
+            4 times the total number of credits taken.
+
+        `double_counted_credits_times_4: dict[(Index, Index), IntVar]`
+            `double_counted_credits_times_4[b1, b2]` (for b1 < b2) is 4 times the number of credits
+            that count for both blocks b1 and b2.
+
+        `fingerprint: str`
+            A hash of the inputs of the skeleton that doesn't depend on uids, to check that a saved
+            model (see `save`) was built for the same inputs.
+
+        ===== DECODING =====
+
+        `decoded_takes_course_in_sem: list[(Id, Index)]`
+            The keys of `takes_course_in_sem`, in the order of the schedule.
+
+        `gather_takes_course_in_sem: Callable[[Sequence[int]], tuple[int, ...]]`
+            Reads the values of the `takes_course_in_sem` vars (in the order of `decoded_takes_course_in_sem`)
+            from a solution vector.
+
+        `decoded_counts_for: list[(Id, Index, BaseRequirement)]`
+            `(c, b, br)` for each `counts_for[c, br.uid]`, where b is the block of br.
+
+        `gather_counts_for: Callable[[Sequence[int]], tuple[int, ...]]`
+            Reads the values of the `counts_for` vars (in the order of `decoded_counts_for`) from a solution vector.
     """
 
     def __init__(
         self,
-        all_courses: list[CourseInfo], 
-        course_requests: list[CourseRequest],
-        completed_courses: list[CompletedCourse],
-        schedule_params: ScheduleParams,
+        catalog_index: CatalogIndex,
+        requirement_blocks: list[RequirementBlock],
+        num_semesters: int,
+        extra_course_ids: frozenset[Id] = frozenset(),
+        extra_counts_for: frozenset[tuple[Id, Uid]] = frozenset(),
+        extra_course_semesters: frozenset[tuple[Id, Index]] = frozenset(),
+        semester_encoding: SemesterEncoding = SemesterEncoding.BOOLEAN,
+        saved_path: Optional[str] = None,
+        pruning: Optional[CoursePruning] = None,
+        verbose: bool = False,
     ) -> None:
+        """
+        `extra_course_ids` are added to the model even if they can't count for any requirement,
+        `extra_counts_for` contains extra (course, BaseRequirement) pairs that the course can count for,
+        `extra_course_semesters` contains extra (course, semester) pairs that the course can be taken in, and
+        the courses of `pruning` are left out of the model even though they can count for requirements (see `prune_courses`).
+        If `saved_path` is given, the model is loaded from that file (see `save`) instead of built.
+        If `verbose` is set, the name of each constraint is printed as it is added.
+        """
         self.model = cp_model.CpModel()
+        self.catalog_index = catalog_index
+        self.semester_encoding = semester_encoding
+        self.pruning = pruning or CoursePruning(frozenset(), frozenset(), {})
+        pruned_course_ids = self.pruning.equivalent | self.pruning.dominated
+
+        self.requirement_blocks = requirement_blocks
+        self.requirement_block_indices = range(len(requirement_blocks))
+        self.all_requirements, self.base_requirements_of_block = flatten_requirement_blocks(requirement_blocks)
+        self.all_base_requirements: list[BaseRequirement] = [
+            br for block_base_requirements in self.base_requirements_of_block for br in block_base_requirements
+        ]
 
-        self.requirement_blocks = schedule_params.requirement_blocks
-        self.requirement_block_indices = range(len(schedule_params.requirement_blocks))
-        # DFS on the requirements tree
-        self.all_requirements: list[Requirement] = []
-        self.base_requirements_of_block: list[list[BaseRequirement]] = []
-        self.all_base_requirements: list[BaseRequirement] = []
-        # None is used as a separator between the subtrees of each block in the DFS stack
-        to_visit: list[Optional[Requirement]] = []
-        for block in self.requirement_blocks:
-            to_visit.append(None)
-            to_visit.extend(block)
-        to_visit = to_visit[::-1]
-        
-        while to_visit:
-            req = to_visit.pop()
-            if req is None:
-                self.base_requirements_of_block.append([])
-                continue
-            
-            self.all_requirements.append(req)
-            if req.is_multi_requirement:
-                to_visit.extend(req.multi_requirements)
-            else:
-                # decide what TODO about this
-                # for course_id in req.base_requirement.courses:
-                #     # Make sure all courses that appear in some requirement are in our set of courses
-                #     assert course_id in set(c['id'] for c in all_courses), f'Missing course: {course_id}'
-                self.base_requirements_of_block[-1].append(req.base_requirement)
-                self.all_base_requirements.append(req.base_requirement)
+        # Interchangeable requirements share the counts_for vars of their group's representative, which makes
+        # the model smaller and saves the solver from trying every way to assign the same courses to them
+        self.slots_of_base_requirement: dict[Uid, list[BaseRequirement]] = {}
+        self.representative_of: dict[Uid, BaseRequirement] = {br.uid: br for br in self.all_base_requirements}
+        for group in interchangeable_requirements(requirement_blocks):
+            slots = [slot_base_requirement(req) for req in group]
+            self.slots_of_base_requirement[slots[0].uid] = slots
+            for br in slots:
+                self.representative_of[br.uid] = slots[0]
 
         # optimization to make the model smaller:
         # only need to consider courses that satisfy at least one of our requirements
-        # and can also exclude 0 CU courses (likely bad data)
-        # TODO: may also need courses that are prerequisites for courses that satisfy 
-        requested_and_completed_ids = set(
-            [request.course_id for request in course_requests] + [completed.course_id for completed in completed_courses]
-        )
-        all_courses = [
-            course for course in all_courses
-            if course['credits'] > 0
-            and (course['id'] in requested_and_completed_ids 
-            or any(
-                br.satisfied_by_course(course)
-                for br in self.all_base_requirements
-            ))
-        ]
+        # TODO: may also need courses that are prerequisites for courses that satisfy
+        extra_courses_of_base_requirement: defaultdict[Uid, set[Id]] = defaultdict(set)
+        for c, br_uid in extra_counts_for:
+            extra_courses_of_base_requirement[self.representative_of[br_uid].uid].add(c)
+
+        # Another optimization: we only create a counts_for[c, br] variable for the (course, base requirement)
+        # pairs where c is allowed to count for br, so find those pairs while filtering the courses
+        eligible_base_requirements_of_course: defaultdict[Id, list[BaseRequirement]] = defaultdict(list)
+        for br in self.all_base_requirements:
+            if self.representative_of[br.uid] is not br:
+                continue
+            for c in (eligible_courses(catalog_index, br) - pruned_course_ids) | extra_courses_of_base_requirement[br.uid]:
+                eligible_base_requirements_of_course[c].append(br)
 
-        self.course_id_to_course = {
-            c['id']: c for c in all_courses
+        selected_course_ids = set(eligible_base_requirements_of_course) | extra_course_ids
+        self.course_id_to_course: dict[Id, CourseInfo] = {
+            c: catalog_index.course_id_to_course[c]
+            for c in catalog_index.sorted_by_position(selected_course_ids)
+        }
+        self.base_requirements_of_course: dict[Id, list[BaseRequirement]] = {
+            c: eligible_base_requirements_of_course[c] for c in self.course_id_to_course
         }
         self.all_courses = self.course_id_to_course.values()
         self.all_course_ids = self.course_id_to_course.keys()
+        # Credits are scaled by 4 in the model, since courses can have .25 CUs
+        self.credits_times_4: dict[Id, int] = {
+            c: int(4 * course['credits']) for c, course in self.course_id_to_course.items()
+        }
+
+        self.block_of_base_requirement: dict[Uid, Index] = {
+            br.uid: b
+            for b, block_base_requirements in enumerate(self.base_requirements_of_block)
+            for br in block_base_requirements
+        }
+        self.courses_of_base_requirement: dict[Uid, list[Id]] = {
+            br.uid: [] for br in self.all_base_requirements
+        }
+        self.base_requirements_of_course_in_block: dict[Id, dict[Index, list[BaseRequirement]]] = {}
+        for c, eligible_base_requirements in self.base_requirements_of_course.items():
+            self.base_requirements_of_course_in_block[c] = defaultdict(list)
+            for br in eligible_base_requirements:
+                self.courses_of_base_requirement[br.uid].append(c)
+                self.base_requirements_of_course_in_block[c][self.block_of_base_requirement[br.uid]].append(br)
+            self.base_requirements_of_course_in_block[c] = dict(self.base_requirements_of_course_in_block[c])
 
         # Use dynamic programming
-        min_base_credits_to_satisfy: dict[Uid, float] = {}
-        max_base_credits_to_satisfy: dict[Uid, float] = {}
+        self.min_base_credits_to_satisfy: dict[Uid, float] = {}
+        self.max_base_credits_to_satisfy: dict[Uid, float] = {}
+        min_base_credits_to_satisfy = self.min_base_credits_to_satisfy
+        max_base_credits_to_satisfy = self.max_base_credits_to_satisfy
         for req in reversed(self.all_requirements):
             if not req.is_multi_requirement:
                 # For requirements that can be satisfied by a course, get the min/max number of CU
@@ -337,11 +950,11 @@ class ScheduleGenerator:
                             reverse=True
                         )[:req.min_satisfied_reqs])
                     )
-                
+
                 if req.min_credits > 0:
                     min_terms.append(req.min_credits)
                     max_terms.append(req.min_credits)
-                    
+
                 # To satisfy, we need to satisfy a minimum number of requirements AND satisfy a minimum
                 # number of credits, hence the max in both cases here
                 min_base_credits_to_satisfy[req.uid] = max(min_terms)
@@ -351,100 +964,167 @@ class ScheduleGenerator:
             min_base_credits_to_satisfy[req.uid] for block in self.requirement_blocks for req in block
         )
 
-        self.course_requests = course_requests
-        self.completed_courses = completed_courses
-        self.schedule_params = schedule_params
-        self.last_completed_sem = max([course.semester for course in self.completed_courses], default=0)
-
-        # Clean schedule_params.max_double_counts entries that are None (i.e., no limit)
-        block_index_pairs = [
-            (b1, b2) 
-            for b1 in self.requirement_block_indices 
-            for b2 in range(b1 + 1, len(self.requirement_block_indices))
-        ]
-        for b1, b2 in block_index_pairs:
-            if schedule_params.max_double_counts[b1, b2] is None:
-                # If we have unlimited double counts, we can upper bound the number of double counts with
-                # an upper bound on the number of credits in either block (whichever is smaller)
-                requirement_blocks = self.schedule_params.requirement_blocks
-                min_max_credits = min(
-                    sum(max_base_credits_to_satisfy[req.uid] for req in block)
-                    for block in (requirement_blocks[b1], requirement_blocks[b2])
-                )
-                schedule_params.max_double_counts[b1, b2] = ceil(min_max_credits)
-
-        self.double_counting_credits_upper_bound = compute_double_counts_upper_bound(schedule_params, max_base_credits_to_satisfy)
+        self.semester_indices = range(1, num_semesters+1)
+        self.semester_indices_with_precollege = range(num_semesters+1)
 
-        self.semester_indices = range(1, schedule_params.num_semesters+1)
-        self.semester_indices_with_precollege = range(schedule_params.num_semesters+1)
-        self.semester_indices_in_future = range(self.last_completed_sem+1, schedule_params.num_semesters+1)
+        # Another optimization: only create semester variables for the semesters that a course can be taken in
+        extra_semesters_of_course: defaultdict[Id, set[Index]] = defaultdict(set)
+        for c, s in extra_course_semesters:
+            extra_semesters_of_course[c].add(s)
+        self.semesters_of_course = compute_semesters_of_courses(
+            self.course_id_to_course, num_semesters, extra_semesters_of_course
+        )
+        self.courses_of_sem: dict[Index, list[Id]] = {s: [] for s in self.semester_indices_with_precollege}
+        for c, sems in self.semesters_of_course.items():
+            for s in sems:
+                self.courses_of_sem[s].append(c)
+
+        position_of_base_requirement = {br.uid: i for i, br in enumerate(self.all_base_requirements)}
+        self.fingerprint = hashlib.sha1(json.dumps([
+            catalog_index.version,
+            [[canonical_requirement(req) for req in block] for block in requirement_blocks],
+            num_semesters,
+            sorted(extra_course_ids),
+            sorted((c, position_of_base_requirement[br_uid]) for c, br_uid in extra_counts_for),
+            sorted(extra_course_semesters),
+            semester_encoding.value,
+            sorted(pruned_course_ids),
+        ]).encode()).hexdigest()
+
+        if saved_path is not None:
+            self.load_model(saved_path)
+        else:
+            self.build_model(verbose)
+        self.index_decoded_vars()
 
+    def build_model(self, verbose: bool = False) -> None:
+        """ Create the CP vars and add the constraints. """
+        semester_encoding = self.semester_encoding
         self.create_cp_vars()
         constraints = [
-            self.link_takes_course_vars,
+            self.link_takes_course_vars
+            if semester_encoding == SemesterEncoding.BOOLEAN else
+            self.link_semester_of_vars,
             self.link_satisfies_vars,
             self.satisfy_all_requirements_once,
-            self.enforce_total_max_credits,
-            self.enforce_max_credits_per_semester,
-            self.enforce_min_credits_per_semester,
-            self.enforce_double_counting_rules,
+            self.count_credits,
+            self.count_double_counted_credits,
             self.take_courses_at_most_once,
             self.must_take_course_to_count,
-            self.courses_only_satisfy_requirements,
             self.no_double_counting_within_requirement_blocks,
-            self.dont_take_unnecessary_courses,
-            self.enforce_prerequisites,
-            self.take_requested_courses,
-            self.too_many_requirements_infeasible,
-            self.take_completed_courses,
-            self.take_course_only_when_offered,
-            # self.minimize_maximum_difficulty,
-            self.dont_take_cross_listed_twice
+            self.enforce_prerequisites
+            if semester_encoding == SemesterEncoding.BOOLEAN else
+            self.enforce_prerequisites_as_precedences,
+            self.dont_take_cross_listed_twice,
         ]
         for constraint in constraints:
-            print(constraint.__name__)
+            if verbose:
+                print(constraint.__name__)
             constraint()
 
-    def solve(
-        self, 
-        num_threads=8, 
-        verbose=False
-    ) -> Optional[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]:
+    def index_decoded_vars(self) -> None:
         """
-        Solve the model to return a schedule along with a mapping from each course Id c
-        to a list of indices (b, r), indicating that course c satisfies requirement r
-        of block b in the SemesterRequirements.
+        Precompute the indices of the vars that `ScheduleGenerator.decode_solution` reads, so that a
+        solution can be decoded by gathering their values from the solution vector at once.
         """
-        solver = cp_model.CpSolver()
-        solver.parameters.num_search_workers = num_threads
-        print(f'Model has {len(self.model.Proto().variables)} vars and {len(self.model.Proto().constraints)} constraints')
-        res = solver.Solve(self.model)
-        if verbose:
-            print(solver.ResponseStats())
-
-        if res in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-            schedule: Schedule = []
-            course_ids_to_satisfied_block_req_indices: dict[Id, list[tuple[Index, BaseRequirement]]] = {}
-            for s in self.semester_indices_with_precollege:
-                selected_course_ids: list[Id] = [
-                    c for c in self.all_course_ids
-                    if solver.Value(self.takes_course_in_sem[c, s]) == 1
-                ]
-                schedule.append(selected_course_ids)
-                course_ids_to_satisfied_block_req_indices |= {
-                    c: [
-                        (b, br)
-                        for b in self.requirement_block_indices
-                        for br in self.base_requirements_of_block[b]
-                        if solver.Value(self.counts_for[c, br.uid]) == 1
-                    ]
-                    for c in selected_course_ids
-                }
-
-            return schedule, course_ids_to_satisfied_block_req_indices
+        self.decoded_takes_course_in_sem: list[tuple[Id, Index]] = [
+            (c, s) for s in self.semester_indices_with_precollege for c in self.courses_of_sem[s]
+        ]
+        self.gather_takes_course_in_sem = gather([
+            self.takes_course_in_sem[c, s].Index() for c, s in self.decoded_takes_course_in_sem
+        ])
+        self.decoded_counts_for: list[tuple[Id, Index, BaseRequirement]] = [
+            (c, self.block_of_base_requirement[br.uid], br)
+            for c, brs in self.base_requirements_of_course.items() for br in brs
+        ]
+        self.gather_counts_for = gather([
+            self.counts_for[c, br.uid].Index() for c, _, br in self.decoded_counts_for
+        ])
 
-        else:
-            return None
+    def save(self, path: str) -> None:
+        """
+        Save the model and the indices of its CP vars to a file, so that a skeleton with the same inputs can be
+        loaded from it without running the constraint methods (e.g. in a new process). Uids are saved as the
+        positions of the requirements, since they differ between processes.
+        """
+        position_of_base_requirement = {br.uid: i for i, br in enumerate(self.all_base_requirements)}
+        position_of_requirement = {req.uid: i for i, req in enumerate(self.all_requirements)}
+        saved_vars: dict[str, Any] = {attr: var_index(getattr(self, attr)) for attr in SKELETON_VARS}
+        for attr in SKELETON_VAR_DICTS:
+            if hasattr(self, attr):
+                saved_vars[attr] = {key: var_index(var) for key, var in getattr(self, attr).items()}
+        saved_vars['counts_for'] = {
+            (c, position_of_base_requirement[br_uid]): i for (c, br_uid), i in saved_vars['counts_for'].items()
+        }
+        saved_vars['is_satisfied'] = {
+            position_of_requirement[req_uid]: i for req_uid, i in saved_vars['is_satisfied'].items()
+        }
+        with open(path, 'wb') as f:
+            pickle.dump({
+                'fingerprint': self.fingerprint,
+                'model': self.model.Proto().SerializeToString(),
+                'vars': saved_vars,
+            }, f, pickle.HIGHEST_PROTOCOL)
+
+    def load_model(self, path: str) -> None:
+        """ Load the model and CP vars saved by `save` (from a trusted file, since it's a pickle). """
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved['fingerprint'] != self.fingerprint:
+            raise ValueError(f'{path} was saved for another catalog, requirement blocks or number of semesters')
+        self.model.Proto().ParseFromString(saved['model'])
+
+        # Vars that are shared between dicts (like `takes_course_by_sem`) are the same object, as when built
+        var_of_index: dict[int, IntVar] = {}
+        def var(i: Optional[int]) -> Optional[IntVar]:
+            if i is None:
+                return None
+            if i not in var_of_index:
+                var_of_index[i] = self.model.GetIntVarFromProtoIndex(i)
+            return var_of_index[i]
+
+        saved_vars = saved['vars']
+        saved_vars['counts_for'] = {
+            (c, self.all_base_requirements[position].uid): i for (c, position), i in saved_vars['counts_for'].items()
+        }
+        saved_vars['is_satisfied'] = {
+            self.all_requirements[position].uid: i for position, i in saved_vars['is_satisfied'].items()
+        }
+        for attr in SKELETON_VARS:
+            setattr(self, attr, var(saved_vars[attr]))
+        for attr in SKELETON_VAR_DICTS:
+            if attr in saved_vars:
+                setattr(self, attr, {key: var(i) for key, i in saved_vars[attr].items()})
+        self.not_taken_sem = len(self.semester_indices_with_precollege)
+
+    def add_linear(
+        self,
+        vars: Sequence[IntVar],
+        coeffs: Optional[Sequence[int]],
+        lb: int,
+        ub: int,
+        enforcement_literals: Sequence[BoolVar] = (),
+    ) -> None:
+        """
+        Add the constraint `lb <= sum(coeffs[i] * vars[i]) <= ub` (with all coefficients 1 if `coeffs` is None),
+        only enforced if all `enforcement_literals` are true. The constraint is written into the proto directly,
+        which is much faster than building the sum out of LinearExprs with `sum()` when there are many terms.
+        """
+        if lb > ub:
+            # Can't hold (e.g. a minimum number of credits with no courses to count)
+            self.model.AddBoolOr([literal.Not() for literal in enforcement_literals])
+            return
+        constraint = self.model.Proto().constraints.add()
+        constraint.enforcement_literal.extend(literal.Index() for literal in enforcement_literals)
+        constraint.linear.vars.extend(var.Index() for var in vars)
+        constraint.linear.coeffs.extend(coeffs if coeffs is not None else [1] * len(vars))
+        constraint.linear.domain.extend([lb, ub])
+
+    def copy_model(self) -> cp_model.CpModel:
+        """ Return a copy of the model, which shares variable indices (and so all CP vars) with the original. """
+        model = cp_model.CpModel()
+        model.Proto().CopyFrom(self.model.Proto())
+        return model
 
     def create_cp_vars(self) -> None:
         """ Initialize all CP variables. """
@@ -454,7 +1134,7 @@ class ScheduleGenerator:
         self.takes_course_in_sem: dict[tuple[Id, Index], BoolVar] = {
             (c, s): model.NewBoolVar('') 
             for c in self.all_course_ids 
-            for s in self.semester_indices_with_precollege
+            for s in self.semesters_of_course[c]
         }
         # takes_course[c] is true iff we take c in any semester
         self.takes_course: dict[Id, BoolVar] = {
@@ -462,22 +1142,45 @@ class ScheduleGenerator:
             for c in self.all_course_ids 
         }
         # takes_course_by_sem[c, s] is true if we take c in semester s or earlier
-        self.takes_course_by_sem: dict[tuple[Id, Index], BoolVar] = {
-            (c, s): model.NewBoolVar('') 
-            for c in self.all_course_ids 
-            for s in self.semester_indices_with_precollege
-        }
+        # (in the first semester and semesters that c can't be taken in, it's the same variable as in the semester before)
+        self.takes_course_by_sem: dict[tuple[Id, Index], BoolVar] = {}
+        # semester_of[c] is the semester that we take c in, or NOT_TAKEN
+        self.semester_of: dict[Id, IntVar] = {}
+        self.not_taken_sem: Index = len(self.semester_indices_with_precollege)
+        for c in self.all_course_ids:
+            sems = self.semesters_of_course[c]
+            if self.semester_encoding == SemesterEncoding.INTEGER:
+                self.semester_of[c] = model.NewIntVarFromDomain(
+                    cp_model.Domain.FromValues(sems + [self.not_taken_sem]), ''
+                )
+                continue
+            if not sems:
+                continue
+            self.takes_course_by_sem[c, sems[0]] = self.takes_course_in_sem[c, sems[0]]
+            for s in range(sems[0] + 1, sems[-1] + 1):
+                if (c, s) in self.takes_course_in_sem:
+                    self.takes_course_by_sem[c, s] = model.NewBoolVar('')
+                else:
+                    self.takes_course_by_sem[c, s] = self.takes_course_by_sem[c, s-1]
         # counts_for[c, r] is true iff course c counts for BaseRequirement r
+        # (only created for pairs where c is allowed to count for r)
         self.counts_for: dict[tuple[Id, Uid], BoolVar] = {
             (c, br.uid): model.NewBoolVar('')
             for c in self.all_course_ids
-            for br in self.all_base_requirements
+            for br in self.base_requirements_of_course[c]
         }
         # is_satisfied[r] is true if Requirement r is satisfied
         self.is_satisfied: dict[Uid, BoolVar] = {
             r.uid: model.NewBoolVar('')
             for r in self.all_requirements
         }
+        # is_future_sem[s] is true iff semester s hasn't been completed yet
+        self.is_future_sem: dict[Index, BoolVar] = {
+            s: model.NewBoolVar('')
+            for s in self.semester_indices
+        }
+        # last_completed_sem_var is the last semester that was already completed
+        self.last_completed_sem_var = model.NewIntVar(0, max(self.semester_indices_with_precollege), '')
 
     def link_takes_course_vars(self) -> None:
         """ Reify `takes_course` and `takes_course_by_sem` in terms of `takes_course_in_sem`. """
@@ -485,13 +1188,13 @@ class ScheduleGenerator:
         for c in self.all_course_ids:
             model.AddBoolOr([
                 self.takes_course_in_sem[c, s]
-                for s in self.semester_indices_with_precollege
+                for s in self.semesters_of_course[c]
             ]).OnlyEnforceIf(
                 self.takes_course[c]
             )
             model.AddBoolAnd([
                 self.takes_course_in_sem[c, s].Not()
-                for s in self.semester_indices_with_precollege
+                for s in self.semesters_of_course[c]
             ]).OnlyEnforceIf(
                 self.takes_course[c].Not()
             )
@@ -499,8 +1202,7 @@ class ScheduleGenerator:
             # TODO: could try the quadratic approach to this and see how it fares
             # Reify takes_course_by_sem in terms of takes_course_in_sem
             # TODO: actually just change this to use implications/bools
-            model.Add(self.takes_course_by_sem[c, PRECOLLEGE_SEM] == self.takes_course_in_sem[c, PRECOLLEGE_SEM])
-            for s in self.semester_indices:
+            for s in self.semesters_of_course[c][1:]:
                 model.AddBoolOr([
                     self.takes_course_by_sem[c, s-1], self.takes_course_in_sem[c, s]
                 ]).OnlyEnforceIf(self.takes_course_by_sem[c, s])
@@ -508,11 +1210,39 @@ class ScheduleGenerator:
                     self.takes_course_by_sem[c, s-1].Not(), self.takes_course_in_sem[c, s].Not()
                 ]).OnlyEnforceIf(self.takes_course_by_sem[c, s].Not())
 
+    def link_semester_of_vars(self) -> None:
+        """ Channel `takes_course` and `takes_course_in_sem` to `semester_of`. """
+        model = self.model
+        for c in self.all_course_ids:
+            model.Add(self.semester_of[c] < self.not_taken_sem).OnlyEnforceIf(self.takes_course[c])
+            model.Add(self.semester_of[c] == self.not_taken_sem).OnlyEnforceIf(self.takes_course[c].Not())
+            for s in self.semesters_of_course[c]:
+                model.Add(self.semester_of[c] == s).OnlyEnforceIf(self.takes_course_in_sem[c, s])
+                model.Add(self.semester_of[c] != s).OnlyEnforceIf(self.takes_course_in_sem[c, s].Not())
+            # Redundant: we take c in exactly one semester iff we take it at all
+            self.add_linear(
+                [self.takes_course_in_sem[c, s] for s in self.semesters_of_course[c]] + [self.takes_course[c]],
+                [1] * len(self.semesters_of_course[c]) + [-1],
+                0, 0
+            )
+
+    def takes_course_by_sem_literal(self, c: Id, s: Index) -> Optional[BoolVar]:
+        """ Return the literal for taking course c in semester s or earlier, or None if that's impossible. """
+        sems = self.semesters_of_course[c]
+        if not sems or s < sems[0]:
+            return None
+        return self.takes_course_by_sem[c, min(s, sems[-1])]
+
     def link_satisfies_vars(self) -> None:
         """ Reify `is_satisfied` in terms of `counts_for`. """
         model = self.model
         for r0 in self.all_requirements:
-            if r0.is_multi_requirement:
+            slot_br = slot_base_requirement(r0) if r0.is_multi_requirement else None
+            if slot_br is not None and self.representative_of[slot_br.uid].uid in self.slots_of_base_requirement:
+                # An elective in a group is satisfied iff its BaseRequirement is (only 1 CU courses count for it)
+                model.Add(self.is_satisfied[r0.uid] == self.is_satisfied[slot_br.parent.uid])
+
+            elif r0.is_multi_requirement:
                 min_reqs_satisfied = model.NewBoolVar('')
                 min_credits_satisfied = model.NewBoolVar('')
 
@@ -523,16 +1253,13 @@ class ScheduleGenerator:
                     model.Add(self.is_satisfied[r0.uid] == min_credits_satisfied)
 
                 if r0.min_satisfied_reqs > 0:
-                    model.Add(
-                        sum(self.is_satisfied[r.uid] for r in r0.multi_requirements) 
-                        >= 
-                        r0.min_satisfied_reqs
-                    ).OnlyEnforceIf(min_reqs_satisfied)
-                    model.Add(
-                        sum(self.is_satisfied[r.uid] for r in r0.multi_requirements) 
-                        <
-                        r0.min_satisfied_reqs
-                    ).OnlyEnforceIf(min_reqs_satisfied.Not())
+                    subreqs_satisfied = [self.is_satisfied[r.uid] for r in r0.multi_requirements]
+                    self.add_linear(
+                        subreqs_satisfied, None, r0.min_satisfied_reqs, len(subreqs_satisfied), [min_reqs_satisfied]
+                    )
+                    self.add_linear(
+                        subreqs_satisfied, None, 0, r0.min_satisfied_reqs - 1, [min_reqs_satisfied.Not()]
+                    )
 
                 if r0.min_credits > 0:
                     base_requirements_of_r0 = []
@@ -547,118 +1274,719 @@ class ScheduleGenerator:
                     # Scale up by 1, 2, or 4 based on whether there are 0.25/0.5 CU courses
                     # that could possibly count towards this requirement
                     scaling_coeff = 4 # 1.0 / ((r0.min_credits % 1) or 1)
-                    scaled_credits_expr = sum(
-                        int(scaling_coeff * c['credits']) * self.counts_for[c['id'], br.uid]
-                        for c in self.all_courses
-                        for br in base_requirements_of_r0
-                    )
-                    model.Add(
-                        scaled_credits_expr >= int(scaling_coeff * r0.min_credits)
-                    ).OnlyEnforceIf(min_credits_satisfied)
-                    model.Add(
-                        scaled_credits_expr < int(scaling_coeff * r0.min_credits)
-                    ).OnlyEnforceIf(min_credits_satisfied.Not())                    
-
-            else:
+                    counts_for_r0 = [
+                        (c, br.uid) for br in base_requirements_of_r0 for c in self.courses_of_base_requirement[br.uid]
+                    ]
+                    counts_for_vars = [self.counts_for[c, br_uid] for c, br_uid in counts_for_r0]
+                    credits = [self.credits_times_4[c] for c, _ in counts_for_r0]
+                    min_credits = int(scaling_coeff * r0.min_credits)
+                    self.add_linear(counts_for_vars, credits, min_credits, sum(credits), [min_credits_satisfied])
+                    self.add_linear(counts_for_vars, credits, 0, min_credits - 1, [min_credits_satisfied.Not()])
+
+            elif r0.base_requirement.uid in self.slots_of_base_requirement:
+                # The j-th slot of a group is satisfied iff at least j courses count for the group
                 br = r0.base_requirement
-                if not br.courses and not br.allow_partial_cu:
-                    # br satisfied <==> some 1 CU course counts for br
-                    model.AddBoolOr(
-                        [self.is_satisfied[r0.uid].Not()] +
-                        [
-                            self.counts_for[c['id'], br.uid] 
-                            for c in self.all_courses 
-                            if c['credits'] == 1
-                        ]
-                    )
-                    for c in self.all_courses:
-                        if c['credits'] == 1:
-                            model.AddImplication(
-                                self.counts_for[c['id'], br.uid], 
-                                self.is_satisfied[r0.uid]
-                            )
-
-                        # No fractional CU course counts for br
-                        else:
-                            model.Add(self.counts_for[c['id'], br.uid] == 0)
-
-                else:
-                    # br satisfied <==> any course in `br.courses` counts for br
-                    # TODO: could we actually only iterate over br.courses instead of all_courses?
-                    # or will this allow other courses to count_for br randomly
-                    model.AddBoolOr(
-                        [self.is_satisfied[r0.uid].Not()] +
-                        [
-                            self.counts_for[c['id'], br.uid] 
-                            for c in self.all_courses 
-                        ]
-                    )
-                    for c in self.all_courses:
+                requires_1cu_course = not br.courses
+                counts_for_vars = []
+                for c in self.courses_of_base_requirement[br.uid]:
+                    if not requires_1cu_course or self.course_id_to_course[c]['credits'] == 1:
+                        counts_for_vars.append(self.counts_for[c, br.uid])
+                    else:
+                        model.Add(self.counts_for[c, br.uid] == 0)
+                for j, slot in enumerate(self.slots_of_base_requirement[br.uid], 1):
+                    is_satisfied = self.is_satisfied[slot.parent.uid]
+                    self.add_linear(counts_for_vars, None, j, len(counts_for_vars), [is_satisfied])
+                    self.add_linear(counts_for_vars, None, 0, j - 1, [is_satisfied.Not()])
+
+            elif self.representative_of[r0.base_requirement.uid] is r0.base_requirement:
+                br = r0.base_requirement
+                requires_1cu_course = not br.courses and not br.allow_partial_cu
+                # br satisfied <==> some eligible course counts for br
+                # (for electives, only 1 CU courses are eligible)
+                model.AddBoolOr(
+                    [self.is_satisfied[r0.uid].Not()] +
+                    [
+                        self.counts_for[c, br.uid]
+                        for c in self.courses_of_base_requirement[br.uid]
+                        if not requires_1cu_course or self.course_id_to_course[c]['credits'] == 1
+                    ]
+                )
+                for c in self.courses_of_base_requirement[br.uid]:
+                    if not requires_1cu_course or self.course_id_to_course[c]['credits'] == 1:
                         model.AddImplication(
-                            self.counts_for[c['id'], br.uid], 
+                            self.counts_for[c, br.uid],
                             self.is_satisfied[r0.uid]
                         )
 
+                    # No fractional CU course counts for br, even if a completed course was pinned to it
+                    else:
+                        model.Add(self.counts_for[c, br.uid] == 0)
+
     def satisfy_all_requirements_once(self) -> None:
-        """ All requirements must be satisfied (by either one 1 CU course or two 0.5 CU courses). """
+        """
+        Requirements must be satisfied at most once (by either one 1 CU course or two 0.5 CU courses).
+        A group of interchangeable requirements is satisfied at most once per slot.
+        That all top-level requirements are satisfied is up to the ScheduleGenerator (see `satisfy_top_level_requirements`).
+        """
         model = self.model
         for block in self.requirement_blocks:
             for r in block:
-                # All top-level requirements must be satisfied
-                model.Add(
-                    self.is_satisfied[r.uid] == 1
-                )
                 # Redundant: Top-level BaseRequirements should be satisfied by at most 1 course (2 if partial allowed)
-                if not r.is_multi_requirement:
+                if not r.is_multi_requirement and self.representative_of[r.base_requirement.uid] is r.base_requirement:
                     br = r.base_requirement
                     max_courses_to_satisfy = 2 if br.allow_partial_cu else 1
-                    model.Add(
-                        sum(self.counts_for[c, br.uid] for c in self.all_course_ids) 
-                        <= 
-                        max_courses_to_satisfy
+                    num_slots = len(self.slots_of_base_requirement.get(br.uid, [br]))
+                    self.add_linear(
+                        [self.counts_for[c, br.uid] for c in self.courses_of_base_requirement[br.uid]], None,
+                        0, max_courses_to_satisfy * num_slots
                     )
 
         for br in self.all_base_requirements:
             # Redundant: All elective BaseRequirements (i.e. where `courses` is not set)
             # should be satisfied by at most 1 CU
-            if not br.courses:
+            if not br.courses and self.representative_of[br.uid] is br:
                 scaling_coeff = 4
-                model.Add(
-                    sum(
-                        int(scaling_coeff * c['credits']) * self.counts_for[c['id'], br.uid]
-                        for c in self.all_courses
+                num_slots = len(self.slots_of_base_requirement.get(br.uid, [br]))
+                self.add_linear(
+                    [self.counts_for[c, br.uid] for c in self.courses_of_base_requirement[br.uid]],
+                    [self.credits_times_4[c] for c in self.courses_of_base_requirement[br.uid]],
+                    0, scaling_coeff * 1 * num_slots
+                )
+
+    def count_double_counted_credits(self) -> None:
+        """ Count the number of credits that count for both blocks, for each pair of blocks. """
+        model = self.model
+
+        double_counts_boolvars_between: defaultdict[tuple[Index, Index], list[tuple[BoolVar, float]]]
+        double_counts_boolvars_between = defaultdict(list)
+
+        for c in self.all_course_ids:
+            eligible_base_requirements_in_block = self.base_requirements_of_course_in_block[c]
+            # A course that can't count for both blocks can never double count between them
+            eligible_blocks = sorted(eligible_base_requirements_in_block)
+            for i, b1 in enumerate(eligible_blocks):
+                for b2 in eligible_blocks[i+1:]:
+                    num_times_counted_in_either_block = model.NewIntVar(0, 2, '')
+                    counts_for_either_block = [
+                        self.counts_for[c, br.uid]
+                        for b in [b1, b2]
+                        for br in eligible_base_requirements_in_block[b]
+                    ]
+                    self.add_linear(
+                        counts_for_either_block + [num_times_counted_in_either_block],
+                        [1] * len(counts_for_either_block) + [-1],
+                        0, 0
                     )
-                    <=
-                    scaling_coeff * 1
+                    is_double_counted = model.NewBoolVar('')
+                    model.Add(num_times_counted_in_either_block == 2).OnlyEnforceIf(is_double_counted)
+                    model.Add(num_times_counted_in_either_block != 2).OnlyEnforceIf(is_double_counted.Not())
+                    credits = self.course_id_to_course[c]['credits']
+                    assert int(credits / 0.25) == credits / 0.25
+                    double_counts_boolvars_between[b1, b2].append((is_double_counted, credits))
+
+        self.double_counted_credits_times_4: dict[tuple[Index, Index], IntVar] = {}
+        for b1 in self.requirement_block_indices:
+            for b2 in range(b1 + 1, len(self.requirement_block_indices)):
+                double_counts_boolvars = double_counts_boolvars_between[b1, b2]
+                self.double_counted_credits_times_4[b1, b2] = model.NewIntVar(
+                    0, sum(int(4 * cu) for _, cu in double_counts_boolvars), ''
+                )
+                self.add_linear(
+                    [is_double_counted for is_double_counted, _ in double_counts_boolvars]
+                    + [self.double_counted_credits_times_4[b1, b2]],
+                    [int(4 * cu) for _, cu in double_counts_boolvars] + [-1],
+                    0, 0
                 )
+
+    def count_credits(self) -> None:
+        """ Count the number of credits taken in each semester and in total, so that they can be bounded later. """
+        model = self.model
+        scaling_coeff = 4
+        assert scaling_coeff == 4  # the scale of `credits_times_4`
+        max_total_credits = sum(self.credits_times_4.values())
+
+        self.credits_in_sem_times_4: dict[Index, IntVar] = {}
+        for s in self.semester_indices_with_precollege:
+            self.credits_in_sem_times_4[s] = model.NewIntVar(0, max_total_credits, '')
+            self.add_linear(
+                [self.takes_course_in_sem[c, s] for c in self.courses_of_sem[s]] + [self.credits_in_sem_times_4[s]],
+                [self.credits_times_4[c] for c in self.courses_of_sem[s]] + [-1],
+                0, 0
+            )
+
+        self.credits_taken_times_4 = model.NewIntVar(0, max_total_credits, '')
+        self.add_linear(
+            [self.takes_course[c] for c in self.all_course_ids] + [self.credits_taken_times_4],
+            [self.credits_times_4[c] for c in self.all_course_ids] + [-1],
+            0, 0
+        )
+
+    def take_courses_at_most_once(self) -> None:
+        """ We should only take a course at most once. """
+        model = self.model
+        for c in self.all_course_ids:
+            self.add_linear([self.takes_course_in_sem[c, s] for s in self.semesters_of_course[c]], None, 0, 1)
+
+    def must_take_course_to_count(self) -> None:
+        """ If we do not take a course, then it does not satisfy anything. """
+        model = self.model
+        for c, br_uid in self.counts_for:
+            model.AddImplication(
+                self.takes_course[c].Not(), 
+                self.counts_for[c, br_uid].Not()
+            )
+
+    def no_double_counting_within_requirement_blocks(self) -> None:
+        """ A course can only count once within a single block of requirements. """
+        model = self.model
         
+        for c in self.all_course_ids:
+            for eligible_base_requirements in self.base_requirements_of_course_in_block[c].values():
+                if len(eligible_base_requirements) > 1:
+                    self.add_linear([self.counts_for[c, br.uid] for br in eligible_base_requirements], None, 0, 1)
+
+    def enforce_prerequisites(self) -> None:
+        """
+        If we take some course in a future sem s, we must have taken its prereqs by sem s-1.
+        (Completed courses are exempt, since we don't know how the student got into them.)
+        """
+        # TODO: allow a mechanism for ignoring prereqs
+        model = self.model
+        self.prereq_group_taken_by_sem: dict[tuple[frozenset[Id], Index], Optional[BoolVar]] = {}
+        for course in self.all_courses:
+            c = course['id']
+            for or_prereq_ids in self.prereq_groups_of_course(course):
+                for s in self.semesters_of_course[c]:
+                    if s == PRECOLLEGE_SEM:
+                        continue
+                    literal = self.prereq_group_taken_by_sem_literal(or_prereq_ids, s-1)
+                    model.AddBoolOr([
+                        self.takes_course_in_sem[c, s].Not(), self.is_future_sem[s].Not()
+                    ] + ([literal] if literal is not None else []))
+
+    def prereq_groups_of_course(self, course: CourseInfo) -> set[frozenset[Id]]:
+        """ Return the course's OR-groups of prereqs, ignoring prereqs that we don't have an entry for. """
+        return set(
+            frozenset(prereq_id for prereq_id in or_prereqs if prereq_id in self.course_id_to_course)
+            for or_prereqs in course['prerequisites']
+        )
+
+    def prereq_group_taken_by_sem_literal(self, or_prereq_ids: frozenset[Id], s: Index) -> Optional[BoolVar]:
+        """
+        Return a literal that is true iff some course in the OR-group of prereqs is taken in semester s or earlier,
+        or None if that's impossible. Groups are reified once per semester and shared by all courses that need them,
+        and groups with a single possible course are just that course's `takes_course_by_sem`.
+        """
+        if (or_prereq_ids, s) not in self.prereq_group_taken_by_sem:
+            # Prereqs that can't be taken by sem s are left out
+            prereq_literals = [
+                literal
+                for p in sorted(or_prereq_ids)
+                if (literal := self.takes_course_by_sem_literal(p, s)) is not None
+            ]
+            if len(prereq_literals) <= 1:
+                self.prereq_group_taken_by_sem[or_prereq_ids, s] = next(iter(prereq_literals), None)
+            else:
+                or_prereqs_satisfied = self.model.NewBoolVar('')
+                self.model.AddBoolOr(prereq_literals).OnlyEnforceIf(or_prereqs_satisfied)
+                self.model.AddBoolAnd([
+                    literal.Not() for literal in prereq_literals
+                ]).OnlyEnforceIf(or_prereqs_satisfied.Not())
+                self.prereq_group_taken_by_sem[or_prereq_ids, s] = or_prereqs_satisfied
+        return self.prereq_group_taken_by_sem[or_prereq_ids, s]
+
+    def enforce_prerequisites_as_precedences(self) -> None:
+        """
+        Same as `enforce_prerequisites` for the INTEGER encoding: if we take some course in a future
+        semester, then for each OR-group of prereqs, we must take one of them in an earlier semester.
+        """
+        model = self.model
+        self.first_sem_of_prereq_group: dict[frozenset[Id], IntVar] = {}
+        for course in self.all_courses:
+            c = course['id']
+            if not course['prerequisites']:
+                continue
+
+            # needs_prereqs is true if we take c in a future semester
+            needs_prereqs = model.NewBoolVar('')
+            model.AddImplication(needs_prereqs, self.takes_course[c])
+            model.Add(
+                self.semester_of[c] <= self.last_completed_sem_var
+            ).OnlyEnforceIf([self.takes_course[c], needs_prereqs.Not()])
+
+            for or_prereq_ids in self.prereq_groups_of_course(course):
+                if not or_prereq_ids:
+                    model.AddBoolOr([needs_prereqs.Not()])
+                    continue
+                # The first semester that a prereq in the group is taken in is shared by all courses that need the group
+                if or_prereq_ids not in self.first_sem_of_prereq_group:
+                    if len(or_prereq_ids) == 1:
+                        self.first_sem_of_prereq_group[or_prereq_ids] = self.semester_of[next(iter(or_prereq_ids))]
+                    else:
+                        self.first_sem_of_prereq_group[or_prereq_ids] = model.NewIntVar(0, self.not_taken_sem, '')
+                        model.AddMinEquality(
+                            self.first_sem_of_prereq_group[or_prereq_ids],
+                            [self.semester_of[p] for p in sorted(or_prereq_ids)]
+                        )
+                model.Add(
+                    self.first_sem_of_prereq_group[or_prereq_ids] < self.semester_of[c]
+                ).OnlyEnforceIf(needs_prereqs)
+
+    def dont_take_cross_listed_twice(self) -> None:
+        """ Enforce cross-listing across courses """
+        model = self.model
+
+        for course in self.all_courses:
+            c = course['id']
+            crosslistings = course["crosslistings"]
+
+            # get all crosslisted courses indices
+            cross_listing_ids = [
+                crosslisted_id
+                for crosslisted_id in crosslistings
+                if crosslisted_id in self.course_id_to_course
+            ]
+
+            for cross_listed_course in cross_listing_ids:
+                model.AddImplication(
+                    self.takes_course[c], 
+                    self.takes_course[cross_listed_course].Not())
+
+
+def skip_preprocessing(solver: cp_model.CpSolver) -> None:
+    """
+    Turn off presolve, symmetry detection, probing and the LP relaxation, which take seconds on a full-catalog
+    model but aren't needed to repair a hint that is close to a solution (e.g. the solution of a previous solve).
+    """
+    solver.parameters.cp_model_presolve = False
+    solver.parameters.symmetry_level = 0
+    solver.parameters.cp_model_probing_level = 0
+    solver.parameters.linearization_level = 0
+
+
+class ScheduleSolutionCallback(cp_model.CpSolverSolutionCallback):
+    """ Decodes every solution that the solver finds and puts it in a queue (see `ScheduleGenerator.solve_iter`). """
+
+    def __init__(self, generator: 'ScheduleGenerator', solutions: Queue) -> None:
+        super().__init__()
+        self.generator = generator
+        self.solutions = solutions
+        # Total time spent decoding solutions, in seconds
+        self.decode_time = 0.0
+
+    def on_solution_callback(self) -> None:
+        start = perf_counter()
+        soln = self.generator.decode_solution(self.Response().solution)
+        self.decode_time += perf_counter() - start
+        self.solutions.put(soln)
+
+
+class ScheduleGenerator(ModelSkeleton):
+    """
+    Class that handles construction and solving of a CP model to generate a schedule.
+    Shares the data and variables of a cached ModelSkeleton (see its attributes), and adds
+    the constraints that depend on the student to a copy of the skeleton's model.
+
+    Attributes:
+
+        ===== DATA =====
+
+        `schedule_params: ScheduleParams`
+            An object storing the course requirements: a copy of the given one, whose `max_double_counts`
+            has a bound instead of None for every pair of blocks (the given one isn't modified).
+
+        `double_counting_credits_upper_bound: float`
+            An upper bound on the number of credits that can count for multiple requirements.
+
+        `last_completed_sem`: Index
+            The last semester that was already completed.
+
+        `semester_indices_in_future: Sequence[Index]`
+            A sequence of all semesters starting from the first semester that hasn't been completed yet.
+
+        `requests_as_assumptions: bool`
+            If set, `course_requests` only add their courses to the model and aren't enforced, so that
+            requests can be made with assumptions instead (see `ScheduleSession`).
+
+        `guard_constraints: bool`
+            If set, the top-level requirements, course requests, credit limits and double counting limits are
+            only enforced when their guard literals are true (see `guard` and `diagnose_infeasibility`), so the
+            model is only meant to be solved with the guards as assumptions.
+
+        `verbose: bool`
+            If set, the constraints and the bounds derived from them are printed as they are added.
+
+        ===== MODEL =====
+
+        `is_requested: dict[Id, BoolVar]`
+            Only if `requests_as_assumptions`: `is_requested[c]` allows course c to be taken even if it
+            doesn't count for any requirement (like a requested course).
+
+        `guards: dict[str, BoolVar]`
+            Only if `guard_constraints`: `guards[description]` is the literal that enforces the constraints
+            described by `description` (e.g. 'at most 5 CU in semester 3').
+
+        `guards_of_kind: dict[str, list[BoolVar]]`
+            The guards of each kind of constraint ('requirement', 'request', 'credits' or 'double counting').
+
+        ===== STATS =====
+
+        `decode_time: float`
+            The time (in seconds) spent decoding solutions in the last `solve`/`solve_iter`.
+
+        `status: Optional[int]`
+            The `cp_model` status of the last `solve`/`solve_iter` (e.g. `cp_model.FEASIBLE` if the best schedule
+            found within the time limit may not be optimal), or None before the first one.
+
+    # Model
+    max_difficulty: IntVar
+    list_difficulties: list[IntVar]
+    """
+
+    def __init__(
+        self,
+        all_courses: list[CourseInfo],
+        course_requests: list[CourseRequest],
+        completed_courses: list[CompletedCourse],
+        schedule_params: ScheduleParams,
+        catalog_index: Optional[CatalogIndex] = None,
+        semester_encoding: Optional[SemesterEncoding] = None,
+        requests_as_assumptions: bool = False,
+        guard_constraints: bool = False,
+        verbose: bool = False,
+    ) -> None:
+        if catalog_index is None:
+            catalog_index = CatalogIndex(all_courses)
+        skeleton = get_model_skeleton(
+            catalog_index, schedule_params, course_requests, completed_courses,
+            semester_encoding or DEFAULT_SEMESTER_ENCODING, verbose=verbose
+        )
+        # Share the skeleton's data and CP vars (which must not be modified),
+        # but add the student's constraints to a copy of its model
+        vars(self).update(vars(skeleton))
+        self.model = skeleton.copy_model()
+
+        self.course_requests = course_requests
+        self.requests_as_assumptions = requests_as_assumptions
+        self.guard_constraints = guard_constraints
+        self.verbose = verbose
+        self.guards: dict[str, BoolVar] = {}
+        self.guards_of_kind: defaultdict[str, list[BoolVar]] = defaultdict(list)
+        self.decode_time = 0.0
+        self.status: Optional[int] = None
+        self.completed_courses = completed_courses
+        # The caller's params may be reused (e.g. as part of a cache key), so the bounds below go in a copy
+        schedule_params = copy(schedule_params)
+        schedule_params.max_double_counts = copy(schedule_params.max_double_counts)
+        self.schedule_params = schedule_params
+        self.last_completed_sem = max([course.semester for course in self.completed_courses], default=0)
+
+        # Clean schedule_params.max_double_counts entries that are None (i.e., no limit)
+        block_index_pairs = [
+            (b1, b2)
+            for b1 in self.requirement_block_indices
+            for b2 in range(b1 + 1, len(self.requirement_block_indices))
+        ]
+        for b1, b2 in block_index_pairs:
+            if schedule_params.max_double_counts[b1, b2] is None:
+                # If we have unlimited double counts, we can upper bound the number of double counts with
+                # an upper bound on the number of credits in either block (whichever is smaller)
+                requirement_blocks = self.schedule_params.requirement_blocks
+                min_max_credits = min(
+                    sum(self.max_base_credits_to_satisfy[req.uid] for req in block)
+                    for block in (requirement_blocks[b1], requirement_blocks[b2])
+                )
+                schedule_params.max_double_counts[b1, b2] = ceil(min_max_credits)
+
+        self.double_counting_credits_upper_bound = compute_double_counts_upper_bound(
+            schedule_params, self.max_base_credits_to_satisfy, verbose
+        )
+
+        self.semester_indices_in_future = range(self.last_completed_sem+1, schedule_params.num_semesters+1)
+
+        constraints = [
+            self.enforce_total_max_credits,
+            self.enforce_max_credits_per_semester,
+            self.enforce_min_credits_per_semester,
+            self.enforce_double_counting_rules,
+            self.dont_take_unnecessary_courses,
+            self.take_requested_courses,
+            self.satisfy_top_level_requirements,
+            self.too_many_requirements_infeasible,
+            self.take_completed_courses,
+            # self.minimize_maximum_difficulty,
+        ]
+        for constraint in constraints:
+            if verbose:
+                print(constraint.__name__)
+            constraint()
+
+    def solve(
+        self, 
+        num_threads=8, 
+        verbose=False,
+        use_hints=True,
+        time_limit: Optional[float] = None,
+    ) -> Optional[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]:
+        """
+        Solve the model to return a schedule along with a mapping from each course Id c
+        to a list of indices (b, r), indicating that course c satisfies requirement r
+        of block b in the SemesterRequirements.
+        If `use_hints` is set, the solver starts from a schedule found by the greedy planner.
+        If `time_limit` (in seconds) is set, the best schedule found within the limit is returned.
+        """
+        soln = None
+        for soln in self.solve_iter(num_threads, verbose, use_hints, time_limit):
+            pass
+        return soln
+
+    def solve_iter(
+        self,
+        num_threads=8,
+        verbose=False,
+        use_hints=True,
+        time_limit: Optional[float] = None,
+    ) -> Iterator[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]:
+        """
+        Anytime version of `solve`: yield each solution as soon as the solver finds it, in the same
+        format as `solve`. When the model has an objective, each solution is better than the last one.
+        The solver runs in a background thread until it proves optimality or runs out of `time_limit`
+        seconds, or until the caller stops iterating.
+        """
+        if use_hints:
+            self.add_greedy_hints()
+        self.status = None
+        solver = cp_model.CpSolver()
+        solver.parameters.num_search_workers = num_threads
+        if time_limit is not None:
+            solver.parameters.max_time_in_seconds = time_limit
+        if verbose:
+            print(f'Model has {len(self.model.Proto().variables)} vars and {len(self.model.Proto().constraints)} constraints')
+
+        solutions: Queue = Queue()
+        callback = ScheduleSolutionCallback(self, solutions)
+        def run_solver() -> None:
+            try:
+                self.status = solver.SolveWithSolutionCallback(self.model, callback)
+            except BaseException as e:
+                solutions.put(e)
+            else:
+                solutions.put(None)
+        solver_thread = Thread(target=run_solver, name='schedule-solver', daemon=True)
+        solver_thread.start()
+
+        try:
+            while (soln := solutions.get()) is not None:
+                if isinstance(soln, BaseException):
+                    raise soln
+                yield soln
+        finally:
+            # Stop the solver if the caller stopped iterating early, and wait for it to return
+            callback.StopSearch()
+            solver_thread.join()
+            self.decode_time = callback.decode_time
+            if verbose:
+                print(solver.ResponseStats())
+                print(f'decode_time: {self.decode_time:.6f}')
+
+    def solve_many(
+        self,
+        k: int,
+        min_hamming_distance: int = 1,
+        num_threads=8,
+        verbose=False,
+        use_hints=True,
+        time_limit: Optional[float] = None,
+    ) -> list[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]:
+        """
+        Return up to k schedules (fewer if there aren't k), in the same format as `solve`, such that any two
+        schedules differ in at least `min_hamming_distance` of the `takes_course_in_sem` vars (so moving a
+        course to another semester counts as 2).
+        The schedules are all found in one copy of the model: after each schedule, a constraint that the next
+        schedules must be far enough from it is added, and the next solve starts from it without preprocessing.
+        If `time_limit` (in seconds) is set, it's the budget for all k schedules.
+        """
+        if use_hints:
+            self.add_greedy_hints()
+        model = self.copy_model()
+        proto = model.Proto()
+        solver = cp_model.CpSolver()
+        solver.parameters.num_search_workers = num_threads
+        if verbose:
+            print(f'Model has {len(proto.variables)} vars and {len(proto.constraints)} constraints')
+
+        solns: list[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]] = []
+        start = perf_counter()
+        while len(solns) < k:
+            if time_limit is not None:
+                solver.parameters.max_time_in_seconds = time_limit - (perf_counter() - start)
+                if solver.parameters.max_time_in_seconds <= 0:
+                    break
+            if solver.Solve(model) not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+                break
+            solution = list(solver.ResponseProto().solution)
+            solns.append(self.decode_solution(solution))
+
+            # Hamming distance to this schedule = (number of its vars that are false) + (number of other vars that are true)
+            taken = [var for var in self.takes_course_in_sem.values() if solution[var.Index()]]
+            not_taken = [var for var in self.takes_course_in_sem.values() if not solution[var.Index()]]
+            model.Add(sum(not_taken) - sum(taken) >= min_hamming_distance - len(taken))
+
+            del proto.solution_hint.vars[:]
+            del proto.solution_hint.values[:]
+            proto.solution_hint.vars.extend(range(len(solution)))
+            proto.solution_hint.values.extend(solution)
+            skip_preprocessing(solver)
+
+        return solns
+
+    def diagnose_infeasibility(
+        self,
+        num_threads=8,
+        time_limit: Optional[float] = None,
+        shrink_time_limit: float = 1.0,
+    ) -> Optional[list[str]]:
+        """
+        Explain why there is no schedule, by returning descriptions of a set of guarded constraints that can't all
+        hold together (or None if there is a schedule, or if the solver ran out of `time_limit` seconds).
+        The model must be built with `guard_constraints`.
+
+        If the credits needed for the requirements don't fit in the remaining semesters (see
+        `too_many_requirements_infeasible`), that is returned without solving. Otherwise, all guards are
+        assumed in one solve, and the solver returns the assumptions that it used to prove infeasibility.
+        That set is then shrunk by deletion: each guard is dropped, and kept only if the model becomes feasible
+        without it. Each of these solves gets `shrink_time_limit` seconds, and a guard whose solve runs out of
+        time is kept, so the set is minimal unless one of them does.
+        """
+        assert self.guard_constraints, 'diagnose_infeasibility needs a model built with guard_constraints'
+        if self.num_credits_lb > self.num_credits_ub:
+            return [
+                f'the requirements need at least {self.num_credits_lb:g} CU, '
+                f'but at most {self.num_credits_ub:g} CU can be taken in {self.schedule_params.num_semesters} semesters'
+            ]
+
+        model = self.copy_model()
+        proto = model.Proto()
+        # CP-SAT accepts a complete and feasible hint without checking the assumptions
+        proto.ClearField('solution_hint')
+        description_of_var = {guard.Index(): description for description, guard in self.guards.items()}
+        proto.assumptions.extend(description_of_var)
+
+        solver = cp_model.CpSolver()
+        solver.parameters.num_search_workers = num_threads
+        if time_limit is not None:
+            solver.parameters.max_time_in_seconds = time_limit
+        if solver.Solve(model) != cp_model.INFEASIBLE:
+            return None
+        core = list(solver.SufficientAssumptionsForInfeasibility())
+
+        solver.parameters.max_time_in_seconds = shrink_time_limit
+        i = 0
+        while i < len(core):
+            del proto.assumptions[:]
+            proto.assumptions.extend(core[:i] + core[i + 1:])
+            if solver.Solve(model) == cp_model.INFEASIBLE:
+                # Not needed: keep only the guards (in order) that the solver used without it
+                used = set(solver.SufficientAssumptionsForInfeasibility())
+                core = [var for var in core[:i] + core[i + 1:] if var in used]
+            else:
+                i += 1
+        return [description_of_var[var] for var in core]
+
+    def decode_solution(
+        self, solution: Sequence[int]
+    ) -> tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]:
+        """
+        Read the schedule (in the format returned by `solve`) from the solution vector of the solver's response
+        (the values of all variables of the model, by index).
+        """
+        schedule: Schedule = [[] for _ in self.semester_indices_with_precollege]
+        for c, s in compress(self.decoded_takes_course_in_sem, self.gather_takes_course_in_sem(solution)):
+            schedule[s].append(c)
+        course_ids_to_satisfied_block_req_indices: dict[Id, list[tuple[Index, BaseRequirement]]] = {
+            c: [] for semester in schedule for c in semester
+        }
+        # Courses that count for a group of interchangeable requirements fill its slots in order
+        # (past the last slot, e.g. in a nested group, they count for the last one)
+        num_filled_slots: defaultdict[Uid, int] = defaultdict(int)
+        for c, b, br in compress(self.decoded_counts_for, self.gather_counts_for(solution)):
+            slots = self.slots_of_base_requirement.get(br.uid)
+            if slots is not None:
+                br = slots[min(num_filled_slots[br.uid], len(slots) - 1)]
+                num_filled_slots[slots[0].uid] += 1
+            course_ids_to_satisfied_block_req_indices[c].append((b, br))
+
+        return schedule, course_ids_to_satisfied_block_req_indices
+
+    def add_greedy_hints(self) -> None:
+        """ Hint `takes_course_in_sem` and `counts_for` (and the vars derived from them) with a greedy schedule. """
+        model = self.model
+        if model.Proto().solution_hint.vars:
+            # Already hinted
+            return
+
+        greedy = greedy_schedule(self)
+        self.add_hints(greedy.semester_of, greedy.counts_for)
+
+    def add_hints(self, semester_of: dict[Id, Index], counts_for: dict[Id, list[Uid]]) -> None:
+        """
+        Hint the schedule in which each course c in `semester_of` is taken in semester `semester_of[c]`
+        and counts for the BaseRequirements with uids `counts_for[c]`. Courses that aren't in the model are ignored.
+        """
+        model = self.model
+        hinted_counts_for = set(
+            (c, self.representative_of[br_uid].uid if br_uid in self.representative_of else br_uid)
+            for c, br_uids in counts_for.items() for br_uid in br_uids
+        )
+        for (c, s), takes_course_in_sem in self.takes_course_in_sem.items():
+            model.AddHint(takes_course_in_sem, int(semester_of.get(c) == s))
+        for c, takes_course in self.takes_course.items():
+            model.AddHint(takes_course, int(c in semester_of))
+        for c, semester_of_var in self.semester_of.items():
+            model.AddHint(semester_of_var, semester_of.get(c, self.not_taken_sem))
+        for (c, br_uid), counts_for_var in self.counts_for.items():
+            model.AddHint(counts_for_var, int((c, br_uid) in hinted_counts_for))
+
+    def guard(self, constraint: cp_model.Constraint, kind: str, description: str) -> None:
+        """
+        If `guard_constraints` is set, only enforce the constraint when the guard literal of `description` is true.
+        Constraints with the same description share a guard.
+        """
+        if not self.guard_constraints:
+            return
+        if description not in self.guards:
+            self.guards[description] = self.model.NewBoolVar('')
+            self.guards_of_kind[kind].append(self.guards[description])
+        constraint.OnlyEnforceIf(self.guards[description])
+
     def enforce_max_credits_per_semester(self) -> None:
         """ Limit the maximum number of courses per semester based on the schedule params. """
         model = self.model
         scaling_coeff = 4
 
+        max_credits = self.schedule_params.max_credits_per_semester
         for s in self.semester_indices_in_future:
-            model.Add(
-                sum(
-                    int(scaling_coeff * c['credits']) * self.takes_course_in_sem[c['id'], s] 
-                    for c in self.all_courses
-                )
-                <= 
-                int(scaling_coeff * self.schedule_params.max_credits_per_semester)
+            self.guard(
+                model.Add(
+                    self.credits_in_sem_times_4[s]
+                    <= 
+                    int(scaling_coeff * max_credits)
+                ),
+                'credits', f'at most {max_credits:g} CU in semester {s}'
             )
 
     def enforce_total_max_credits(self) -> None:
         model = self.model
         scaling_coeff = 4
 
-        model.Add(
-            sum(
-                int(scaling_coeff * c['credits']) * self.takes_course_in_sem[c['id'], s] 
-                for c in self.all_courses
-                for s in self.semester_indices_with_precollege
-            )
-            <= 
-            int(scaling_coeff * self.schedule_params.total_max_credits)
+        total_max_credits = self.schedule_params.total_max_credits
+        self.guard(
+            model.Add(
+                self.credits_taken_times_4
+                <= 
+                int(scaling_coeff * total_max_credits)
+            ),
+            'credits', f'at most {total_max_credits:g} CU in total'
         )
 
     def enforce_min_credits_per_semester(self) -> None:
@@ -666,102 +1994,47 @@ class ScheduleGenerator:
         model = self.model
         scaling_coeff = 4
 
+        min_credits = self.schedule_params.min_credits_per_semester
         for s in self.semester_indices_in_future:
-            model.Add(
-                sum(
-                    int(scaling_coeff * c['credits']) * self.takes_course_in_sem[c['id'], s] 
-                    for c in self.all_courses
-                )
-                >=
-                int(scaling_coeff * self.schedule_params.min_credits_per_semester)
+            self.guard(
+                model.Add(
+                    self.credits_in_sem_times_4[s]
+                    >=
+                    int(scaling_coeff * min_credits)
+                ),
+                'credits', f'at least {min_credits:g} CU in semester {s}'
             )
 
     def enforce_double_counting_rules(self) -> None:
         """ Limit the number of courses that can be double counted based on the schedule params. """
         model = self.model
 
-        double_counts_boolvars_between: defaultdict[tuple[Index, Index], list[tuple[BoolVar, float]]]
-        double_counts_boolvars_between = defaultdict(list)
-
+        # Disallow triple counting for requirements that cannot triple count
         for c in self.all_course_ids:
-            # Disallow triple counting for requirements that cannot triple count
-            total_num_times_counted = model.NewIntVar(0, 2, '')
-            model.Add(
-                total_num_times_counted == sum(
-                    self.counts_for[c, br.uid] 
-                    for b in self.requirement_block_indices
-                    if b in self.schedule_params.cannot_triple_count
-                    for br in self.base_requirements_of_block[b]
-                )
-            )
-
-            # Count the number of double counts between each pair of blocks
-            for b1, b2 in self.schedule_params.max_double_counts.keys():
-                num_times_counted_in_either_block = model.NewIntVar(0, 2, '')
-                model.Add(
-                    num_times_counted_in_either_block == sum(
-                        self.counts_for[c, br.uid]
-                        for b in [b1, b2]
-                        for br in self.base_requirements_of_block[b]
-                    )
+            eligible_base_requirements_in_block = self.base_requirements_of_course_in_block[c]
+            counts_for_blocks_that_cannot_triple_count = [
+                self.counts_for[c, br.uid]
+                for b in self.schedule_params.cannot_triple_count
+                for br in eligible_base_requirements_in_block.get(b, [])
+            ]
+            if len(counts_for_blocks_that_cannot_triple_count) > 2:
+                total_num_times_counted = model.NewIntVar(0, 2, '')
+                self.guard(
+                    model.Add(
+                        total_num_times_counted == sum(counts_for_blocks_that_cannot_triple_count)
+                    ),
+                    'double counting', f'no triple counting between blocks {sorted(self.schedule_params.cannot_triple_count)}'
                 )
-                is_double_counted = model.NewBoolVar('')
-                model.Add(num_times_counted_in_either_block == 2).OnlyEnforceIf(is_double_counted)
-                model.Add(num_times_counted_in_either_block != 2).OnlyEnforceIf(is_double_counted.Not())
-                credits = self.course_id_to_course[c]['credits']
-                assert int(credits / 0.25) == credits / 0.25
-                double_counts_boolvars_between[b1, b2].append((is_double_counted, credits))
 
         # Allow at most max_double_counts[b1, b2] courses to double count between blocks b1 and b2
         for (b1, b2), max_double_count_cu in self.schedule_params.max_double_counts.items():
             double_count_credits_between_blocks = model.NewIntVar(0, max_double_count_cu, '')
-            double_count_credits_expr_times_4 = sum(
-                int(4 * cu) * is_double_counted 
-                for is_double_counted, cu in double_counts_boolvars_between[b1, b2]
-            )
-            model.Add(
-                4 * double_count_credits_between_blocks == double_count_credits_expr_times_4
-            )
-
-    def take_courses_at_most_once(self) -> None:
-        """ We should only take a course at most once. """
-        model = self.model
-        for c in self.all_course_ids:
-            model.Add(
-                sum(self.takes_course_in_sem[c, s] for s in self.semester_indices_with_precollege) <= 1
-            )
-
-    def must_take_course_to_count(self) -> None:
-        """ If we do not take a course, then it does not satisfy anything. """
-        model = self.model
-        for c in self.all_course_ids:
-            for br in self.all_base_requirements:
-                model.AddImplication(
-                    self.takes_course[c].Not(), 
-                    self.counts_for[c, br.uid].Not()
-                )
-
-    def courses_only_satisfy_requirements(self) -> None:
-        """ A course cannot satisfy anything that it is not allowed to. """
-        model = self.model
-        course_counts_for = {}
-        for completed_id, _, completed_id_counts_for in self.completed_courses:
-            course_counts_for[completed_id] = set(completed_id_counts_for)
-        for course in self.all_courses:
-            c = course['id']
-            for br in self.all_base_requirements:
-                if not br.satisfied_by_course(course) and br.uid not in course_counts_for.get(c, []):
-                    model.Add(self.counts_for[c, br.uid] == 0)
-
-    def no_double_counting_within_requirement_blocks(self) -> None:
-        """ A course can only count once within a single block of requirements. """
-        model = self.model
-        
-        for c in self.all_course_ids:           
-            for b in self.requirement_block_indices:
+            self.guard(
                 model.Add(
-                    sum(self.counts_for[c, br.uid] for br in self.base_requirements_of_block[b]) <= 1
-                )
+                    4 * double_count_credits_between_blocks == self.double_counted_credits_times_4[b1, b2]
+                ),
+                'double counting', f'at most {max_double_count_cu} CU double counted between blocks {b1} and {b2}'
+            )
 
     def dont_take_unnecessary_courses(self) -> None:
         """ If a course won't satisfy any requirements, don't take it. """
@@ -769,6 +2042,7 @@ class ScheduleGenerator:
         model = self.model
         taken_courses = set(course.course_id for course in self.completed_courses)
         requested_courses = set(course.course_id for course in self.course_requests)
+        self.is_requested: dict[Id, BoolVar] = {}
         for c in self.all_course_ids:
             # TODO: commenting this out because we can assume for now all taken courses
             # count for something -- otherwise we can ask user to label them, or maybe
@@ -777,53 +2051,25 @@ class ScheduleGenerator:
                 # Don't add this constraint if the user has already taken the course
                 continue
 
-            if c in requested_courses:
+            if c in requested_courses and not self.requests_as_assumptions:
                 # Don't add this constraint if the user has requested this course
                 continue
 
-            # TODO: change this to use implications/bools?
-            course_counts_for_something = model.NewBoolVar('')
+            # takes_course[c] => some counts_for[c, br] (or is_requested[c])
+            exemptions = []
+            if self.requests_as_assumptions:
+                self.is_requested[c] = model.NewBoolVar('')
+                exemptions.append(self.is_requested[c])
             model.AddBoolOr([
                 self.counts_for[c, br.uid] 
-                for br in self.all_base_requirements
-            ]).OnlyEnforceIf(course_counts_for_something)
-            model.AddBoolAnd([
-                self.counts_for[c, br.uid].Not()
-                for br in self.all_base_requirements
-            ]).OnlyEnforceIf(course_counts_for_something.Not())
-            model.AddImplication(course_counts_for_something.Not(), self.takes_course[c].Not())
-
-    def enforce_prerequisites(self) -> None:
-        """ If we have taken some course by sem s, we must have taken its prereqs by sem s-1. """
-        # TODO: allow a mechanism for ignoring prereqs
-        model = self.model
-        taken_courses = set(course.course_id for course in self.completed_courses)
-        for course in self.all_courses:
-            c = course['id']
-            if c in taken_courses:
-                continue
-            for or_prereqs in course['prerequisites']:
-                # Ignore prereqs in or_prereqs that we don't have an entry for
-                or_prereq_ids = [
-                    prereq_id
-                    for prereq_id in or_prereqs
-                    if prereq_id in self.course_id_to_course
-                ]
-                for s in self.semester_indices:
-                    or_prereqs_satisfied = model.NewBoolVar('')
-                    model.AddBoolOr([
-                        self.takes_course_by_sem[p, s-1]
-                        for p in or_prereq_ids
-                    ]).OnlyEnforceIf(or_prereqs_satisfied)
-                    model.AddBoolAnd([
-                        self.takes_course_by_sem[p, s-1].Not()
-                        for p in or_prereq_ids
-                    ]).OnlyEnforceIf(or_prereqs_satisfied.Not())
-                    model.AddImplication(self.takes_course_in_sem[c, s], or_prereqs_satisfied)
+                for br in self.base_requirements_of_course[c]
+            ] + exemptions + [self.takes_course[c].Not()])
 
     def take_requested_courses(self) -> None:
         """ Take the courses that the student requested. """
         model = self.model
+        if self.requests_as_assumptions:
+            return
 
         completed_ids = set(course.course_id for course in self.completed_courses)
 
@@ -835,12 +2081,29 @@ class ScheduleGenerator:
                 continue
 
             if sem:
-                model.Add(
-                    self.takes_course_in_sem[course_id, sem] == 1
-                )
+                description = f'request {course_id} in semester {sem}'
+                if (course_id, sem) in self.takes_course_in_sem:
+                    self.guard(model.Add(
+                        self.takes_course_in_sem[course_id, sem] == 1
+                    ), 'request', description)
+                elif course_id in self.takes_course and sem in self.semester_indices:
+                    # The course can't be taken in that semester (because of prerequisites or offerings)
+                    self.guard(model.AddBoolOr([]), 'request', description)
+                else:
+                    raise KeyError((course_id, sem))
             else:
-                model.Add(
+                self.guard(model.Add(
                     self.takes_course[course_id] == 1
+                ), 'request', f'request {course_id}')
+
+    def satisfy_top_level_requirements(self) -> None:
+        """ All top-level requirements must be satisfied. """
+        model = self.model
+        for b, block in enumerate(self.requirement_blocks):
+            for r, req in enumerate(block):
+                self.guard(
+                    model.Add(self.is_satisfied[req.uid] == 1),
+                    'requirement', f'requirement {r} of block {b}: {get_root(req).nickname or req}'
                 )
 
     def too_many_requirements_infeasible(self) -> None:
@@ -854,89 +2117,52 @@ class ScheduleGenerator:
             self.course_id_to_course[c.course_id]['credits'] for c in self.completed_courses
         )
         num_credits_ub = credits_completed + max_credits_per_semester * (num_semesters - self.last_completed_sem)
+        self.num_credits_ub = num_credits_ub
+        self.num_credits_lb = self.total_credits_lower_bound - self.double_counting_credits_upper_bound
         # multiply by 4 because we can have .25 CUs
         scaling_coeff = 4
-        self.num_credits_taken_scaled = model.NewIntVar(0, int(scaling_coeff * num_credits_ub), '')
+        self.num_credits_taken_scaled = self.credits_taken_times_4
+        # With guards, these facts only hold when the constraints they are derived from hold
         model.Add(
-            self.num_credits_taken_scaled 
-            == 
-            sum(
-                int(scaling_coeff * c['credits']) * self.takes_course[c['id']] for c in self.all_courses
+            self.num_credits_taken_scaled <= int(scaling_coeff * num_credits_ub)
+        ).OnlyEnforceIf(self.guards_of_kind['credits'])
+        if self.verbose:
+            print(
+                f'{num_credits_ub} >= num_credits_taken >= {self.total_credits_lower_bound} - {self.double_counting_credits_upper_bound}'
             )
-        )
-        print(
-            f'{num_credits_ub} >= num_credits_taken >= {self.total_credits_lower_bound} - {self.double_counting_credits_upper_bound}'
-        )
         # total number of credits >= total number of requirements - num_double_counts
         # this formula is derived from the inclusion-exclusion principle (cis160 ftw)
         model.Add(
             self.num_credits_taken_scaled 
             >= 
-            int(scaling_coeff * (self.total_credits_lower_bound - self.double_counting_credits_upper_bound))
-        )
-        
+            int(scaling_coeff * self.num_credits_lb)
+        ).OnlyEnforceIf(self.guards_of_kind['requirement'] + self.guards_of_kind['double counting'])
+
     def take_completed_courses(self) -> None:
         """ Take the courses that the student has already completed. """
         model = self.model
+        for s in self.semester_indices:
+            model.Add(self.is_future_sem[s] == int(s > self.last_completed_sem))
+        model.Add(self.last_completed_sem_var == self.last_completed_sem)
+
         for course_id, sem, counts_for in self.completed_courses:
             model.Add(
                 self.takes_course_in_sem[course_id, sem] == 1
             )
             for br_uid in counts_for:
                 model.Add(
-                    self.counts_for[course_id, br_uid] == 1
+                    self.counts_for[course_id, self.representative_of[br_uid].uid] == 1
                 )
 
         # disallow taking any other courses in semesters that have already gone by
+        completed_course_semesters = set((course.course_id, course.semester) for course in self.completed_courses)
         for sem in range(PRECOLLEGE_SEM, self.last_completed_sem + 1):
-            for course_id in self.all_course_ids:
-
+            for course_id in self.courses_of_sem[sem]:
                 # skip existing courses
-                add_constraint = True
-                for course in self.completed_courses:
-                    if course_id == course.course_id and course.semester == sem:
-                        add_constraint = False
-                
-                if add_constraint:
+                if (course_id, sem) not in completed_course_semesters:
                     model.Add(
                         self.takes_course_in_sem[course_id, sem] == 0
                     )
-        
-    def dont_take_cross_listed_twice(self) -> None:
-        """ Enforce cross-listing across courses """
-        model = self.model
-
-        for course in self.all_courses:
-            c = course['id']
-            crosslistings = course["crosslistings"]
-
-            # get all crosslisted courses indices
-            cross_listing_ids = [
-                crosslisted_id
-                for crosslisted_id in crosslistings
-                if crosslisted_id in self.course_id_to_course
-            ]
-
-            for cross_listed_course in cross_listing_ids:
-                model.AddImplication(
-                    self.takes_course[c], 
-                    self.takes_course[cross_listed_course].Not())
-
-    def take_course_only_when_offered(self) -> None:
-        """ 
-        Don't take a class if in some semester if, based on recent history,
-        it is not offered in that season.
-        """
-        # TODO: allow override with course requests?
-        for s in self.semester_indices_in_future:
-            season = Semester.FALL if s % 2 == 1 else Semester.SPRING
-            for course in self.all_courses:
-                c = course['id']
-                rate_offered_in_season = course['rate_offered'][season.value]
-                if rate_offered_in_season == 0:
-                    self.model.Add(
-                        self.takes_course_in_sem[c, s] == 0
-                    )
 
     def minimize_maximum_difficulty(self) -> None:
         """ Main optimizer: based on creating a balanced academic load """
@@ -953,17 +2179,12 @@ class ScheduleGenerator:
             model.Add(
                 self.list_difficulties[s - 1] 
                 == sum(
-                    round(difficulty) * self.takes_course_in_sem[course['id'], s]
-                    for course in self.all_courses
-                    if (difficulty := course.get("difficulty", 0) or 0) >= 0
+                    round(difficulty) * self.takes_course_in_sem[c, s]
+                    for c in self.courses_of_sem[s]
+                    if (difficulty := self.course_id_to_course[c].get("difficulty", 0) or 0) >= 0
                 )
             )
         
         # minimize maximum difficulty across semesters
         model.AddMaxEquality(self.max_difficulty, self.list_difficulties)
         model.Minimize(self.max_difficulty)
-    
-
-            
-                 
-
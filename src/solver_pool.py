@@ -0,0 +1,255 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+import multiprocessing
+from multiprocessing.context import BaseContext
+import os
+import tempfile
+from threading import RLock
+from time import monotonic
+from typing import Iterator, NamedTuple, Optional, Sequence
+from catalog import CatalogIndex
+from cp2_types import (
+    BaseRequirement, CompletedCourse, CourseInfo, CourseRequest, Id, Index, Schedule, ScheduleParams, Student
+)
+import solver
+from solver import ScheduleGenerator, SemesterEncoding, get_model_skeleton
+
+# More search workers than this don't make a single solve noticeably faster
+MAX_WORKERS_PER_SOLVE = 8
+
+def default_mp_context() -> BaseContext:
+    """
+    The way to start the processes of a pool. Not fork: the pool is created in processes that run other threads
+    (the web server's, and solver threads), and a process forked while another thread holds a lock can deadlock.
+    A fork server is started once, single-threaded, and forks the processes from there; where it isn't available,
+    the processes are spawned.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+# Each process of the pool builds the CatalogIndex once (see `init_worker`) and keeps its own model skeleton cache
+worker_catalog_index: Optional[CatalogIndex] = None
+
+
+def init_worker(
+    all_courses: Sequence[CourseInfo],
+    skeleton_params: Optional[ScheduleParams] = None,
+    semester_encoding: Optional[SemesterEncoding] = None,
+    skeleton_path: Optional[str] = None,
+) -> None:
+    """
+    Index the catalog, and if the pool was given `skeleton_params`, put the model skeleton that the pool saved
+    to `skeleton_path` in this process's cache, so that solves with those params don't build it again.
+    """
+    global worker_catalog_index
+    worker_catalog_index = CatalogIndex(all_courses)
+    if skeleton_params is not None and skeleton_path is not None:
+        get_model_skeleton(
+            worker_catalog_index, skeleton_params, [], [], semester_encoding or solver.DEFAULT_SEMESTER_ENCODING,
+            saved_path=skeleton_path
+        )
+
+
+class SolveResult(NamedTuple):
+    # The result of `ScheduleGenerator.solve`
+    soln: Optional[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]
+    # The `cp_model` status of the solve (see `ScheduleGenerator.status`)
+    status: Optional[int]
+
+
+def solve_in_worker(
+    course_requests: list[CourseRequest],
+    completed_courses: list[CompletedCourse],
+    schedule_params: ScheduleParams,
+    semester_encoding: Optional[SemesterEncoding],
+    num_workers: int,
+    time_limit: Optional[float],
+) -> SolveResult:
+    assert worker_catalog_index is not None
+    generator = ScheduleGenerator(
+        worker_catalog_index.all_courses, course_requests, completed_courses, schedule_params,
+        catalog_index=worker_catalog_index, semester_encoding=semester_encoding
+    )
+    soln = generator.solve(num_threads=num_workers, time_limit=time_limit)
+    return SolveResult(soln, generator.status)
+
+
+def workers_per_solve(num_free_cores: int, num_waiting: int) -> int:
+    """
+    Return the number of search workers to give to the next solve, when `num_free_cores` cores aren't used by
+    running solves and `num_waiting` other solves are waiting to start: the free cores are shared with the
+    waiting solves, so each solve gets fewer workers under high load and up to `MAX_WORKERS_PER_SOLVE` when idle.
+    """
+    return max(1, min(MAX_WORKERS_PER_SOLVE, num_free_cores // (num_waiting + 1)))
+
+
+class SolveJob(NamedTuple):
+    future: Future
+    course_requests: list[CourseRequest]
+    completed_courses: list[CompletedCourse]
+    schedule_params: ScheduleParams
+    semester_encoding: Optional[SemesterEncoding]
+    # The job must finish within `time_limit` seconds of `submitted_at` (or of when it starts, if not `count_queue_time`)
+    time_limit: Optional[float]
+    count_queue_time: bool
+    submitted_at: float
+
+
+class SolverPool:
+    """
+    Solves schedules for many students concurrently in a pool of processes that have the catalog preloaded.
+
+    Jobs wait in a FIFO queue until one of the `num_processes` processes is free. When a job starts, it is
+    given a share of the `num_cores` cores that running jobs aren't using (see `workers_per_solve`) and
+    the rest of its time budget as a time limit. Jobs whose budget runs out in the queue fail with a TimeoutError.
+    The processes are started with `mp_context` (see `default_mp_context`).
+
+    If `skeleton_params` are given (e.g. for a batch of students with the same params), the model skeleton for
+    them is built once here and saved to a temporary file (see `ModelSkeleton.save`), and each process loads it
+    instead of building it. Students whose completed courses or requests need a different skeleton (see
+    `get_model_skeleton`) still get one built in their process.
+
+    Attributes:
+
+        `catalog_index: CatalogIndex`
+            The index of the catalog that the processes were loaded with.
+    """
+
+    def __init__(
+        self,
+        all_courses: Sequence[CourseInfo],
+        num_processes: Optional[int] = None,
+        num_cores: Optional[int] = None,
+        catalog_index: Optional[CatalogIndex] = None,
+        mp_context: Optional[BaseContext] = None,
+        skeleton_params: Optional[ScheduleParams] = None,
+        semester_encoding: Optional[SemesterEncoding] = None,
+    ) -> None:
+        self.catalog_index = catalog_index or CatalogIndex(all_courses)
+        self.num_cores = num_cores or os.cpu_count() or 1
+        self.num_processes = num_processes or self.num_cores
+        self.skeleton_path: Optional[str] = None
+        if skeleton_params is not None:
+            semester_encoding = semester_encoding or solver.DEFAULT_SEMESTER_ENCODING
+            skeleton = get_model_skeleton(self.catalog_index, skeleton_params, [], [], semester_encoding)
+            fd, self.skeleton_path = tempfile.mkstemp(suffix='.skeleton')
+            os.close(fd)
+            skeleton.save(self.skeleton_path)
+        self.executor = ProcessPoolExecutor(
+            self.num_processes, mp_context=mp_context or default_mp_context(),
+            initializer=init_worker,
+            initargs=(self.catalog_index.all_courses, skeleton_params, semester_encoding, self.skeleton_path)
+        )
+        self.lock = RLock()
+        self.waiting_jobs: deque[SolveJob] = deque()
+        self.num_running_jobs = 0
+        self.num_cores_in_use = 0
+
+    def submit(
+        self,
+        course_requests: list[CourseRequest],
+        completed_courses: list[CompletedCourse],
+        schedule_params: ScheduleParams,
+        time_limit: Optional[float] = None,
+        semester_encoding: Optional[SemesterEncoding] = None,
+        count_queue_time: bool = True,
+    ) -> 'Future[SolveResult]':
+        """
+        Queue a solve and return a Future of its `SolveResult`.
+        If `time_limit` (in seconds) is set, it's the budget for the whole job, including the time spent in
+        the queue unless `count_queue_time` is False (e.g. for batches that fill the queue on purpose).
+        """
+        future: Future = Future()
+        job = SolveJob(
+            future, course_requests, completed_courses, schedule_params, semester_encoding,
+            time_limit, count_queue_time, monotonic()
+        )
+        with self.lock:
+            self.waiting_jobs.append(job)
+            self.start_waiting_jobs()
+        return future
+
+    def start_waiting_jobs(self) -> None:
+        """ Start waiting jobs while there are free processes. Must be called with the lock held. """
+        while self.waiting_jobs and self.num_running_jobs < self.num_processes:
+            job = self.waiting_jobs.popleft()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            time_limit = job.time_limit
+            if time_limit is not None and job.count_queue_time:
+                time_limit -= monotonic() - job.submitted_at
+                if time_limit <= 0:
+                    job.future.set_exception(TimeoutError(f'Solve waited more than its {job.time_limit:g} s budget to start'))
+                    continue
+
+            num_workers = workers_per_solve(self.num_cores - self.num_cores_in_use, len(self.waiting_jobs))
+            self.num_running_jobs += 1
+            self.num_cores_in_use += num_workers
+            worker_future = self.executor.submit(
+                solve_in_worker, job.course_requests, job.completed_courses, job.schedule_params,
+                job.semester_encoding, num_workers, time_limit
+            )
+            worker_future.add_done_callback(
+                lambda worker_future, job=job, num_workers=num_workers: self.finish_job(job, num_workers, worker_future)
+            )
+
+    def finish_job(self, job: SolveJob, num_workers: int, worker_future: Future) -> None:
+        with self.lock:
+            self.num_running_jobs -= 1
+            self.num_cores_in_use -= num_workers
+            self.start_waiting_jobs()
+        if (e := worker_future.exception()) is not None:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(worker_future.result())
+
+    def shutdown(self) -> None:
+        """ Cancel the jobs that haven't started and wait for the running ones to finish. """
+        with self.lock:
+            while self.waiting_jobs:
+                self.waiting_jobs.popleft().future.cancel()
+        self.executor.shutdown()
+        if self.skeleton_path is not None:
+            os.remove(self.skeleton_path)
+
+
+def generate_schedules_batch(
+    all_courses: Sequence[CourseInfo],
+    students: Sequence[Student],
+    schedule_params: ScheduleParams,
+    catalog_index: Optional[CatalogIndex] = None,
+    semester_encoding: Optional[SemesterEncoding] = None,
+    time_limit: Optional[float] = None,
+    pool: Optional[SolverPool] = None,
+) -> Iterator[tuple[Index, Optional[tuple[Schedule, dict[Id, list[tuple[Index, BaseRequirement]]]]]]]:
+    """
+    Generate schedules for a cohort of students with the same `schedule_params`, and yield `(i, soln)` as soon as
+    the schedule of `students[i]` is solved, where `soln` is the result of `ScheduleGenerator.solve`.
+    `time_limit` (in seconds) applies to each solve.
+
+    The catalog is indexed once up front. The solves run in `pool`, or in a new pool for the batch, which builds
+    the model skeleton for `schedule_params` once and has its processes load it (see `SolverPool`).
+    """
+    if catalog_index is None:
+        catalog_index = CatalogIndex(all_courses)
+    # Resolved here so that the processes use the encoding of the skeleton that they load
+    semester_encoding = semester_encoding or solver.DEFAULT_SEMESTER_ENCODING
+    batch_pool = pool or SolverPool(
+        catalog_index.all_courses, catalog_index=catalog_index,
+        skeleton_params=schedule_params, semester_encoding=semester_encoding
+    )
+    try:
+        student_of_future = {
+            batch_pool.submit(
+                student.course_requests, student.completed_courses, schedule_params,
+                time_limit=time_limit, semester_encoding=semester_encoding, count_queue_time=False
+            ): i
+            for i, student in enumerate(students)
+        }
+        for future in as_completed(student_of_future):
+            yield student_of_future[future], future.result().soln
+    finally:
+        if pool is None:
+            batch_pool.shutdown()
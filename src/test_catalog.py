@@ -0,0 +1,28 @@
+from typing import Sequence
+from catalog import CatalogIndex
+from cp2_types import BaseRequirement, CourseInfo
+
+
+def test_courses_satisfying_matches_scan(sample_courses_info: Sequence[CourseInfo]):
+    index = CatalogIndex(sample_courses_info)
+    base_requirements = [
+        BaseRequirement(courses=['CIS-120', 'CIS-420']),
+        BaseRequirement(categories=['MATH@SEAS']),
+        BaseRequirement(categories=['MATH@SEAS', 'ENG@SEAS']),
+        BaseRequirement(depts=['CIS']),
+        BaseRequirement(depts=['CIS', 'MATH'], min_number=121, max_number=240),
+        BaseRequirement(depts=['CIS'], max_number=188),
+        BaseRequirement(categories=['ENG@SEAS'], min_number=200),
+        BaseRequirement(categories=['ENG@SEAS'], depts=['CIS'], courses=['CIS-121', 'CIS-160']),
+        BaseRequirement(categories=['FREE']),
+        BaseRequirement(depts=['OMG']),
+    ]
+    for br in base_requirements:
+        assert index.courses_satisfying(br) == set(
+            course['id'] for course in sample_courses_info if br.satisfied_by_course(course)
+        ), br
+
+
+def test_sorted_by_position(sample_courses_info: Sequence[CourseInfo]):
+    index = CatalogIndex(sample_courses_info)
+    assert index.sorted_by_position({'MATH-104', 'CIS-160', 'CIS-120'}) == ['CIS-120', 'CIS-160', 'MATH-104']
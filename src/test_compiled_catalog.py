@@ -0,0 +1,67 @@
+import pytest
+from catalog import CatalogIndex
+from compiled_catalog import CompiledCatalog, compile_catalog
+from cp2_types import BaseRequirement, CourseInfo, Semester
+
+
+def test_compiled_catalog_round_trip(sample_courses_info: list[CourseInfo], tmp_path):
+    courses = sample_courses_info + [{
+        'id': 'ESE-5420',
+        'title': 'Statistics for Data Science — Éte',
+        'credits': 0.5,
+        'semester': '2022A',
+        'prerequisites': [['CIS-120', 'CIS-160'], ['CIS-121']],
+        'requirements': [],
+        'rate_offered': {Semester.FALL.value: 0.8, Semester.SPRING.value: 0.2, Semester.SUMMER.value: 0},
+        'crosslistings': ['STAT-5420', 'CIS-5420'],
+        'sections': [{'id': 'ESE-5420-001', 'credits': 0.5}],
+        'course_quality': 3.1,
+        'instructor_quality': None,
+        'difficulty': 2.75,
+        'work_required': None,
+        'description': 'Left out',
+    }, {
+        **sample_courses_info[0],
+        'id': 'CIS-1200',
+        'title': None,
+        'semester': None,
+    }]
+    filename = str(tmp_path / 'course_infos.cp2cat')
+    compile_catalog(courses, filename)
+    catalog = CompiledCatalog.load(filename)
+
+    assert len(catalog) == len(courses)
+    assert catalog.course_ids() == [course['id'] for course in courses]
+    expected = [
+        {**{k: v for k, v in course.items() if k != 'description'}, 'sections': []}
+        for course in courses
+    ]
+    # Indexing only decodes the courses that are read
+    assert catalog[-2] == expected[-2]
+    assert catalog[-1] == expected[-1]
+    assert catalog[1:3] == expected[1:3]
+    assert catalog.num_decoded == 4
+    with pytest.raises(IndexError):
+        catalog[len(courses)]
+    # Iterating decodes the others, and keeps the decoded ones
+    last = catalog[-1]
+    assert list(catalog) == expected
+    assert catalog[-1] is last
+    assert list(CompiledCatalog.load(filename)) == expected
+
+    # The columns can be read directly
+    assert catalog.credits.tolist() == [course['credits'] for course in courses]
+    assert catalog.number.tolist()[:4] == [120, 160, 121, 240]
+    assert [catalog.strings[i] for i in catalog.dept_names[catalog.dept].tolist()][-3:] == ['CIS', 'ESE', 'CIS']
+    assert catalog.rate_offered[-2].tolist() == [0.2, 0, 0.8]
+
+    # The adapter can stand in for the list of course infos
+    br = BaseRequirement(categories=['ENG@SEAS'])
+    assert CatalogIndex(catalog).courses_satisfying(br) == CatalogIndex(courses).courses_satisfying(br)
+
+
+def test_compiled_catalog_rejects_other_files(tmp_path):
+    filename = tmp_path / 'course_infos.json'
+    filename.write_text('[]')
+    with pytest.raises(ValueError):
+        CompiledCatalog.load(str(filename))
@@ -0,0 +1,189 @@
+from math import inf
+import threading
+from time import perf_counter
+import pytest
+import requests
+from conftest import StubApiServer
+import fetch_data
+from fetch_data import (
+    compute_course_infos, fetch_course_infos, get_cached_value, historical_offered_rate, historical_semesters,
+    read_checkpoint
+)
+from http_cache import HttpCache
+from http_fetch import AsyncFetcher
+
+
+def test_fetch_course_infos(stub_api_server: StubApiServer):
+    course_ids = [f'CIS-{100 + i}' for i in range(40)]
+    for course_id in course_ids:
+        stub_api_server.documents[f'/courses/{course_id}/'] = {'id': course_id, 'description': '...'}
+    # Transient failures are retried, missing courses and persistent failures are reported
+    stub_api_server.fail_first['/courses/CIS-100/'] = 2
+    stub_api_server.fail_first['/courses/CIS-101/'] = 100
+    del stub_api_server.documents['/courses/CIS-102/']
+
+    with AsyncFetcher(concurrency=4, max_attempts=3, backoff=0.01) as fetcher:
+        course_infos, failures = fetch_course_infos(course_ids, fetcher, f'{stub_api_server.url}/courses/{{}}/')
+    assert failures == {'CIS-101': 'HTTP 503', 'CIS-102': 'HTTP 404'}
+    assert set(course_infos) == set(course_ids) - set(failures)
+    assert course_infos['CIS-100'] == {'id': 'CIS-100'}
+    assert stub_api_server.num_requests['/courses/CIS-100/'] == 3
+    assert stub_api_server.num_requests['/courses/CIS-101/'] == 3
+    assert stub_api_server.num_requests['/courses/CIS-102/'] == 1
+    # Connections are kept alive and reused
+    assert len(stub_api_server.client_addresses) <= 4
+
+
+def test_fetch_rate_limit(stub_api_server: StubApiServer):
+    stub_api_server.documents['/x/'] = 1
+    with AsyncFetcher(concurrency=2, rate_limit=50) as fetcher:
+        start = perf_counter()
+        results = fetcher.fetch_all_sync({i: f'{stub_api_server.url}/x/' for i in range(20)})
+        # A burst of 2, then 50 per second
+        assert perf_counter() - start >= 18 / 50
+    assert all(result.value == 1 for result in results.values())
+
+
+def test_compute_course_infos_resumes(stub_api_server: StubApiServer, tmp_path):
+    course_ids = [f'CIS-{100 + i}' for i in range(10)]
+    for course_id in course_ids:
+        stub_api_server.documents[f'/courses/{course_id}/'] = {'id': course_id, 'description': '...'}
+    stub_api_server.fail_first['/courses/CIS-109/'] = 100
+    # An interrupted refresh that saved two courses, and was killed while writing the third
+    checkpoint = tmp_path / 'course_infos.partial.jsonl'
+    checkpoint.write_text('{"id": "CIS-103"}\n{"id": "CIS-100"}\n{"id": "CIS-1')
+
+    with AsyncFetcher(max_attempts=2, backoff=0.01) as fetcher:
+        course_infos = compute_course_infos(
+            [{'id': course_id} for course_id in course_ids], str(checkpoint), f'{stub_api_server.url}/courses/{{}}/', fetcher
+        )
+    assert [course_info['id'] for course_info in course_infos] == course_ids[:-1]
+    assert stub_api_server.num_requests['/courses/CIS-103/'] == stub_api_server.num_requests['/courses/CIS-100/'] == 0
+    assert stub_api_server.num_requests['/courses/CIS-101/'] == 1
+    # The caller deletes the checkpoint once it saved the course infos
+    assert checkpoint.exists()
+
+
+def test_checkpoint_kept_until_course_infos_saved(stub_api_server: StubApiServer, tmp_path, monkeypatch):
+    course_ids = [f'CIS-{100 + i}' for i in range(5)]
+    for course_id in course_ids:
+        stub_api_server.documents[f'/courses/{course_id}/'] = {'id': course_id}
+    cache_file = tmp_path / 'course_infos.json'
+    checkpoint = tmp_path / 'course_infos.partial.jsonl'
+
+    def get_course_infos(fetcher: AsyncFetcher) -> list:
+        return get_cached_value(
+            str(cache_file),
+            lambda: compute_course_infos(
+                [{'id': course_id} for course_id in course_ids], str(checkpoint),
+                f'{stub_api_server.url}/courses/{{}}/', fetcher
+            ),
+            on_saved=checkpoint.unlink,
+        )
+
+    # Saving the course infos fails after they were all fetched, so the checkpoint must survive
+    def fail_to_write(filename: str, value) -> None:
+        raise OSError('No space left on device')
+    monkeypatch.setattr(fetch_data, 'write_json_atomically', fail_to_write)
+    with AsyncFetcher(backoff=0.01) as fetcher, pytest.raises(OSError):
+        get_course_infos(fetcher)
+    assert not cache_file.exists()
+    assert len(read_checkpoint(str(checkpoint))) == len(course_ids)
+    monkeypatch.undo()
+
+    # The next refresh saves them without fetching them again, and only then deletes the checkpoint
+    with AsyncFetcher(backoff=0.01) as fetcher:
+        assert [course_info['id'] for course_info in get_course_infos(fetcher)] == course_ids
+    assert all(stub_api_server.num_requests[f'/courses/{course_id}/'] == 1 for course_id in course_ids)
+    assert cache_file.exists()
+    assert not checkpoint.exists()
+
+
+def test_read_checkpoint(tmp_path):
+    checkpoint = tmp_path / 'course_infos.partial.jsonl'
+    checkpoint.write_text('{"id": "CIS-100"}\n{"id": "CIS-1')
+    assert read_checkpoint(str(checkpoint)) == {'CIS-100': {'id': 'CIS-100'}}
+    # The partial line is cut off, so that the next course info starts on its own line
+    assert checkpoint.read_text() == '{"id": "CIS-100"}\n'
+    assert read_checkpoint(str(tmp_path / 'missing.jsonl')) == {}
+
+
+def test_http_cache(stub_api_server: StubApiServer, tmp_path):
+    url = f'{stub_api_server.url}/courses/'
+    stub_api_server.documents['/courses/'] = [{'id': 'CIS-120'}]
+    cache = HttpCache(str(tmp_path))
+    assert cache.get_json(url) == [{'id': 'CIS-120'}]
+    # Fresh responses are used without a request
+    assert cache.get_json(url) == [{'id': 'CIS-120'}]
+    assert stub_api_server.num_requests['/courses/'] == 1
+    # Stale responses are revalidated, and only downloaded again if they changed
+    assert cache.get_json(url, ttl=0) == [{'id': 'CIS-120'}]
+    assert stub_api_server.num_not_modified['/courses/'] == 1
+    stub_api_server.documents['/courses/'] = [{'id': 'CIS-121'}]
+    assert cache.get_json(url, ttl=inf) == [{'id': 'CIS-120'}]
+    assert HttpCache(str(tmp_path)).get_json(url, ttl=0) == [{'id': 'CIS-121'}]
+    assert stub_api_server.num_requests['/courses/'] == 3
+    assert (cache.hits, cache.revalidated, cache.downloads) == (2, 1, 1)
+    with pytest.raises(requests.HTTPError):
+        cache.get_json(f'{stub_api_server.url}/missing/')
+
+
+def test_fetch_course_infos_cached(stub_api_server: StubApiServer, tmp_path, monkeypatch):
+    course_ids = [f'CIS-{100 + i}' for i in range(10)]
+    for course_id in course_ids:
+        stub_api_server.documents[f'/courses/{course_id}/'] = {'id': course_id}
+    get_course_api = f'{stub_api_server.url}/courses/{{}}/'
+    cache = HttpCache(str(tmp_path))
+    # Entries are saved in the fetcher's threads, not the event loop's (which runs in this thread)
+    saving_threads = set()
+    save = HttpCache.save
+    def record_thread(self, entry) -> None:
+        saving_threads.add(threading.get_ident())
+        save(self, entry)
+    monkeypatch.setattr(HttpCache, 'save', record_thread)
+    with AsyncFetcher(concurrency=4, cache=cache) as fetcher:
+        fetch_course_infos(course_ids, fetcher, get_course_api)
+        assert cache.downloads == 10
+        fetch_course_infos(course_ids, fetcher, get_course_api)
+        assert cache.hits == 10
+        # A refresh only downloads the courses that changed
+        stub_api_server.documents['/courses/CIS-105/'] = {'id': 'CIS-105', 'title': 'New'}
+        cache.ttl = 0
+        course_infos, failures = fetch_course_infos(course_ids, fetcher, get_course_api)
+    assert not failures
+    assert course_infos['CIS-105'] == {'id': 'CIS-105', 'title': 'New'}
+    assert (cache.revalidated, cache.downloads) == (9, 11)
+    assert sum(stub_api_server.num_requests.values()) == 20
+    assert saving_threads and threading.get_ident() not in saving_threads
+
+
+def test_historical_offered_rate(stub_api_server: StubApiServer, tmp_path):
+    semesters = historical_semesters('2022B')
+    assert semesters[:4] == ['2022A', '2022B', '2021A', '2021B'] and len(semesters) == 14
+    for semester in semesters + ['2022C']:
+        # CIS-120 is offered every semester, CIS-160 every fall and CIS-121 every spring until 2020
+        course_ids = ['CIS-120', 'CIS-120']
+        course_ids += ['CIS-160'] if semester.endswith('C') else []
+        course_ids += ['CIS-121'] if semester.endswith('A') and semester < '2020' else []
+        stub_api_server.documents[f'/{semester}/courses/'] = [{'id': course_id} for course_id in course_ids]
+    stub_api_server.fail_first['/2019B/courses/'] = 100
+    list_courses_api_url = f'{stub_api_server.url}/{{}}/courses/'
+
+    with AsyncFetcher(max_attempts=1) as fetcher:
+        rates = historical_offered_rate('2022B', str(tmp_path), list_courses_api_url, fetcher)
+        assert rates == {
+            'CIS-120': {'A': 1.0, 'B': 1.0, 'C': 1.0},
+            'CIS-121': {'A': 2 / 5, 'B': 0.0, 'C': 0.0},
+            'CIS-160': {'A': 0.0, 'B': 0.0, 'C': 1.0},
+        }
+        assert sum(stub_api_server.num_requests.values()) == 14
+
+        # Past semesters are saved; the current one is fetched again, and a new term costs one download
+        stub_api_server.num_requests.clear()
+        historical_offered_rate('2022B', str(tmp_path), list_courses_api_url, fetcher)
+        assert dict(stub_api_server.num_requests) == {'/2019B/courses/': 1, '/2022B/courses/': 1}
+        del stub_api_server.fail_first['/2019B/courses/']
+        stub_api_server.num_requests.clear()
+        rates = historical_offered_rate('2022C', str(tmp_path), list_courses_api_url, fetcher)
+        assert dict(stub_api_server.num_requests) == {'/2019B/courses/': 1, '/2022C/courses/': 1}
+    assert rates['CIS-160'] == {'A': 0.0, 'B': 0.0, 'C': 1.0}
@@ -0,0 +1,47 @@
+from collections import defaultdict
+from typing import Sequence
+from cp2_types import CompletedCourse, CourseInfo, ScheduleParams, Requirement
+from greedy import greedy_schedule
+from solver import ScheduleGenerator
+
+
+def test_greedy_schedule_respects_prerequisites_and_seasons(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=1,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-262']),
+            Requirement.base(courses=['CIS-261']),
+            Requirement.base(courses=['CIS-160']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    generator = ScheduleGenerator(sample_courses_info, [], [], params)
+    greedy = greedy_schedule(generator)
+
+    # CIS-160 is a prereq of both courses, and CIS-261 is only offered in the fall
+    assert greedy.semester_of == {'CIS-160': 1, 'CIS-262': 2, 'CIS-261': 3}
+    assert all(len(greedy.counts_for[c]) == 1 for c in greedy.semester_of)
+
+    generator.add_greedy_hints()
+    assert generator.solve()
+
+
+def test_greedy_schedule_keeps_completed_courses(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=3,
+        min_credits_per_semester=0,
+        max_credits_per_semester=1,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-262']),
+            Requirement.base(courses=['CIS-160']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    completed_courses = [CompletedCourse('CIS-160', 1, [])]
+    generator = ScheduleGenerator(sample_courses_info, [], completed_courses, params)
+    greedy = greedy_schedule(generator)
+    assert greedy.semester_of == {'CIS-160': 1, 'CIS-262': 2}
@@ -0,0 +1,144 @@
+from collections import defaultdict
+import os
+from typing import Sequence
+from ortools.sat.python import cp_model
+from catalog import CatalogIndex
+from cp2_types import CourseInfo, CourseRequest, Requirement, ScheduleParams
+from schedule_cache import ScheduleCache
+import solver
+from solver import generate_schedule
+
+
+def make_params(max_credits_per_semester: float = 2) -> ScheduleParams:
+    return ScheduleParams(
+        num_semesters=3,
+        min_credits_per_semester=0,
+        max_credits_per_semester=max_credits_per_semester,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.any([Requirement.base(courses=['CIS-262']), Requirement.base(courses=['CIS-261'])]),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+
+
+def test_schedule_cache_key(sample_courses_info: Sequence[CourseInfo], tmp_path):
+    cache = ScheduleCache(str(tmp_path))
+    index = CatalogIndex(sample_courses_info)
+    params = make_params()
+    requests = [CourseRequest('CIS-120', 1), CourseRequest('CIS-160', None)]
+    key = cache.key(index, requests, [], params)
+    # Requests in another order, and requirement blocks with the same structure but new uids
+    assert cache.key(index, requests[::-1], [], make_params()) == key
+    assert cache.key(index, requests[:1], [], params) != key
+    assert cache.key(index, requests, [], make_params(max_credits_per_semester=1)) != key
+    assert cache.key(CatalogIndex(sample_courses_info[1:]), requests, [], params) != key
+
+    # Solving doesn't replace unlimited double counting (None) with a bound in the params, which would change the key
+    params = make_params()
+    params.requirement_blocks.append([Requirement.base(courses=['CIS-120'])])
+    params.max_double_counts = {(0, 1): None}
+    key = cache.key(index, [], [], params)
+    assert generate_schedule(sample_courses_info, [], [], params, catalog_index=index, cache=cache)
+    assert params.max_double_counts == {(0, 1): None}
+    assert cache.key(index, [], [], params) == key
+
+
+def test_schedule_cache_double_counting(sample_courses_info: Sequence[CourseInfo], tmp_path):
+    # An empty defaultdict means no double counting or no limit, depending on its default
+    def make_double_major_params(max_double_counts) -> ScheduleParams:
+        return ScheduleParams(
+            num_semesters=2,
+            min_credits_per_semester=0,
+            max_credits_per_semester=1,
+            requirement_blocks=[
+                [Requirement.base(courses=['CIS-160'])],
+                [Requirement.base(courses=['CIS-120', 'CIS-160'])],
+            ],
+            max_double_counts=max_double_counts,
+            cannot_triple_count=set(),
+        )
+    cache = ScheduleCache(str(tmp_path))
+    unlimited_params = make_double_major_params(defaultdict(lambda: None))
+    schedule, _ = generate_schedule(sample_courses_info, [], [], unlimited_params, cache=cache)
+    assert sorted(c for semester in schedule for c in semester) == ['CIS-160']
+    no_double_counting_params = make_double_major_params(defaultdict(int))
+    schedule, _ = generate_schedule(sample_courses_info, [], [], no_double_counting_params, cache=cache)
+    assert sorted(c for semester in schedule for c in semester) == ['CIS-120', 'CIS-160']
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (0, 0, 2)
+    # Reading the bounds for the key doesn't add them to the params
+    assert not unlimited_params.max_double_counts and not no_double_counting_params.max_double_counts
+
+
+def test_generate_schedule_with_cache(sample_courses_info: Sequence[CourseInfo], tmp_path):
+    cache = ScheduleCache(str(tmp_path))
+    params = make_params()
+    soln = generate_schedule(sample_courses_info, [], [], params, cache=cache)
+    assert soln
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (0, 0, 1)
+    assert generate_schedule(sample_courses_info, [], [], params, cache=cache) == soln
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (1, 0, 1)
+
+    # A new cache (e.g. after a restart) finds it on disk, and maps it to the new requirement blocks
+    cache = ScheduleCache(str(tmp_path))
+    other_params = make_params()
+    schedule, course_id_to_requirements = generate_schedule(sample_courses_info, [], [], other_params, cache=cache)
+    assert schedule == soln[0]
+    all_base_requirements = [
+        br for req in other_params.requirement_blocks[0]
+        for br in ([req.base_requirement] if not req.is_multi_requirement else [r.base_requirement for r in req.multi_requirements])
+    ]
+    assert all(
+        br in all_base_requirements and br.courses == {c}
+        for c, requirements in course_id_to_requirements.items() for _, br in requirements
+    )
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (0, 1, 0)
+
+
+def test_schedule_cache_only_optimal(sample_courses_info: Sequence[CourseInfo], tmp_path, monkeypatch):
+    # A schedule found within the time limit but not proven optimal isn't cached
+    solve = solver.ScheduleGenerator.solve
+    def solve_until_time_limit(self, *args, **kwargs):
+        soln = solve(self, *args, **kwargs)
+        assert self.status == cp_model.OPTIMAL
+        self.status = cp_model.FEASIBLE
+        return soln
+    monkeypatch.setattr(solver.ScheduleGenerator, 'solve', solve_until_time_limit)
+    cache = ScheduleCache(str(tmp_path))
+    params = make_params()
+    assert generate_schedule(sample_courses_info, [], [], params, time_limit=30, cache=cache)
+    assert generate_schedule(sample_courses_info, [], [], params, time_limit=30, cache=cache)
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (0, 0, 2)
+    assert not os.listdir(tmp_path)
+
+
+def test_schedule_cache_eviction(sample_courses_info: Sequence[CourseInfo], tmp_path):
+    params = make_params()
+    soln = generate_schedule(sample_courses_info, [], [], params)
+    assert soln
+
+    # Too old
+    cache = ScheduleCache(str(tmp_path), max_age=-1)
+    cache.put('a', params.requirement_blocks, soln)
+    assert ScheduleCache(str(tmp_path), max_age=-1).get('a', params.requirement_blocks) is None
+    assert not os.listdir(tmp_path)
+    # In memory too
+    assert cache.get('a', params.requirement_blocks) is None
+    assert not cache.entries
+
+    # Too big: the oldest entries are deleted first
+    cache = ScheduleCache(str(tmp_path))
+    cache.put('a', params.requirement_blocks, soln)
+    os.utime(tmp_path / 'a.json', (0, 0))
+    cache.max_disk_bytes = os.path.getsize(tmp_path / 'a.json')
+    cache.max_age = None
+    cache.put('b', params.requirement_blocks, soln)
+    assert os.listdir(tmp_path) == ['b.json']
+
+    # The memory tier is an LRU
+    cache = ScheduleCache(None, max_entries=1)
+    cache.put('a', params.requirement_blocks, soln)
+    cache.put('b', params.requirement_blocks, soln)
+    assert cache.get('a', params.requirement_blocks) is None
+    assert cache.get('b', params.requirement_blocks) == soln
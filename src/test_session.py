@@ -0,0 +1,79 @@
+from collections import defaultdict
+from typing import Sequence
+from cp2_types import CourseInfo, CourseRequest, ScheduleParams, Requirement
+from session import ScheduleSession
+from solver import ScheduleGenerator
+
+
+def semester_of(soln) -> dict[str, int]:
+    schedule, _ = soln
+    return {c: s for s, semester in enumerate(schedule) for c in semester}
+
+
+def test_schedule_session(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-262']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    session = ScheduleSession(sample_courses_info, [], params)
+    assert session.solve()
+    generator = session.generator
+
+    session.request('CIS-262', 4)
+    assert (soln := session.solve()) and semester_of(soln)['CIS-262'] == 4
+    session.request('CIS-262', 2)
+    assert (soln := session.solve()) and semester_of(soln)['CIS-262'] == 2
+    # CIS-262 needs CIS-160 first
+    session.request('CIS-262', 1)
+    assert not session.solve()
+    session.request('CIS-262', 3)
+    assert (soln := session.solve()) and semester_of(soln)['CIS-262'] == 3
+    assert session.generator is generator
+
+    # CIS-120 doesn't count for anything, so it isn't in the model until it's requested
+    session.request('CIS-120', 1)
+    assert session.generator is not generator
+    assert (soln := session.solve()) and semester_of(soln)['CIS-120'] == 1
+    session.unrequest('CIS-120')
+    assert (soln := session.solve()) and 'CIS-120' not in semester_of(soln)
+
+    session.forbid('CIS-160')
+    assert not session.solve()
+    session.allow('CIS-160')
+    assert (soln := session.solve()) and semester_of(soln)['CIS-160'] < semester_of(soln)['CIS-262'] == 3
+
+
+def test_schedule_session_pruning(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=3,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[Requirement.base(depts=['CIS'])]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    # CIS-240 dominates CIS-121 (see `test_prune_courses`), so CIS-121 is left out of the model
+    session = ScheduleSession(sample_courses_info, [], params)
+    assert 'CIS-121' not in session.generator.takes_course
+    assert session.solve()
+
+    # Requesting CIS-240 brings it back, as in a new model with the request
+    generator = session.generator
+    session.request('CIS-240', 3)
+    assert session.generator is not generator
+    assert 'CIS-121' in session.generator.takes_course
+    assert ScheduleGenerator(
+        sample_courses_info, [CourseRequest('CIS-240', 3)], [], params
+    ).takes_course.keys() == session.generator.takes_course.keys()
+    assert (soln := session.solve()) and semester_of(soln)['CIS-240'] == 3
+    # Only once
+    generator = session.generator
+    session.request('CIS-240', 2)
+    assert session.generator is generator
@@ -1,12 +1,23 @@
 from collections import defaultdict
 from itertools import count
 import sched
+import threading
 from typing import Sequence
+from catalog import CatalogIndex
 from cp2_types import CompletedCourse, CourseInfo, CourseRequest, ScheduleParams, Requirement
-from solver import generate_schedule
+from solver import ScheduleGenerator, SemesterEncoding, generate_schedule, max_double_counted_units_upper_bound
+import solver
+from ortools.sat.python import cp_model
 import pytest
 
 
+@pytest.fixture(autouse=True, params=list(SemesterEncoding), ids=[encoding.value for encoding in SemesterEncoding])
+def semester_encoding(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> SemesterEncoding:
+    """ Run every test with each of the semester encodings. """
+    monkeypatch.setattr(solver, 'DEFAULT_SEMESTER_ENCODING', request.param)
+    return request.param
+
+
 def test_empty(sample_courses_info: Sequence[CourseInfo]):
     params = ScheduleParams(
         num_semesters=1,
@@ -134,6 +145,21 @@ def test_requirement_one_dept_not_exists(sample_courses_info: Sequence[CourseInf
     assert not generate_schedule(sample_courses_info, [], [], params)
 
 
+def test_elective_dept_not_exists(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=1,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.elective(depts=['OMG'])
+        ]],
+        # No double counting
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    assert not generate_schedule(sample_courses_info, [], [], params)
+
+
 def test_requirement_same_course_not_allowed(sample_courses_info: Sequence[CourseInfo]):
     params = ScheduleParams(
         num_semesters=1,
@@ -799,6 +825,383 @@ def can(sample_courses_info: Sequence[CourseInfo]):
     assert not generate_schedule(sample_courses_info, [], [], params)
 
 
+def test_counts_for_only_eligible_pairs(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=2,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            c160 := Requirement.base(courses=['CIS-160']),
+            math := Requirement.base(categories=['MATH@SEAS']),
+            cis := Requirement.base(depts=['CIS']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    completed_courses = [
+        # Pinned to a requirement that it wouldn't otherwise satisfy
+        CompletedCourse('MATH-104', 0, [cis.base_requirement.uid])
+    ]
+    generator = ScheduleGenerator(sample_courses_info, [], completed_courses, params)
+
+    assert set(generator.counts_for) == {
+        ('CIS-160', c160.base_requirement.uid),
+        ('CIS-160', math.base_requirement.uid),
+        ('CIS-262', math.base_requirement.uid),
+        ('MATH-104', math.base_requirement.uid),
+        ('MATH-104', cis.base_requirement.uid),
+        # CIS-188 and CIS-189 are 0.5 CU so they can't satisfy the CIS requirement,
+        # and CIS-121 is pruned since CIS-240 can count for the same requirements with fewer prereqs
+        *(
+            (course_id, cis.base_requirement.uid)
+            for course_id in ['CIS-120', 'CIS-160', 'CIS-240', 'CIS-262', 'CIS-261']
+        ),
+    }
+
+
+def test_interchangeable_requirements(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=2,
+        min_credits_per_semester=0,
+        max_credits_per_semester=3,
+        requirement_blocks=[
+            cis := [Requirement.base(depts=['CIS']) for _ in range(2)],
+            [Requirement.all(electives := [Requirement.elective(depts=['CIS']) for _ in range(3)])],
+        ],
+        max_double_counts=defaultdict(lambda: None),
+        cannot_triple_count=set(),
+    )
+    completed_courses = [
+        # Pinned to a requirement that isn't the group's representative
+        CompletedCourse('CIS-120', 0, [cis[1].base_requirement.uid, electives[2].multi_requirements[0].base_requirement.uid])
+    ]
+    generator = ScheduleGenerator(sample_courses_info, [], completed_courses, params)
+    # Courses only count for the first requirement of each group
+    assert set(br_uid for _, br_uid in generator.counts_for) == {
+        cis[0].base_requirement.uid, electives[0].multi_requirements[0].base_requirement.uid
+    }
+
+    assert (soln := generator.solve())
+    schedule, course_id_to_requirements = soln
+    assert 'CIS-120' in schedule[0]
+    # Each requirement is satisfied by its own course, and 0.5 CU courses don't count for the electives
+    satisfied_by = defaultdict(list)
+    for c, requirements in course_id_to_requirements.items():
+        for _, br in requirements:
+            satisfied_by[br.uid].append(c)
+    assert sorted(satisfied_by) == sorted(
+        [req.base_requirement.uid for req in cis] + [req.multi_requirements[0].base_requirement.uid for req in electives]
+    )
+    assert all(len(course_ids) == 1 for course_ids in satisfied_by.values())
+    assert len(set(satisfied_by[req.base_requirement.uid][0] for req in cis)) == 2
+    elective_course_ids = [satisfied_by[req.multi_requirements[0].base_requirement.uid][0] for req in electives]
+    assert len(set(elective_course_ids)) == 3
+    assert all(generator.course_id_to_course[c]['credits'] == 1 for c in elective_course_ids)
+
+    # Without double counting, there are six 1 CU CIS courses for the requirements
+    def no_double_counting_params(num_cis: int) -> ScheduleParams:
+        return ScheduleParams(
+            num_semesters=4,
+            min_credits_per_semester=0,
+            max_credits_per_semester=4,
+            requirement_blocks=[
+                [Requirement.base(depts=['CIS']) for _ in range(num_cis)],
+                [Requirement.all([Requirement.elective(depts=['CIS']) for _ in range(3)])],
+            ],
+            max_double_counts=defaultdict(int),
+            cannot_triple_count=set(),
+        )
+    assert generate_schedule(sample_courses_info, [], [], no_double_counting_params(3))
+    assert not generate_schedule(sample_courses_info, [], [], no_double_counting_params(4))
+
+
+def test_prune_courses(sample_courses_info: Sequence[CourseInfo]):
+    cis_121_copy = dict(next(course for course in sample_courses_info if course['id'] == 'CIS-121'), id='CIS-1210')
+    all_courses = [*sample_courses_info, cis_121_copy]
+    index = CatalogIndex(all_courses)
+    blocks = [[Requirement.base(depts=['CIS'])]]
+    # CIS-240 and CIS-262 dominate CIS-121 (same requirements, a subset of the prereqs), which is equivalent to
+    # its copy, and CIS-262 dominates CIS-261 (offered in more seasons and less difficult)
+    pruning = solver.prune_courses(index, blocks)
+    assert pruning.equivalent == {'CIS-1210'}
+    assert pruning.dominated == {'CIS-121', 'CIS-261'}
+    assert pruning.dominators_of['CIS-121'] == pruning.dominators_of['CIS-1210'] == ('CIS-240', 'CIS-262')
+    assert pruning.dominators_of['CIS-261'] == ('CIS-262',)
+    # Each requirement needs its own dominator, so CIS-121 is kept for three of them (but its copy isn't)
+    pruning = solver.prune_courses(index, [[Requirement.base(depts=['CIS']) for _ in range(3)]])
+    assert not pruning.equivalent
+    assert pruning.dominated == {'CIS-1210'}
+
+    def make_params() -> ScheduleParams:
+        return ScheduleParams(
+            num_semesters=3,
+            min_credits_per_semester=0,
+            max_credits_per_semester=2,
+            requirement_blocks=blocks,
+            max_double_counts=defaultdict(int),
+            cannot_triple_count=set(),
+        )
+    generator = ScheduleGenerator(all_courses, [], [], make_params(), catalog_index=index)
+    assert 'CIS-121' not in generator.takes_course and 'CIS-1210' not in generator.takes_course
+    assert generator.pruning.equivalent == {'CIS-1210'}
+    assert generator.pruning.dominated == {'CIS-121', 'CIS-261'}
+    # Unless it is requested, or its dominator is
+    generator = ScheduleGenerator(all_courses, [CourseRequest('CIS-121', None)], [], make_params(), catalog_index=index)
+    assert 'CIS-121' in generator.takes_course and 'CIS-1210' not in generator.takes_course
+    assert generator.pruning.dominated == {'CIS-261'}
+    generator = ScheduleGenerator(all_courses, [CourseRequest('CIS-240', 3)], [], make_params(), catalog_index=index)
+    assert 'CIS-121' in generator.takes_course
+
+
+def test_model_skeleton_reused(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=2,
+        min_credits_per_semester=0,
+        max_credits_per_semester=1,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-262']),
+            Requirement.base(courses=['CIS-160']),
+        ]],
+        # No double counting
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    generator = ScheduleGenerator(sample_courses_info, [], [], params)
+    assert (soln := generator.solve())
+    schedule, _ = soln
+    assert schedule == [[], ['CIS-160'], ['CIS-262']]
+
+    completed_courses = [CompletedCourse('CIS-160', 1, [])]
+    other_generator = ScheduleGenerator(sample_courses_info, [], completed_courses, params)
+    assert other_generator.takes_course_in_sem is generator.takes_course_in_sem
+    assert other_generator.model is not generator.model
+    assert (soln := other_generator.solve())
+    schedule, _ = soln
+    assert schedule == [[], ['CIS-160'], ['CIS-262']]
+
+    # Prerequisites don't apply to completed courses
+    completed_courses = [CompletedCourse('CIS-262', 1, [])]
+    assert (soln := ScheduleGenerator(sample_courses_info, [], completed_courses, params).solve())
+    schedule, _ = soln
+    assert schedule == [[], ['CIS-262'], ['CIS-160']]
+
+    # The first model wasn't modified by the other students' constraints
+    assert (soln := generator.solve())
+    schedule, _ = soln
+    assert schedule == [[], ['CIS-160'], ['CIS-262']]
+
+
+def test_model_built_quietly(sample_courses_info: Sequence[CourseInfo], capsys):
+    params = ScheduleParams(
+        num_semesters=3,
+        min_credits_per_semester=0,
+        max_credits_per_semester=1,
+        requirement_blocks=[[Requirement.base(courses=['CIS-120'])], [Requirement.base(courses=['CIS-160'])]],
+        max_double_counts=defaultdict(lambda: None),
+        cannot_triple_count=set(),
+    )
+    # Neither the skeleton nor the student's constraints print anything unless verbose
+    ScheduleGenerator(sample_courses_info, [], [], params)
+    assert capsys.readouterr().out == ''
+    ScheduleGenerator(sample_courses_info, [], [], params, verbose=True)
+    assert 'take_completed_courses' in capsys.readouterr().out
+
+
+def test_model_skeleton_saved(sample_courses_info: Sequence[CourseInfo], semester_encoding: SemesterEncoding, tmp_path):
+    def make_params(num_semesters: int = 2) -> ScheduleParams:
+        return ScheduleParams(
+            num_semesters=num_semesters,
+            min_credits_per_semester=0,
+            max_credits_per_semester=1,
+            requirement_blocks=[[
+                Requirement.base(courses=['CIS-262']),
+                Requirement.any([Requirement.base(courses=['CIS-160']), Requirement.base(courses=['CIS-120'])]),
+            ]],
+            max_double_counts=defaultdict(int),
+            cannot_triple_count=set(),
+        )
+    index = CatalogIndex(sample_courses_info)
+    skeleton = solver.get_model_skeleton(index, make_params(), [], [], semester_encoding)
+    path = str(tmp_path / 'skeleton.pickle')
+    skeleton.save(path)
+
+    # Requirement blocks with the same structure have new uids, so they aren't cached yet
+    params = make_params()
+    loaded = solver.get_model_skeleton(index, params, [], [], semester_encoding, saved_path=path)
+    assert loaded.model.Proto() == skeleton.model.Proto()
+    assert {k: v.Index() for k, v in loaded.takes_course_in_sem.items()} == {k: v.Index() for k, v in skeleton.takes_course_in_sem.items()}
+    assert len(loaded.counts_for) == len(skeleton.counts_for)
+
+    generator = ScheduleGenerator(sample_courses_info, [], [], params, catalog_index=index)
+    assert generator.takes_course_in_sem is loaded.takes_course_in_sem
+    assert (soln := generator.solve())
+    schedule, course_id_to_requirements = soln
+    assert schedule == [[], ['CIS-160'], ['CIS-262']]
+    assert [br.courses for _, br in course_id_to_requirements['CIS-262']] == [{'CIS-262'}]
+    assert course_id_to_requirements['CIS-262'][0][1] is params.requirement_blocks[0][0].base_requirement
+
+    # Saved for other inputs
+    with pytest.raises(ValueError):
+        solver.get_model_skeleton(index, make_params(num_semesters=3), [], [], semester_encoding, saved_path=path)
+
+
+def test_semesters_of_course(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-120']),
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-121']),
+            Requirement.base(courses=['CIS-261']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    generator = ScheduleGenerator(sample_courses_info, [], [], params)
+    assert generator.semesters_of_course['CIS-120'] == [1, 2, 3, 4]
+    assert generator.semesters_of_course['CIS-121'] == [2, 3, 4]
+    # CIS-261 is only offered in the fall
+    assert generator.semesters_of_course['CIS-261'] == [3]
+    assert ('CIS-121', 1) not in generator.takes_course_in_sem
+
+    # Completed courses can be taken in any semester, which also moves up the courses that depend on them
+    completed_courses = [CompletedCourse('CIS-160', 0, [])]
+    generator = ScheduleGenerator(sample_courses_info, [], completed_courses, params)
+    assert generator.semesters_of_course['CIS-160'] == [0, 1, 2, 3, 4]
+    assert generator.semesters_of_course['CIS-261'] == [1, 3]
+    assert (soln := generator.solve())
+    schedule, _ = soln
+    assert schedule[0] == ['CIS-160']
+    assert 'CIS-261' in schedule[1] + schedule[3]
+
+
+def test_solve_iter(sample_courses_info: Sequence[CourseInfo], capsys):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-262']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    generator = ScheduleGenerator(sample_courses_info, [], [], params)
+    # Take CIS-262 as late as possible, so that the solver has to improve on the first solutions
+    generator.model.Maximize(sum(s * generator.takes_course_in_sem['CIS-262', s] for s in generator.semesters_of_course['CIS-262']))
+    capsys.readouterr()
+    sems_of_262 = [
+        next(s for s, semester in enumerate(schedule) if 'CIS-262' in semester)
+        for schedule, _ in generator.solve_iter(use_hints=False)
+    ]
+    assert sems_of_262 == sorted(sems_of_262)
+    assert sems_of_262[-1] == 4
+    # Progress is only printed when verbose
+    assert capsys.readouterr().out == ''
+
+    # The solver stops when the caller stops iterating
+    generator.decode_time = 0.0
+    solutions = generator.solve_iter(time_limit=10)
+    schedule, course_id_to_requirement = next(solutions)
+    solutions.close()
+    assert 'CIS-160' in course_id_to_requirement and 'CIS-262' in course_id_to_requirement
+    assert not any(thread.name == 'schedule-solver' for thread in threading.enumerate())
+    assert generator.decode_time > 0
+
+    assert (soln := generate_schedule(sample_courses_info, [], [], params, time_limit=10))
+
+
+def test_solve_many(sample_courses_info: Sequence[CourseInfo], capsys):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-262']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    generator = ScheduleGenerator(sample_courses_info, [], [], params)
+    def semesters(soln) -> tuple[int, int]:
+        schedule, _ = soln
+        sem_of = {c: s for s, semester in enumerate(schedule) for c in semester}
+        return sem_of['CIS-160'], sem_of['CIS-262']
+
+    # CIS-160 must be taken before CIS-262, so there are 6 schedules
+    capsys.readouterr()
+    solns = generator.solve_many(10)
+    assert sorted(semesters(soln) for soln in solns) == [(1, 2), (1, 3), (1, 4), (2, 3), (2, 4), (3, 4)]
+    assert capsys.readouterr().out == ''
+    assert len(generator.solve_many(4)) == 4
+
+    # Both courses must move between any two schedules (there are at most 3 such schedules,
+    # but each schedule is only required to be far from the earlier ones, so there may be fewer)
+    solns = generator.solve_many(10, min_hamming_distance=4)
+    assert 2 <= len(solns) <= 3
+    for i, soln in enumerate(solns):
+        for other_soln in solns[:i]:
+            assert all(s1 != s2 for s1, s2 in zip(semesters(soln), semesters(other_soln)))
+
+    # The model itself isn't changed
+    assert generator.solve()
+
+
+def test_diagnose_infeasibility(sample_courses_info: Sequence[CourseInfo], monkeypatch):
+    params = ScheduleParams(
+        num_semesters=2,
+        min_credits_per_semester=0,
+        max_credits_per_semester=1,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-262']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    generator = ScheduleGenerator(sample_courses_info, [], [], params, guard_constraints=True)
+    assert generator.diagnose_infeasibility() is None
+
+    # CIS-262 needs CIS-160 first
+    course_requests = [CourseRequest('CIS-262', 1)]
+    assert not ScheduleGenerator(sample_courses_info, course_requests, [], params).solve()
+    generator = ScheduleGenerator(sample_courses_info, course_requests, [], params, guard_constraints=True)
+    assert generator.diagnose_infeasibility() == ['request CIS-262 in semester 1']
+
+    # The solver doesn't promise a minimal set of assumptions: one with every guard is shrunk to the request
+    all_guards = [guard.Index() for guard in generator.guards.values()]
+    sufficient_assumptions = cp_model.CpSolver.SufficientAssumptionsForInfeasibility
+    num_calls = 0
+    def all_guards_first(self):
+        nonlocal num_calls
+        num_calls += 1
+        return all_guards if num_calls == 1 else sufficient_assumptions(self)
+    monkeypatch.setattr(cp_model.CpSolver, 'SufficientAssumptionsForInfeasibility', all_guards_first)
+    assert generator.diagnose_infeasibility() == ['request CIS-262 in semester 1']
+
+    # Explained without solving: 3 CU of requirements in 2 semesters of 1 CU
+    params.requirement_blocks[0].append(Requirement.base(depts=['MATH']))
+    generator = ScheduleGenerator(sample_courses_info, [], [], params, guard_constraints=True)
+    diagnosis = generator.diagnose_infeasibility()
+    assert diagnosis and 'at least 3 CU' in diagnosis[0]
+
+
+def test_max_double_counted_units_upper_bound():
+    assert max_double_counted_units_upper_bound((), ()) == 0
+    assert max_double_counted_units_upper_bound((4,), ()) == 0
+    assert max_double_counted_units_upper_bound((3, 5), (2,)) == 2
+    assert max_double_counted_units_upper_bound((3, 5), (10,)) == 3
+    # All three blocks can share the same 2 units, saving 2 units each
+    assert max_double_counted_units_upper_bound((2, 2, 2), (2, 2, 2)) == 4
+    assert max_double_counted_units_upper_bound((2, 2, 2), (2, 0, 0)) == 2
+    # Units shared by all three blocks count towards every pair's limit
+    assert max_double_counted_units_upper_bound((5, 5, 5), (5, 5, 1)) == 6
+
+
 # TODO: left to test
 # - multiple requirements per block
 # - more complex prerequisites
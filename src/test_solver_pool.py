@@ -0,0 +1,112 @@
+from collections import defaultdict
+from typing import Sequence
+from catalog import CatalogIndex
+from ortools.sat.python import cp_model
+from cp2_types import CompletedCourse, CourseInfo, CourseRequest, ScheduleParams, Requirement, Student
+import solver
+from solver import ScheduleGenerator, generate_schedule, get_model_skeleton, model_skeleton_cache
+import solver_pool
+from solver_pool import (
+    MAX_WORKERS_PER_SOLVE, SolverPool, default_mp_context, generate_schedules_batch, init_worker, workers_per_solve
+)
+
+
+def test_workers_per_solve():
+    assert workers_per_solve(32, 0) == MAX_WORKERS_PER_SOLVE
+    assert workers_per_solve(4, 0) == 4
+    # Free cores are shared with the waiting solves
+    assert workers_per_solve(16, 3) == 4
+    assert workers_per_solve(2, 10) == 1
+    assert workers_per_solve(0, 0) == 1
+
+
+def test_default_mp_context():
+    # Forking a process that runs other threads can deadlock
+    assert default_mp_context().get_start_method() in ['forkserver', 'spawn']
+
+
+def test_solver_pool(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-262']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    pool = SolverPool(sample_courses_info, num_processes=2, num_cores=2)
+    try:
+        futures = [
+            pool.submit([CourseRequest('CIS-262', sem)], [], params, time_limit=60)
+            for sem in [2, 3, 4]
+        ]
+        for sem, future in zip([2, 3, 4], futures):
+            soln, status = future.result()
+            assert soln and status == cp_model.OPTIMAL
+            schedule, course_id_to_requirement = soln
+            assert 'CIS-262' in schedule[sem]
+            assert set(course_id_to_requirement) == {'CIS-160', 'CIS-262'}
+        assert pool.num_running_jobs == pool.num_cores_in_use == 0
+
+        assert (soln := generate_schedule(sample_courses_info, [], [], params, pool=pool))
+        # Infeasible: CIS-262 needs CIS-160 first
+        assert not generate_schedule(sample_courses_info, [CourseRequest('CIS-262', 1)], [], params, pool=pool)
+    finally:
+        pool.shutdown()
+
+
+def test_generate_schedules_batch(sample_courses_info: Sequence[CourseInfo]):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-262']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    students = [
+        Student([CourseRequest('CIS-262', 4)], []),
+        Student([], [CompletedCourse('CIS-160', 1, [])]),
+        # Infeasible: CIS-262 needs CIS-160 first
+        Student([CourseRequest('CIS-262', 1)], []),
+    ]
+    solns = dict(generate_schedules_batch(sample_courses_info, students, params, time_limit=60))
+    assert set(solns) == {0, 1, 2}
+    assert (soln := solns[0]) and 'CIS-262' in soln[0][4]
+    assert (soln := solns[1]) and soln[0][1] == ['CIS-160']
+    assert solns[2] is None
+
+
+def test_init_worker_loads_skeleton(sample_courses_info: Sequence[CourseInfo], tmp_path, monkeypatch):
+    params = ScheduleParams(
+        num_semesters=4,
+        min_credits_per_semester=0,
+        max_credits_per_semester=2,
+        requirement_blocks=[[
+            Requirement.base(courses=['CIS-160']),
+            Requirement.base(courses=['CIS-262']),
+        ]],
+        max_double_counts=defaultdict(int),
+        cannot_triple_count=set(),
+    )
+    path = str(tmp_path / 'skeleton')
+    skeleton = get_model_skeleton(CatalogIndex(sample_courses_info), params, [], [])
+    skeleton.save(path)
+
+    # A new process has an empty cache, and must load the skeleton instead of building it
+    model_skeleton_cache.clear()
+    def build_model(self):
+        raise AssertionError('The skeleton was built instead of loaded')
+    monkeypatch.setattr(solver.ModelSkeleton, 'build_model', build_model)
+    init_worker(sample_courses_info, params, None, path)
+    generator = ScheduleGenerator(
+        sample_courses_info, [], [], params, catalog_index=solver_pool.worker_catalog_index
+    )
+    assert generator.fingerprint == skeleton.fingerprint
+    assert generator.solve()